@@ -0,0 +1,143 @@
+"""
+Synthetic outputs of the commands run by the dependency collectors, and
+SSH configs, as large as those of big hosts. They are generated from a
+seed, so that they are the same for every run (with the same major
+version of Python).
+
+"""
+import json
+import random
+
+
+WORDS = [
+    'core', 'utils', 'http', 'json', 'xml', 'crypto', 'auth', 'cache',
+    'log', 'test', 'dev', 'data', 'net', 'io', 'async', 'db', 'sql', 'orm',
+    'cli', 'web', 'api', 'client', 'server', 'proto', 'schema', 'config',
+]
+
+
+def make_name(rand, index, separator='-'):
+    return separator.join(rand.sample(WORDS, rand.randint(1, 3))
+                          + [str(index)])
+
+
+def make_version(rand):
+    return '%d.%d.%d' % (rand.randint(0, 9), rand.randint(0, 30),
+                         rand.randint(0, 99))
+
+
+def make_sha(rand):
+    return '%040x' % rand.getrandbits(160)
+
+
+def pip_freeze(lines=10000, editables=0.05, seed=0):
+    """Return `pip freeze' output, with a share of ``editables``."""
+    rand = random.Random(seed)
+    output = ['# Editable install with no version control (local==1.0)']
+    for i in range(lines - 1):
+        name = make_name(rand, i)
+        if rand.random() >= editables:
+            output.append('%s==%s' % (name, make_version(rand)))
+            continue
+        sha = make_sha(rand)
+        output.append(rand.choice([
+            '-e git+https://github.com/org/{name}.git@{sha}#egg={name}-dev',
+            '-e git+git@github.com:org/{name}.git@{sha}#egg={name}-dev',
+            '-e hg+https://hg.example.com/{name}/@{short}#egg={name}-dev',
+            '-e svn+https://svn.example.com/{name}/trunk@{rev}#egg={name}',
+            '-e bzr+https://bzr.example.com/{name}/trunk/@{rev}'
+            '#egg={name}-dev',
+        ]).format(name=name, sha=sha, short=sha[:12],
+                  rev=rand.randint(1, 99999)))
+    return '\n'.join(output) + '\n'
+
+
+def dpkg_query(lines=30000, seed=0):
+    """Return `dpkg-query --show' output."""
+    rand = random.Random(seed)
+    output = []
+    for i in range(lines):
+        name = make_name(rand, i)
+        if rand.random() < 0.2:
+            name = 'lib%s:%s' % (name, rand.choice(['amd64', 'i386']))
+        version = '%s%s-%dubuntu%d.%d' % (
+            rand.choice(['', '', '', '1:', '2:']), make_version(rand),
+            rand.randint(1, 5), rand.randint(1, 9), rand.randint(0, 9))
+        output.append('%s %s' % (name, version))
+    return '\n'.join(output) + '\n'
+
+
+def rpm_query(lines=30000, seed=0):
+    """Return `rpm --query --all' output."""
+    rand = random.Random(seed)
+    return ''.join(
+        '%s %s-%d.fc%d\n' % (make_name(rand, i), make_version(rand),
+                             rand.randint(1, 9), rand.randint(17, 39))
+        for i in range(lines)
+    )
+
+
+def npm_list_json(size=50 * 1024 * 1024, seed=0):
+    """
+    Return about ``size`` bytes of `npm --json list' output, with deeply
+    nested dependencies, of which only the top-level ones are collected.
+
+    """
+    rand = random.Random(seed)
+
+    def make_tree(depth):
+        tree = {}
+        for _ in range(rand.randint(0, 6) if depth else 0):
+            name = make_name(rand, rand.randint(0, 9999))
+            version = make_version(rand)
+            tree[name] = {
+                'version': version,
+                'from': '%s@^%s' % (name, version),
+                'resolved': 'https://registry.npmjs.org/%s/-/%s-%s.tgz'
+                            % (name, name, version),
+            }
+            dependencies = make_tree(depth - 1)
+            if dependencies:
+                tree[name]['dependencies'] = dependencies
+        return tree
+
+    entries = []
+    total = 0
+    while total < size:
+        name = make_name(rand, len(entries))
+        entry = '%s: %s' % (json.dumps(name), json.dumps({
+            'version': make_version(rand),
+            'from': name,
+            'dependencies': make_tree(depth=4),
+        }, indent=2, sort_keys=True))
+        entries.append(entry)
+        total += len(entry)
+    return '{"name": "app", "dependencies": {\n%s\n}}\n' % ',\n'.join(entries)
+
+
+def ssh_config(entries=5000, seed=0):
+    """
+    Return ``(config, urls)``: an SSH config with host aliases, and Git
+    remote URLs using some of them.
+
+    """
+    rand = random.Random(seed)
+    config = ['Host *', '    ServerAliveInterval 60', '']
+    urls = []
+    for i in range(entries):
+        alias = 'alias-%d' % i
+        config.extend([
+            'Host %s %s.internal' % (alias, alias),
+            '    HostName git-%d.example.com' % i,
+            '    User git',
+            '    Port %d' % rand.choice([22, 2222]),
+            '    IdentityFile ~/.ssh/id_%d' % i,
+            '',
+        ])
+        if rand.random() < 0.02:
+            urls.append(rand.choice([
+                'git@{alias}:org/repo-{i}.git',
+                'ssh://git@{alias}/org/repo-{i}.git',
+                'https://{alias}/org/repo-{i}.git',
+            ]).format(alias=alias, i=i))
+    return '\n'.join(config), urls
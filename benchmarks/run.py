@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+"""
+Benchmarks of dependency collection, serialization and the client, with
+large synthetic data (see ``fixtures.py``).
+
+The time of each benchmark is the best of --repeat runs, each calling it
+for at least --min-time seconds, and its memory peak (Python 3.4+) is
+what it allocates on top of what already was allocated, measured by
+``tracemalloc`` in another call.
+
+The results are compared against ``baseline.json``, and a time or a
+memory peak exceeding the baseline by more than --time-threshold or
+--memory-threshold is a regression, which makes the exit status 1. The
+baseline is only valid for the machine, Python version and --scale it
+was recorded with, so record it again with --save-baseline when any of
+them changes:
+
+    $ python benchmarks/run.py
+    $ python benchmarks/run.py --only parse_ --scale 0.1 --no-compare
+    $ python benchmarks/run.py --save-baseline
+
+"""
+from __future__ import print_function
+import gc
+import os
+import sys
+import time
+import json
+import logging
+import argparse
+import platform
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(BENCHMARKS_DIR),
+                os.path.join(os.path.dirname(BENCHMARKS_DIR), 'tests')]
+
+import fixtures
+from opbeatcli.log import logger
+from opbeatcli.client import OpbeatClient, encode_json
+from opbeatcli.deployment import serialize
+from opbeatcli.deployment.cache import CollectionCache
+from opbeatcli.deployment.packages.deb import DebCollector
+from opbeatcli.deployment.packages.nodejs import NodeCollector
+from opbeatcli.deployment.packages.python import PythonCollector
+from opbeatcli.deployment.packages.rpm import RPMCollector
+from opbeatcli.deployment.vcs import expand_ssh_host_alias
+from opbeatcli.utils.ssh_config import SSHConfig
+from standin_server import StandInServer
+
+try:
+    import tracemalloc
+except ImportError:  # Python < 3.4
+    tracemalloc = None
+
+
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+
+EXIT_SUCCESS, EXIT_REGRESSION = 0, 1
+
+
+class Benchmarks(object):
+    """
+    The fixtures scaled by ``scale``, and ``setup_<name>()`` methods
+    returning the function to be measured for each benchmark.
+
+    """
+
+    NAMES = [
+        'parse_pip_freeze',
+        'parse_dpkg',
+        'parse_rpm',
+        'parse_npm',
+        'load_cached_packages',
+        'parse_ssh_config',
+        'expand_ssh_host_aliases',
+        'serialize',
+        'encode_json',
+        'post',
+        'post_compressed',
+    ]
+
+    def __init__(self, scale=1.0):
+        self.scale = scale
+        self.outputs = {
+            PythonCollector: fixtures.pip_freeze(lines=self.scaled(10000)),
+            DebCollector: fixtures.dpkg_query(lines=self.scaled(30000)),
+            RPMCollector: fixtures.rpm_query(lines=self.scaled(30000)),
+            NodeCollector: fixtures.npm_list_json(
+                size=self.scaled(50 * 1024 * 1024)),
+        }
+        self.ssh_config, self.urls = fixtures.ssh_config(
+            entries=self.scaled(5000))
+        self._server = None
+
+    def scaled(self, size):
+        return max(1, int(size * self.scale))
+
+    def close(self):
+        if self._server is not None:
+            self._server.__exit__(None, None, None)
+
+    @property
+    def packages(self):
+        if not hasattr(self, '_packages'):
+            self._packages = [
+                package
+                for collector_class, output in self.outputs.items()
+                for package in collector_class().parse(output)
+            ]
+        return self._packages
+
+    @property
+    def data(self):
+        if not hasattr(self, '_data'):
+            self._data = serialize.deployment('localhost', self.packages)
+        return self._data
+
+    @property
+    def server(self):
+        if self._server is None:
+            self._server = StandInServer().__enter__()
+        return self._server
+
+    def setup_parse(self, collector_class):
+        collector = collector_class()
+        output = self.outputs[collector_class]
+        return lambda: list(collector.parse(output))
+
+    def setup_parse_pip_freeze(self):
+        return self.setup_parse(PythonCollector)
+
+    def setup_parse_dpkg(self):
+        return self.setup_parse(DebCollector)
+
+    def setup_parse_rpm(self):
+        return self.setup_parse(RPMCollector)
+
+    def setup_parse_npm(self):
+        return self.setup_parse(NodeCollector)
+
+    def setup_load_cached_packages(self):
+        # The memory peak is mostly the loaded packages themselves.
+        items = [CollectionCache.dump_dependency(package)
+                 for package in self.packages]
+        load = CollectionCache.load_dependency
+        return lambda: [load(item) for item in items]
+
+    def setup_parse_ssh_config(self):
+        lines = self.ssh_config.splitlines(True)
+        return lambda: SSHConfig().parse(lines)
+
+    def setup_expand_ssh_host_aliases(self):
+        config = SSHConfig()
+        config.parse(self.ssh_config.splitlines(True))
+        return lambda: [expand_ssh_host_alias(url, config)
+                        for url in self.urls]
+
+    def setup_serialize(self):
+        packages = self.packages
+        return lambda: serialize.deployment('localhost', packages)
+
+    def setup_encode_json(self):
+        data = self.data
+        return lambda: encode_json(data)
+
+    def setup_post(self, compress=False):
+        client = OpbeatClient(secret_token='token', organization_id='org',
+                              app_id='app', server=self.server.url,
+                              compress=compress, retries=0)
+        data = self.data
+
+        def post():
+            client.post('/api/v1/organizations/{organization_id}/apps'
+                        '/{app_id}/deployments/', data)
+            # Not to keep all the bodies in memory.
+            del self.server.requests[:]
+        return post
+
+    def setup_post_compressed(self):
+        return self.setup_post(compress=True)
+
+
+def time_calls(func, min_time):
+    """
+    Return the time per call of ``func``, called repeatedly for at least
+    ``min_time`` seconds, so that short benchmarks are timed reliably.
+
+    """
+    gc.collect()
+    calls = 0
+    started = time.time()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.time() - started
+        if elapsed >= min_time:
+            return elapsed / calls
+
+
+def measure(func, repeat, min_time):
+    """Return ``(best_time, memory_peak)`` of calls of ``func``."""
+    best_time = min(time_calls(func, min_time) for _ in range(repeat))
+
+    memory_peak = None
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            func()
+            memory_peak = tracemalloc.get_traced_memory()[1] - start
+        finally:
+            tracemalloc.stop()
+
+    return best_time, memory_peak
+
+
+def compare(results, baseline, time_threshold, memory_threshold):
+    """
+    Return ``{name: [regression, ...]}`` of the ``results`` of benchmarks
+    slower or using more memory than in ``baseline`` by more than the
+    thresholds (e.g., ``0.25`` for 25%).
+
+    """
+    regressions = {}
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        found = []
+        if result['time'] > base['time'] * (1 + time_threshold):
+            found.append('time')
+        if (result['memory_peak'] is not None
+                and base.get('memory_peak') is not None
+                and result['memory_peak']
+                > base['memory_peak'] * (1 + memory_threshold)):
+            found.append('memory')
+        if found:
+            regressions[name] = found
+    return regressions
+
+
+def format_change(value, base):
+    if value is None or not base:
+        return ''
+    return '%+.0f%%' % ((value - base) * 100.0 / base)
+
+
+def format_size(size):
+    if size is None:
+        return '-'
+    return '%.1f MiB' % (size / 1024.0 / 1024)
+
+
+def print_results(results, baseline, regressions):
+    print('%-25s %9s %7s %11s %7s' % (
+        'benchmark', 'time', 'change', 'memory', 'change'))
+    for name in Benchmarks.NAMES:
+        if name not in results:
+            continue
+        result, base = results[name], baseline.get(name, {})
+        print(('%-25s %8.3fs %7s %11s %7s  %s' % (
+            name,
+            result['time'],
+            format_change(result['time'], base.get('time')),
+            format_size(result['memory_peak']),
+            format_change(result['memory_peak'], base.get('memory_peak')),
+            ', '.join(regressions.get(name, [])),
+        )).rstrip())
+
+
+def get_environment(args):
+    return {
+        'scale': args.scale,
+        'python': platform.python_version(),
+    }
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Scale the size of the fixtures (default: 1).')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs of each benchmark (default: 3).')
+    parser.add_argument('--min-time', type=float, default=0.5,
+                        help='The minimum duration of a run, in seconds'
+                             ' (default: 0.5).')
+    parser.add_argument('--only', metavar='PREFIX',
+                        help='Only run benchmarks starting with PREFIX.')
+    parser.add_argument('--baseline', metavar='FILE', default=BASELINE_PATH,
+                        help='The baseline (default: benchmarks/'
+                             'baseline.json).')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Save the results as the baseline.')
+    parser.add_argument('--no-compare', action='store_true',
+                        help="Don't compare against the baseline.")
+    parser.add_argument('--time-threshold', type=float, default=0.25,
+                        help='Allowed slowdown (default: 0.25, i.e., 25%%).')
+    parser.add_argument('--memory-threshold', type=float, default=0.1,
+                        help='Allowed memory growth (default: 0.1).')
+    return parser
+
+
+def main(argv=sys.argv[1:]):
+    args = get_parser().parse_args(argv)
+    logger.setLevel(logging.WARNING)
+
+    baseline = {}
+    if not (args.no_compare or args.save_baseline):
+        try:
+            with open(args.baseline) as f:
+                saved = json.load(f)
+        except (IOError, ValueError) as e:
+            print('No baseline to compare against: %s' % e, file=sys.stderr)
+        else:
+            if saved['environment'] != get_environment(args):
+                print('The baseline is of another environment (%r), not'
+                      ' comparing' % saved['environment'], file=sys.stderr)
+            else:
+                baseline = saved['benchmarks']
+
+    names = [name for name in Benchmarks.NAMES
+             if name.startswith(args.only or '')]
+    benchmarks = Benchmarks(scale=args.scale)
+    results = {}
+    try:
+        for name in names:
+            func = getattr(benchmarks, 'setup_' + name)()
+            best_time, memory_peak = measure(func, args.repeat,
+                                             args.min_time)
+            results[name] = {'time': best_time, 'memory_peak': memory_peak}
+    finally:
+        benchmarks.close()
+
+    regressions = compare(results, baseline, args.time_threshold,
+                          args.memory_threshold)
+    print_results(results, baseline, regressions)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'environment': get_environment(args),
+                'benchmarks': results,
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Saved the baseline to %s' % args.baseline)
+
+    if regressions:
+        return EXIT_REGRESSION
+    return EXIT_SUCCESS
+
+
+if __name__ == '__main__':
+    sys.exit(main())
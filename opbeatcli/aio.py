@@ -0,0 +1,316 @@
+"""
+An asyncio Opbeat client for applications that embed opbeatcli and run
+an event loop, e.g., deployment orchestrators. Requires Python 3.5+.
+
+    client = AsyncOpbeatClient(secret_token, organization_id, app_id)
+    try:
+        await client.post_many(settings.DEPLOYMENT_API_URI, [
+            (data, {'app_id': app_id}) for app_id, data in deployments
+        ])
+    finally:
+        await client.close()
+
+"""
+import asyncio
+import ssl
+
+from opbeatcli import settings
+from opbeatcli.client import BaseOpbeatClient
+from opbeatcli.compat import urlsplit
+from opbeatcli.connection import Response
+from opbeatcli.exceptions import ClientConnectionError
+
+
+DEFAULT_PORTS = {
+    'http': 80,
+    'https': 443,
+}
+
+# Errors of a reused connection that mean that the server has closed it
+# while it was idle, before it got our request.
+STALE_CONNECTION_ERRORS = (
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+    asyncio.IncompleteReadError,
+)
+
+# Errors of a connection, or of a malformed response (e.g., a line
+# exceeding the stream limit, or an invalid status or length).
+CONNECTION_ERRORS = (
+    OSError,
+    asyncio.IncompleteReadError,
+    asyncio.LimitOverrunError,
+    ValueError,
+)
+
+# The statuses of responses that never have a body.
+NO_BODY_STATUSES = (204, 304)
+
+# ``asyncio.get_running_loop()`` is only available on Python 3.7+.
+get_running_loop = getattr(asyncio, 'get_running_loop',
+                           asyncio.get_event_loop)
+
+
+class AsyncConnection(object):
+    """A persistent HTTP/1.1 connection."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, scheme, host, port):
+        ssl_context = None
+        if scheme == 'https':
+            ssl_context = ssl.create_default_context()
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=ssl_context)
+        return cls(reader, writer)
+
+    async def request(self, method, host, path, body, headers):
+        """Return ``(response, will_close)``."""
+        lines = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % host,
+                 'Content-Length: %d' % len(body)]
+        lines.extend('%s: %s' % header for header in headers.items())
+        self.writer.write(
+            ('\r\n'.join(lines) + '\r\n\r\n').encode('latin1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readuntil(b'\r\n')
+        version, status, reason = (
+            status_line.decode('latin1').rstrip('\r\n') + ' ').split(' ', 2)
+
+        response_headers = {}
+        while True:
+            line = (await self.reader.readuntil(b'\r\n')).decode('latin1')
+            if line == '\r\n':
+                break
+            name, _, value = line.partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        will_close = (response_headers.get('connection', '').lower()
+                      == 'close' or version == 'HTTP/1.0')
+        status = int(status)
+        if status in NO_BODY_STATUSES:
+            response_body = b''
+        elif response_headers.get('transfer-encoding') == 'chunked':
+            response_body = await self.read_chunked()
+        elif 'content-length' in response_headers:
+            length = int(response_headers['content-length'])
+            response_body = await self.reader.readexactly(length)
+        else:
+            # The body ends when the server closes the connection.
+            response_body = await self.reader.read()
+            will_close = True
+        response = Response(
+            status=status,
+            reason=reason.strip(),
+            headers=response_headers,
+            body=response_body,
+        )
+        return response, will_close
+
+    async def read_chunked(self):
+        chunks = []
+        while True:
+            size_line = await self.reader.readuntil(b'\r\n')
+            size = int(size_line.split(b';')[0], 16)
+            chunk = await self.reader.readexactly(size + 2)
+            if not size:
+                return b''.join(chunks)
+            chunks.append(chunk[:-2])
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncConnectionPool(object):
+    """
+    The asyncio counterpart of ``opbeatcli.connection.ConnectionPool``.
+
+    """
+
+    def __init__(self, url, timeout=settings.TIMEOUT,
+                 maxsize=settings.HTTP_POOL_SIZE):
+        scheme, netloc, path, _, _ = urlsplit(url)
+        if scheme not in DEFAULT_PORTS:
+            raise ValueError('unsupported server URL: %r' % url)
+        self.scheme = scheme
+        self.netloc = netloc
+        host, _, port = netloc.rpartition(':')
+        if not host or ']' in port:  # No port, or an IPv6 address.
+            host, port = netloc, DEFAULT_PORTS[scheme]
+        self.host, self.port = host.strip('[]'), int(port)
+        self.base_path = path.rstrip('/')
+        self.timeout = timeout
+        self.maxsize = maxsize
+
+        # The number of connections opened, for logging and tests.
+        self.connections_opened = 0
+
+        self._idle = []
+
+    async def new_connection(self):
+        self.connections_opened += 1
+        return await AsyncConnection.open(self.scheme, self.host, self.port)
+
+    async def request(self, method, uri, body=b'', headers=None):
+        """
+        Make a request and return the ``Response``.
+
+        :raises: ``asyncio.TimeoutError``, or one of
+                 ``CONNECTION_ERRORS`` on connection errors.
+
+        """
+        return await asyncio.wait_for(
+            self._request(method, self.base_path + uri, body, headers or {}),
+            self.timeout
+        )
+
+    async def _request(self, method, path, body, headers):
+        if self._idle:
+            connection, reused = self._idle.pop(), True
+        else:
+            connection, reused = await self.new_connection(), False
+        while True:
+            try:
+                response, will_close = await connection.request(
+                    method, self.netloc, path, body, headers)
+            except STALE_CONNECTION_ERRORS:
+                connection.close()
+                if reused:
+                    connection, reused = await self.new_connection(), False
+                    continue
+                raise
+            except BaseException:
+                # Including cancellation on timeout.
+                connection.close()
+                raise
+            break
+
+        if will_close or len(self._idle) >= self.maxsize:
+            connection.close()
+        else:
+            self._idle.append(connection)
+        return response
+
+    def close(self):
+        """Close all idle connections."""
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+class AsyncOpbeatClient(BaseOpbeatClient):
+    """
+    An asyncio Opbeat client. It has the same URI templating,
+    headers, compression, and errors as ``opbeatcli.client.OpbeatClient``.
+
+    The blocking parts of a request, i.e., encoding and compressing the
+    data, which takes a while for large deployments, and reading and
+    writing the circuit breaker state, are run in the loop's default
+    executor, so that they don't block other coroutines.
+
+    """
+    def __init__(self, secret_token, organization_id, app_id,
+                 server=settings.SERVER, timeout=settings.TIMEOUT,
+                 dry_run=False, pool_size=settings.HTTP_POOL_SIZE,
+                 compress=False, retries=settings.RETRIES,
+                 retry_backoff=settings.RETRY_BACKOFF, circuit_breaker=None):
+        super(AsyncOpbeatClient, self).__init__(
+            secret_token=secret_token,
+            organization_id=organization_id,
+            app_id=app_id,
+            server=server,
+            timeout=timeout,
+            dry_run=dry_run,
+            compress=compress,
+            retries=retries,
+            retry_backoff=retry_backoff,
+            circuit_breaker=circuit_breaker,
+        )
+        self.pool = AsyncConnectionPool(server, timeout=timeout,
+                                        maxsize=pool_size)
+
+    async def post(self, uri, data, idempotency_key=None, **uri_params):
+        """
+        HTTP POST ``data`` as JSON to collection identified by ``uri``.
+        See ``OpbeatClient.post()``.
+
+        """
+        uri, headers, body, uncompressed = await self.run_blocking(
+            self.prepare_request, uri, data, uri_params, idempotency_key)
+
+        if self.dry_run:
+            self.logger.info('Not sending because --dry-run.')
+            return
+
+        await self.run_blocking(self.check_circuit_breaker)
+        retry = 0
+        while True:
+            try:
+                response, error = await self.send(uri, body, headers), None
+                if self.is_compression_rejected(response, headers):
+                    body = uncompressed
+                    response = await self.send(uri, body, headers)
+            except ClientConnectionError as e:
+                response, error = None, e
+            delay = self.get_retry_delay(retry, response)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+            retry += 1
+
+        await self.run_blocking(self.finish, response, error)
+
+    async def run_blocking(self, func, *args):
+        """Return ``func(*args)``, called in the default executor."""
+        return await get_running_loop().run_in_executor(None, func, *args)
+
+    async def post_many(self, uri, items, concurrency=settings.HTTP_POOL_SIZE,
+                        return_exceptions=False):
+        """
+        POST each of ``items``, which are ``(data, uri_params)`` pairs
+        (see ``post()``), with up to ``concurrency`` requests at a time.
+
+        All the items are posted even if some fail. Then the error of the
+        first failed item (in ``items`` order) is raised, or, with
+        ``return_exceptions``, a list with ``None`` for each posted item
+        and the error for each failed one is returned.
+
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def post(data, uri_params):
+            async with semaphore:
+                return await self.post(uri, data, **uri_params)
+
+        results = await asyncio.gather(
+            *[post(data, uri_params) for data, uri_params in items],
+            return_exceptions=True
+        )
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+        return results
+
+    async def send(self, uri, body, headers):
+        """
+        POST ``body`` and return the response.
+
+        :raises: ClientConnectionError
+
+        """
+        try:
+            return await self.pool.request('POST', uri, body=body,
+                                           headers=headers)
+        except asyncio.TimeoutError as e:
+            raise self.connection_error(e, timed_out=True)
+        except CONNECTION_ERRORS as e:
+            raise self.connection_error(e)
+
+    async def close(self):
+        """Close the idle connections to the server."""
+        self.pool.close()
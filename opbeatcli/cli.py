@@ -37,6 +37,10 @@ class OpbeatHelpFormatter(argparse.RawDescriptionHelpFormatter):
         kwargs['max_help_position'] = max_help_position
         super(OpbeatHelpFormatter, self).__init__(*args, **kwargs)
 
+    def _get_help_string(self, action):
+        # Builds ``LazyHelp``.
+        return str(action.help)
+
     def _split_lines(self, text, width):
         text = dedent(text).strip() + '\n\n'
         return text.splitlines()
@@ -95,10 +99,10 @@ def get_parser():
     common.add_argument(
         '-a', '--app-id',
         dest='app_id',
-        required=ENV.APP_ID not in os.environ,
         default=os.environ.get(ENV.APP_ID),
         help="""
         Can be also set with environment variable ${env_var_name}.
+        Required, unless the command says otherwise.
 
         """
         .format(
@@ -143,6 +147,68 @@ def get_parser():
         default=settings.TIMEOUT,
         help='Time for the connection phase of HTTP requests.',
     )
+    common.add_argument(
+        '--retries',
+        metavar='N',
+        dest='retries',
+        type=int,
+        default=settings.RETRIES,
+        help="""
+        Retry failed requests up to N times (default: {default}), waiting
+        longer and longer between the attempts.
+
+        """.format(default=settings.RETRIES),
+    )
+    common.add_argument(
+        '--compress',
+        action='store_true',
+        dest='compress',
+        help="""
+        Send gzip-compressed data, which is much smaller for large
+        deployments. If the server does not accept it, the data is sent
+        uncompressed.
+
+        """,
+    )
+
+    common.add_argument(
+        '--profile',
+        action='store_true',
+        dest='profile',
+        help="""
+        Print the wall time, CPU time, CPU time of child processes, and
+        peak memory (Python 3.9+) of each phase of the command, e.g.,
+        of each dependency collector command, the longest first.
+
+        """,
+    )
+    common.add_argument(
+        '--profile-json',
+        metavar='FILE',
+        dest='profile_json',
+        help='Write the --profile measurements to FILE as JSON.',
+    )
+    common.add_argument(
+        '--profile-stats',
+        metavar='FILE',
+        dest='profile_stats',
+        help="""
+        Write cProfile stats of the main thread to FILE, to be read with
+        the `pstats' module. Implies --profile.
+
+        """,
+    )
+    common.add_argument(
+        '--trace',
+        metavar='FILE',
+        dest='trace',
+        help="""
+        Write a timeline of the phases of the command in each thread to
+        FILE, in the Chrome trace event format, to be viewed with e.g.
+        chrome://tracing or https://ui.perfetto.dev.
+
+        """,
+    )
 
     ### Add command sub-parsers.
 
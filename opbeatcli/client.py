@@ -3,29 +3,91 @@ Opbeat log API client.
 
 """
 import json
+import time
+import uuid
+import zlib
+import socket
 import logging
+import threading
 
 from opbeatcli import __version__
 from opbeatcli.log import logger
-from opbeatcli import settings
+from opbeatcli import settings, profiling
+from opbeatcli.connection import (ConnectionPool, HTTPException,
+                                  is_timeout_error)
+from opbeatcli.retry import RetryPolicy, RETRY_STATUSES
 from opbeatcli.exceptions import ClientConnectionError, ClientHTTPError
-from opbeatcli.compat import (Request, urlopen, URLError,
-                              HTTPError, BaseHTTPRequestHandler)
 
 
-HTTP_RESPONSE_CODES = BaseHTTPRequestHandler.responses
+# Compact separators; the default ones pad the body with whitespace.
+JSON_SEPARATORS = (',', ':')
 
+GZIP_LEVEL = 6
 
-class OpbeatClient(object):
+# The response status of servers not accepting compressed request bodies.
+HTTP_UNSUPPORTED_MEDIA_TYPE = 415
+
+# The size of chunks of streamed request bodies.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def encode_json(data):
+    """Return ``data`` encoded as compact JSON bytes."""
+    return json.dumps(data, separators=JSON_SEPARATORS,
+                      sort_keys=True).encode('utf8')
+
+
+def gzip_compress(body):
+    # ``gzip.compress()`` is only available on Python 3.2+.
+    return b''.join(gzip_compress_chunks([body]))
+
+
+def gzip_compress_chunks(chunks):
+    """Yield gzip-compressed ``chunks`` of bytes."""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def join_fragments(fragments, size=STREAM_CHUNK_SIZE):
     """
-    The Opbeat client, which handles communication with the
-    Opbeat servers.
+    Encode text ``fragments`` and yield them joined into chunks of bytes
+    of about ``size``, to be sent with chunked transfer encoding.
+
+    """
+    buffered, buffered_size = [], 0
+    for fragment in fragments:
+        fragment = fragment.encode('utf8')
+        buffered.append(fragment)
+        buffered_size += len(fragment)
+        if buffered_size >= size:
+            yield b''.join(buffered)
+            buffered, buffered_size = [], 0
+    if buffered:
+        yield b''.join(buffered)
+
+
+class BaseOpbeatClient(object):
+    """
+    What the Opbeat clients have in common regardless of how they
+    send requests: configuration, building requests, and handling
+    responses and errors.
 
     """
     def __init__(self, secret_token, organization_id, app_id,
                  server=settings.SERVER, timeout=settings.TIMEOUT,
-                 dry_run=False):
+                 dry_run=False, compress=False, retries=settings.RETRIES,
+                 retry_backoff=settings.RETRY_BACKOFF, circuit_breaker=None):
+        """
+        :param retries: how many times failed requests are retried
+        :param retry_backoff: the initial backoff of retries in seconds
+        :param circuit_breaker: an ``opbeatcli.retry.CircuitBreaker``
 
+        """
         self.server = server
         self.secret_token = secret_token
         self.organization_id = organization_id
@@ -33,6 +95,12 @@ class OpbeatClient(object):
 
         self.timeout = timeout
         self.dry_run = dry_run
+        self.compress = compress
+        # Guards turning off ``compress`` when requests run concurrently.
+        self._compress_lock = threading.Lock()
+        self.retry_policy = RetryPolicy(retries=retries,
+                                        backoff=retry_backoff)
+        self.circuit_breaker = circuit_breaker
 
         self.logger = logger.getChild('client')
 
@@ -49,21 +117,170 @@ class OpbeatClient(object):
 
     def log_response(self, response, level=logging.DEBUG):
         """
-        :type response: HTTPResponse
+        :type response: opbeatcli.connection.Response
         """
         self.logger.log(level, '< HTTP %d %s',
-                        response.code,
-                        HTTP_RESPONSE_CODES[response.code][0])
+                        response.status,
+                        response.reason)
+
+        if response.body:
+            self.logger.log(level, '< %s', response.body)
+
+    def prepare_request(self, uri, data, uri_params, idempotency_key=None):
+        """
+        Return ``(uri, headers, body, uncompressed_body)`` of a POST of
+        ``data`` to ``uri``. See ``OpbeatClient.post()``.
+
+        """
+        uri = self.format_uri(uri, uri_params)
+        headers = self.get_headers(idempotency_key)
+        with profiling.phase('encode'):
+            body = uncompressed = encode_json(data)
+            if self.compress:
+                headers['Content-Encoding'] = 'gzip'
+                body = gzip_compress(uncompressed)
+                self.logger.debug('Compressed %d bytes to %d bytes',
+                                  len(uncompressed), len(body))
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            # Pretty-printed only for humans.
+            self.log_request(uri, headers,
+                             json.dumps(data, indent=2, sort_keys=True))
+
+        return uri, headers, body, uncompressed
+
+    def format_uri(self, uri, uri_params):
+        params = dict(
+            organization_id=self.organization_id,
+            app_id=self.app_id
+        )
+        params.update(uri_params)
+        return uri.format(**params)
+
+    def get_headers(self, idempotency_key=None):
+        return {
+            'User-Agent': 'opbeatcli/%s' % __version__,
+            'Authorization': 'Bearer %s' % self.secret_token,
+            'Content-Type': 'application/json',
+            # The same for all the attempts, so that the server can tell
+            # a retry from a new deployment.
+            'Idempotency-Key': idempotency_key or uuid.uuid4().hex,
+        }
+
+    def is_compression_rejected(self, response, headers):
+        """
+        Return ``True`` if the server has rejected the compressed body,
+        which then has to be sent uncompressed with ``headers``.
+
+        """
+        if (response.status == HTTP_UNSUPPORTED_MEDIA_TYPE
+                and 'Content-Encoding' in headers):
+            del headers['Content-Encoding']
+            with self._compress_lock:
+                # Other requests may have found out at the same time.
+                if self.compress:
+                    self.logger.info('The server does not accept compressed'
+                                     ' data, sending it uncompressed.')
+                    self.compress = False
+            return True
+        return False
+
+    def check_circuit_breaker(self):
+        """:raises: CircuitBreakerOpenError"""
+        if self.circuit_breaker:
+            try:
+                self.circuit_breaker.check()
+            except ClientConnectionError as e:
+                self.logger.error('Unable to reach the API server: %s', e)
+                raise
+
+    def get_retry_delay(self, retry, response):
+        """
+        Return the seconds to wait before retrying a request that has
+        failed with ``response`` (``None`` on connection errors), or
+        ``None`` if it should not be retried.
+
+        """
+        delay = self.retry_policy.get_delay(retry, response)
+        if delay is not None:
+            if response is not None:
+                self.log_response(response, level=logging.WARNING)
+            self.logger.warning('Retrying in %.1fs (retry %d of %d)',
+                                delay, retry + 1, self.retry_policy.retries)
+        return delay
+
+    def finish(self, response, error):
+        """
+        Record the outcome of a request in the circuit breaker, and raise
+        its error, if any.
 
-        body = response.read()
+        :raises: ClientConnectionError or ClientHTTPError
 
-        if body:
-            self.logger.log(level, '< %s', body)
+        """
+        if self.circuit_breaker:
+            if error or response.status in RETRY_STATUSES:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+        if error:
+            raise error
+        self.check_response(response)
+
+    def check_response(self, response):
+        """:raises: ClientHTTPError if the request has failed."""
+        if response.status >= 400:
+            self.logger.error('< The server could not fulfill the request')
+            self.log_response(response, level=logging.ERROR)
+
+            raise ClientHTTPError(response.status)
+
+        self.log_response(response, level=logging.DEBUG)
 
-    def post(self, uri, data):
+    def connection_error(self, error, timed_out=False):
+        """Log and return a ``ClientConnectionError`` for ``error``."""
+        if timed_out:
+            error_msg = 'request timed out (--timeout=%.2f)' % self.timeout
+        else:
+            error_msg = (getattr(error, 'strerror', None)
+                         or str(error) or repr(error))
+        self.logger.error('Unable to reach the API server: %s', error_msg)
+        self.logger.debug('Connection error', exc_info=True)
+
+        return ClientConnectionError(error_msg)
+
+
+class OpbeatClient(BaseOpbeatClient):
+    """
+    The Opbeat client, which handles communication with the
+    Opbeat servers.
+
+    """
+    def __init__(self, secret_token, organization_id, app_id,
+                 server=settings.SERVER, timeout=settings.TIMEOUT,
+                 dry_run=False, pool_size=settings.HTTP_POOL_SIZE,
+                 compress=False, retries=settings.RETRIES,
+                 retry_backoff=settings.RETRY_BACKOFF, circuit_breaker=None):
+        super(OpbeatClient, self).__init__(
+            secret_token=secret_token,
+            organization_id=organization_id,
+            app_id=app_id,
+            server=server,
+            timeout=timeout,
+            dry_run=dry_run,
+            compress=compress,
+            retries=retries,
+            retry_backoff=retry_backoff,
+            circuit_breaker=circuit_breaker,
+        )
+        self.pool = ConnectionPool(server, timeout=timeout,
+                                   maxsize=pool_size)
+
+    def post(self, uri, data, idempotency_key=None, **uri_params):
         """
         HTTP POST ``data`` as JSON to collection identified by ``uri``.
 
+        Failed requests are retried (see ``opbeatcli.retry``).
+
         :param uri:
             The collection URI. It can be in the form of a URI template
             with the variables {organization_id} and {app_id}, e.g.:
@@ -73,59 +290,92 @@ class OpbeatClient(object):
         :param data: the data to be send
         :type data: dict
 
+        :param idempotency_key:
+            Identifies the request, so that the server does not
+            register the same data twice. Random by default.
+
+        :param uri_params:
+            Override the URI template variables, e.g., ``app_id``
+            to post to a different app than the client's one.
+
         """
-        uri = uri.format(
-            organization_id=self.organization_id,
-            app_id=self.app_id
-        )
-        url = self.server + uri
+        with profiling.phase('post'):
+            uri, headers, body, uncompressed = self.prepare_request(
+                uri, data, uri_params, idempotency_key)
 
-        headers = {
-            'User-Agent': 'opbeatcli/%s' % __version__,
-            'Authorization': 'Bearer %s' % self.secret_token,
-            'Content-Type': 'application/json',
-        }
-        payload = json.dumps(data, indent=2, sort_keys=True)
-        request = Request(
-            url=url,
-            headers=headers,
-            data=payload.encode('utf8')
-        )
+            if self.dry_run:
+                self.logger.info('Not sending because --dry-run.')
+                return
+
+            self.check_circuit_breaker()
+            retry = 0
+            while True:
+                try:
+                    response, error = self.send(uri, body, headers), None
+                    if self.is_compression_rejected(response, headers):
+                        body = uncompressed
+                        response = self.send(uri, body, headers)
+                except ClientConnectionError as e:
+                    response, error = None, e
+                delay = self.get_retry_delay(retry, response)
+                if delay is None:
+                    break
+                time.sleep(delay)
+                retry += 1
+
+            self.finish(response, error)
 
-        self.log_request(uri, headers, payload)
+    def post_stream(self, uri, fragments, idempotency_key=None,
+                    chunk_size=STREAM_CHUNK_SIZE, **uri_params):
+        """
+        Like ``post()``, but the JSON data is given as an iterable of text
+        ``fragments``, which are sent with chunked transfer encoding as
+        they are produced, so that the data never has to be in memory at
+        once, and the upload starts right away.
+
+        Since the data cannot be produced again, a failed request is not
+        retried, and is not resent uncompressed if the server does not
+        accept --compress.
+
+        """
+        uri = self.format_uri(uri, uri_params)
+        headers = self.get_headers(idempotency_key)
+        chunks = join_fragments(fragments, chunk_size)
+        if self.compress:
+            headers['Content-Encoding'] = 'gzip'
+            chunks = gzip_compress_chunks(chunks)
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.log_request(uri, headers, '<streamed>')
 
         if self.dry_run:
+            for _ in chunks:
+                pass
             self.logger.info('Not sending because --dry-run.')
             return
 
-        try:
-            response = urlopen(
-                request,
-                timeout=self.timeout,
-            )
-        # voidspace.org.uk/python/articles/urllib2.shtml#handling-exceptions
-        except HTTPError as e:
-            self.logger.error('< The server could not fulfill the request')
-            self.logger.debug('HTTP error', exc_info=True)
-            self.log_response(e, level=logging.ERROR)
+        self.check_circuit_breaker()
+        with profiling.phase('post'):
+            try:
+                response, error = self.send(uri, chunks, headers), None
+            except ClientConnectionError as e:
+                response, error = None, e
+        self.finish(response, error)
 
-            raise ClientHTTPError(e.code)
+    def send(self, uri, body, headers):
+        """
+        POST ``body`` and return the response.
 
-        except URLError as e:  # Connection error.
-            try:
-                code, reason = e.reason.args
-            except ValueError:
-                code, reason = None, str(e)
-            if reason == 'Operation now in progress':
-                error_msg = 'request timed out (--timeout=%.2f)' % self.timeout
-            else:
-                error_msg = reason
-            self.logger.error('Unable to reach the API server: %s', error_msg)
-            self.logger.debug('URL error (connection error)', exc_info=0)
+        :raises: ClientConnectionError
 
-            raise ClientConnectionError(error_msg)
+        """
+        try:
+            with profiling.phase('send'):
+                return self.pool.request('POST', uri, body=body,
+                                         headers=headers)
+        except (socket.error, HTTPException) as e:  # Connection error.
+            raise self.connection_error(e, timed_out=is_timeout_error(e))
 
-        except Exception:
-            raise  # Unexpected error, not handled here.
-        else:
-            self.log_response(response, level=logging.DEBUG)
+    def close(self):
+        """Close the idle connections to the server."""
+        self.pool.close()
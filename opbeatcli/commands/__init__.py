@@ -1,6 +1,8 @@
 from .deployment import DeploymentCommand
+from .flush import FlushCommand
 
 
 COMMANDS = {
-    'deployment': DeploymentCommand
+    'deployment': DeploymentCommand,
+    'flush': FlushCommand,
 }
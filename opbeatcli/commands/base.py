@@ -1,5 +1,33 @@
-from opbeatcli.client import OpbeatClient
 from opbeatcli.log import logger
+from opbeatcli.exceptions import InvalidArgumentError
+
+
+def positive_int(string):
+    """An argparse ``type`` for options such as ``--collect-jobs N``."""
+    try:
+        value = int(string)
+        if value < 1:
+            raise ValueError()
+    except ValueError:
+        raise InvalidArgumentError('not a positive integer: %r' % string)
+    return value
+
+
+class LazyHelp(object):
+    """
+    Argument help text built by ``build()`` only when help is shown, for
+    help text that is expensive to build. Requires ``OpbeatHelpFormatter``.
+
+    """
+
+    def __init__(self, build):
+        self.build = build
+
+    def __str__(self):
+        return self.build()
+
+    def strip(self):
+        return str(self).strip()
 
 
 class CommandBase(object):
@@ -15,16 +43,29 @@ class CommandBase(object):
         """
         self.parser = parser
         self.args = args
-        self.logger = logger.getChild(
-            type(self).__name__.replace('Command', '').lower())
+        self.logger = logger.getChild(self.name)
+
+    @property
+    def name(self):
+        return type(self).__name__.replace('Command', '').lower()
 
     def run(self):
         """Do the actual work."""
 
     @property
     def client(self):
-        """Return a client configured based on global args."""
+        """The client configured based on global args."""
+        return self.get_client()
+
+    def get_client(self):
+        """
+        Return the client configured based on global args, which is
+        created on the first call. Call it before using ``client`` from
+        multiple threads, so that they all share it.
+
+        """
         if not hasattr(self, '_client'):
+            from opbeatcli.client import OpbeatClient
             #noinspection PyAttributeOutsideInit
             self._client = OpbeatClient(
                 organization_id=self.args.organization_id,
@@ -33,9 +74,33 @@ class CommandBase(object):
                 secret_token=self.args.secret_token,
                 dry_run=self.args.dry_run,
                 timeout=self.args.timeout,
+                compress=self.args.compress,
+                retries=self.args.retries,
+                circuit_breaker=self.get_circuit_breaker(),
             )
         return self._client
 
+    def close(self):
+        """
+        Release resources, such as the client's connections, and the
+        strings interned during the run.
+
+        """
+        # Not imported at the top, since compat imports subprocess.
+        from opbeatcli.compat import clear_interned
+
+        if hasattr(self, '_client'):
+            self._client.close()
+        clear_interned()
+
+    def get_circuit_breaker(self):
+        """
+        Return an ``opbeatcli.retry.CircuitBreaker`` for the client,
+        or ``None``.
+
+        """
+        return None
+
     @classmethod
     def add_command_args(cls, subparser):
         """
@@ -1,22 +1,41 @@
 import os
+import socket
 #noinspection PyCompatibility
 import argparse
 from collections import namedtuple, defaultdict
-from operator import attrgetter
-from itertools import chain, groupby
+from operator import attrgetter, methodcaller
+from itertools import groupby
 
-from opbeatcli import settings
+from opbeatcli import settings, profiling
 from opbeatcli.log import logger
-from opbeatcli.deployment.packages.component import Component
-from opbeatcli.deployment.packages.base import BaseDependency
-from opbeatcli.deployment import serialize
-from opbeatcli.deployment.vcs import VCS_NAME_MAP
-from opbeatcli.deployment.packages import (DEPENDENCY_COLLECTORS,
-                                           DEPENDENCIES_BY_TYPE)
-from opbeatcli.exceptions import (InvalidArgumentError,
+from opbeatcli.exceptions import (OpbeatError,
+                                  ClientConnectionError,
+                                  InvalidArgumentError,
                                   ExternalCommandNotFoundError,
                                   ExternalCommandError)
-from .base import CommandBase
+from opbeatcli.utils.concurrency import map_concurrently
+from .base import CommandBase, LazyHelp, positive_int
+from .flush import add_spool_args
+
+
+# The deployment machinery (packages, collectors, VCS backends) is imported
+# only when the command runs, rather than whenever the CLI parser is built,
+# to keep the startup fast (`opbeat --version', `opbeat deployment --help').
+
+
+def get_vcs_types():
+    from opbeatcli.deployment.vcs import VCS_NAME_MAP
+    return VCS_NAME_MAP.values()
+
+
+def get_dependency_types():
+    from opbeatcli.deployment.packages import DEPENDENCIES_BY_TYPE
+    return DEPENDENCIES_BY_TYPE.keys()
+
+
+def get_dependency_collectors():
+    from opbeatcli.deployment.packages import DEPENDENCY_COLLECTORS
+    return DEPENDENCY_COLLECTORS
 
 
 class KeyValue(namedtuple('BaseKeyValue', ['key', 'value'])):
@@ -130,100 +149,480 @@ args_to_dependency_spec = PackageSpecValidator(
 )
 
 
+# Outcomes of ``DeploymentCommand.register()``.
+REGISTERED, UNCHANGED, SPOOLED = 'registered', 'unchanged', 'spooled'
+
+
 class DeploymentCommand(CommandBase):
 
     def run(self):
-        self.logger.info('Registering deployment @ %s', self.args.hostname)
+        if self.args.defer and not self.args.spool_dir:
+            self.parser.error('--defer requires --spool-dir')
+
+        if self.args.stream:
+            if (self.args.manifest or self.args.skip_unchanged
+                    or self.args.spool_dir):
+                self.parser.error(
+                    '--stream cannot be used together with --manifest,'
+                    ' --skip-unchanged, or --spool-dir, which need all'
+                    ' the data at once')
+            return self.run_stream()
+
+        if self.args.manifest:
+            return self.run_manifest()
+
+        if not self.args.app_id:
+            self.parser.error('argument -a/--app-id is required')
+
+        self.logger.info('Registering deployment @ %s', self.hostname)
         try:
             data = self.get_data()
         except InvalidArgumentError as e:
             self.parser.error(str(e))
         else:
-            self.logger.info('Sending data')
-            self.client.post(uri=settings.DEPLOYMENT_API_URI, data=data)
+            self.register(self.args.app_id, data)
             self.logger.info('Done')
 
-    def get_data(self):
-        packages = list(self.get_all_packages())
+    def run_stream(self):
+        """
+        Register the deployment while the dependencies are being
+        collected, without keeping them all in memory (--stream).
+
+        """
+        from opbeatcli.client import JSON_SEPARATORS
+        from opbeatcli.deployment import serialize
+        from opbeatcli.deployment.dedupe import iter_unique_packages
+        from opbeatcli.deployment.packages.component import Component
+
+        if not self.args.app_id:
+            self.parser.error('argument -a/--app-id is required')
+
+        self.logger.info('Registering deployment @ %s', self.hostname)
+        try:
+            # Validated before anything is sent.
+            packages = self.get_packages_from_args()
+            collectors = self.get_collectors()
+        except InvalidArgumentError as e:
+            self.parser.error(str(e))
+
+        counts = {'components': 0, 'dependencies': 0}
+
+        def count(packages):
+            for package in packages:
+                if isinstance(package, Component):
+                    counts['components'] += 1
+                else:
+                    counts['dependencies'] += 1
+                yield package
+
+        self.logger.info('Sending data of %s while collecting it',
+                         self.args.app_id)
+        self.client.post_stream(
+            uri=settings.DEPLOYMENT_API_URI,
+            fragments=serialize.iter_deployment_json(
+                local_hostname=self.hostname,
+                # Concurrent collection would collect everything first.
+                packages=count(iter_unique_packages(
+                    packages, self.collect_dependencies(collectors, jobs=1))),
+                separators=JSON_SEPARATORS,
+            ),
+            app_id=self.args.app_id,
+        )
+        self.logger.info('The app (%s) has %d components and %d dependencies',
+                         self.args.app_id,
+                         counts['components'],
+                         counts['dependencies'])
+        self.logger.info('Done')
+
+    def run_manifest(self):
+        """
+        Register deployments of all the apps in the manifest. Dependencies
+        are collected only once, and shared by all the apps.
+
+        :return: the exit status
+
+        """
+        from opbeatcli.core import EXIT_SUCCESS, get_exit_status
+        from opbeatcli.deployment.dedupe import dedupe_packages
+        from opbeatcli.deployment.manifest import load_manifest
+
+        try:
+            apps = load_manifest(self.args.manifest)
+            self.logger.info('Registering deployments of %d apps @ %s',
+                             len(apps), self.hostname)
+            shared_packages = self.get_packages_from_args()
+            collected = list(self.collect_dependencies())
+            deployments = [
+                (app_id, self.get_data(
+                    app_id,
+                    packages=dedupe_packages(
+                        explicit=(self.get_components(components)
+                                  + self.get_dependencies(dependencies)
+                                  + shared_packages),
+                        collected=collected,
+                    )
+                ))
+                for app_id, components, dependencies in apps
+            ]
+        except InvalidArgumentError as e:
+            self.parser.error(str(e))
+
+        def register(deployment):
+            try:
+                return self.register(*deployment), None
+            except OpbeatError as e:
+                return None, e
+
+        # Shared by all the threads, with its connections and circuit
+        # breaker.
+        self.get_client()
+        results = map_concurrently(register, deployments,
+                                   jobs=self.args.post_jobs)
+
+        failures = [error for outcome, error in results if error]
+        outcomes = [outcome for outcome, error in results]
+        self.logger.info('Summary: %d apps registered, %d unchanged,'
+                         ' %d spooled, %d failed',
+                         outcomes.count(REGISTERED),
+                         outcomes.count(UNCHANGED),
+                         outcomes.count(SPOOLED),
+                         len(failures))
+        for (app_id, _), (outcome, error) in zip(deployments, results):
+            if error:
+                self.logger.error('  %s: failed: %s', app_id, error)
+            else:
+                self.logger.info('  %s: %s', app_id, outcome)
+
+        if failures:
+            return get_exit_status(failures[0])
+        return EXIT_SUCCESS
+
+    def register(self, app_id, data):
+        """
+        Register deployment ``data`` of ``app_id``.
+
+        :return: ``REGISTERED``, ``UNCHANGED`` if not sent because nothing
+                 has changed (--skip-unchanged), or ``SPOOLED`` if spooled
+                 to be sent by `opbeat flush' (--spool-dir).
+
+        """
+        import uuid
+
+        state = self.get_state(app_id)
+        if state and not self.check_changed(state, data):
+            self.logger.info(
+                'Nothing has changed since the last registered'
+                ' deployment of %s, not sending (--skip-unchanged)', app_id)
+            return UNCHANGED
+
+        # The same for the request spooled if this one fails.
+        idempotency_key = uuid.uuid4().hex
+        if self.args.defer:
+            self.spool(app_id, data, idempotency_key)
+            return SPOOLED
+
+        self.logger.info('Sending data of %s', app_id)
+        try:
+            self.client.post(uri=settings.DEPLOYMENT_API_URI, data=data,
+                             idempotency_key=idempotency_key, app_id=app_id)
+        except ClientConnectionError as e:
+            from opbeatcli.spool import is_spoolable
+
+            if not (self.args.spool_dir and is_spoolable(e)):
+                raise
+            self.logger.warning('Unable to send the deployment of %s: %s',
+                                app_id, e)
+            self.spool(app_id, data, idempotency_key)
+            return SPOOLED
+
+        if state and not self.args.dry_run:
+            state.save(data)
+        return REGISTERED
+
+    def spool(self, app_id, data, idempotency_key):
+        """Spool the deployment to be sent later by `opbeat flush'."""
+        from opbeatcli.spool import Spool
+
+        if self.args.dry_run:
+            self.logger.info('Not spooling because --dry-run.')
+            return
+        Spool(self.args.spool_dir,
+              max_age=self.args.spool_max_age,
+              max_size=self.args.spool_max_size).put(
+            uri=settings.DEPLOYMENT_API_URI,
+            data=data,
+            uri_params={'organization_id': self.args.organization_id,
+                        'app_id': app_id},
+            idempotency_key=idempotency_key,
+        )
+
+    @property
+    def hostname(self):
+        if not self.args.hostname:
+            self.args.hostname = socket.gethostname()
+        return self.args.hostname
+
+    def get_state(self, app_id):
+        from opbeatcli.deployment.state import DeploymentState
+
+        if not self.args.skip_unchanged:
+            return None
+        return DeploymentState(
+            server=self.args.server,
+            organization_id=self.args.organization_id,
+            app_id=app_id,
+            hostname=self.hostname,
+            path=self.args.cache_dir,
+        )
+
+    def check_changed(self, state, data):
+        """
+        Return whether deployment ``data`` differs from the last registered
+        one, and log the differences.
+
+        """
+        from opbeatcli.deployment.state import (canonical_hash,
+                                                canonical_releases,
+                                                diff_releases)
+
+        last = state.load()
+        if last is None:
+            self.logger.debug('No previously registered deployment found')
+            return True
+
+        last_hash, last_releases = last
+        if last_hash == canonical_hash(data):
+            return False
+
+        added, removed, changed = diff_releases(
+            last_releases, canonical_releases(data['releases']))
+        self.logger.info('Since the last registered deployment: %d added,'
+                         ' %d removed, %d changed releases',
+                         len(added), len(removed), len(changed))
+        for _, release in added:
+            self.logger.debug('  + %s', release)
+        for _, release in removed:
+            self.logger.debug('  - %s', release)
+        for (_, old), (_, new) in changed:
+            self.logger.debug('  ~ %s -> %s', old, new)
+        return True
+
+    def get_data(self, app_id=None, packages=None):
+        """
+        Return serialized deployment data of ``app_id`` (the one from the
+        arguments by default) consisting of ``packages`` (by default, those
+        from the arguments and the collected ones, see
+        ``get_all_packages()``).
+
+        """
+        from opbeatcli.deployment import serialize
+        from opbeatcli.deployment.packages.component import Component
+
+        if packages is None:
+            packages = self.get_all_packages()
 
         component_count = sum(isinstance(package, Component)
                               for package in packages)
         self.logger.info('The app (%s) has %d components and %d dependencies',
-                         self.args.app_id,
+                         app_id or self.args.app_id,
                          component_count,
                          len(packages) - component_count)
 
-        return serialize.deployment(
-            local_hostname=self.args.hostname,
-            packages=packages,
-        )
+        with profiling.phase('serialize'):
+            return serialize.deployment(
+                local_hostname=self.hostname,
+                packages=packages,
+            )
 
     def get_all_packages(self):
-        return chain(
-            self.get_packages_from_args(),
-            self.collect_dependencies()
+        """
+        Return a list of the packages from the arguments and the collected
+        ones, without duplicates, in the canonical order.
+
+        """
+        from opbeatcli.deployment.dedupe import dedupe_packages
+
+        return dedupe_packages(
+            explicit=self.get_packages_from_args(),
+            collected=self.collect_dependencies(),
         )
 
-    def collect_dependencies(self):
+    def collect_dependencies(self, collectors=None, jobs=None):
+        """
+        Yield dependencies from ``collectors`` using ``jobs`` threads (by
+        default, the ones given by the arguments).
+
+        """
+        if collectors is None:
+            collectors = self.get_collectors()
+        jobs = jobs or self.args.collect_jobs
+
+        if jobs > 1 and len(collectors) > 1:
+            self.logger.debug('Collecting dependencies using %d jobs', jobs)
+            # Each collector runs in its own thread (the work is mostly
+            # waiting for external commands) and we merge the results
+            # in the same order in which they would be collected serially.
+            results = map_concurrently(
+                lambda collector: list(self.run_collector(*collector)),
+                collectors,
+                jobs=jobs,
+            )
+            for dependencies in results:
+                for dep in dependencies:
+                    yield dep
+        else:
+            for collector, explicit in collectors:
+                for dep in self.run_collector(collector, explicit):
+                    yield dep
+
+    def run_collector(self, collector, explicit):
+        """
+        Yield dependencies from ``collector``.
+
+        Errors of explicitly requested collectors are propagated, whereas
+        those of automatic ones are ignored (missing commands) or logged
+        as warnings (failed commands). Since a command can fail after some
+        of its output has already been parsed, the dependencies of
+        automatic collectors are only yielded once they have succeeded.
+
+        """
+        if explicit:
+            for dep in collector.collect():
+                yield dep
+            return
+
+        try:
+            dependencies = list(collector.collect())
+        except ExternalCommandNotFoundError:
+            # Completely ignore missing auto collection commands.
+            pass
+        except ExternalCommandError as e:
+            # Warn about auto collection command failures.
+            self.logger.warn(str(e))
+        else:
+            for dep in dependencies:
+                yield dep
+
+    def get_collectors(self):
+        """
+        Return a list of ``(collector, explicit)`` tuples for all the
+        dependency collection that should be performed.
+
+        """
+        from opbeatcli.deployment.packages import (
+            DEPENDENCY_COLLECTORS, NATIVE_DEPENDENCY_COLLECTORS)
+        from opbeatcli.deployment.packages.types import (DEB_PACKAGE,
+                                                         NODE_PACKAGE)
+
+        collectors = []
 
-        if not self.args.do_auto_collect and not self.args.explicit_collect:
+        if not (self.args.do_auto_collect
+                or self.args.explicit_collect
+                or self.args.native_collect):
             self.logger.debug('Not collecting dependencies.')
 
         auto_collect = (DEPENDENCY_COLLECTORS.copy()
                         if self.args.do_auto_collect else {})
+        cache = self.get_cache()
 
         if self.args.explicit_collect:
             # This is how
             # "--collect-dependencies python:py_custom ruby:rb_custom python"
             # => {python: [py_custom, <py default cmds>],
             #     ruby: [rb_custom] }
-
-            get_type = attrgetter('key')
-            get_command = attrgetter('value')
-            # Group by type so that we can instantiate one collector per type:
-            groups = groupby(sorted(self.args.explicit_collect, key=get_type),
-                             key=get_type)
-            for dep_type, group in groups:
-                self.logger.debug('Explicit %r dependency collection',
-                                  dep_type)
-                if dep_type in auto_collect:
-                    del auto_collect[dep_type]
-
-                try:
-                    collector_class = DEPENDENCY_COLLECTORS[dep_type]
-                except KeyError:
-                    raise InvalidArgumentError(
-                        'Unknown dependency type to collect: %r' % dep_type)
-                custom_commands = list(map(get_command, group))
-                if len(custom_commands) != len(set(custom_commands)):
-                    raise InvalidArgumentError(
-                        'Duplicate dependency type: %s' % dep_type)
-                commands = []
-                for custom_command in custom_commands:
-                    if custom_command is None:
-                        # eg. 'python' => add all default commands for type
-                        commands.extend(collector_class.default_commands)
-                    else:
-                        # eg. 'python:custom_command'
-                        commands.append(custom_command)
-                collector = collector_class(custom_commands=commands)
-                for dep in collector.collect():
-                    yield dep
+            groups = self.group_explicit_collection(
+                self.args.explicit_collect,
+                collectors=DEPENDENCY_COLLECTORS,
+                get_defaults=attrgetter('default_commands'),
+            )
+            for dep_type, collector_class, commands in groups:
+                auto_collect.pop(dep_type, None)
+                collectors.append(
+                    (collector_class(custom_commands=commands, cache=cache,
+                                     vcs_resolver=self.vcs_resolver),
+                     True))
+
+        if self.args.native_collect:
+            # The same for "--collect-native python:/venv python".
+            groups = self.group_explicit_collection(
+                self.args.native_collect,
+                collectors=NATIVE_DEPENDENCY_COLLECTORS,
+                get_defaults=methodcaller('get_default_sources'),
+                what='native dependency type',
+            )
+            for dep_type, collector_class, sources in groups:
+                auto_collect.pop(dep_type, None)
+                kwargs = {}
+                if dep_type == DEB_PACKAGE:
+                    kwargs['qualify_multiarch'] = self.args.deb_multiarch
+                elif dep_type == NODE_PACKAGE:
+                    kwargs['jobs'] = self.args.collect_jobs
+                collectors.append(
+                    (collector_class(custom_sources=sources, cache=cache,
+                                     vcs_resolver=self.vcs_resolver,
+                                     **kwargs),
+                     True))
 
         if auto_collect:
             self.logger.debug('Auto-collecting dependencies: %s',
                               ', '.join(sorted(auto_collect.keys())))
-            for collector_class in auto_collect.values():
-                collector = collector_class()
-                try:
-                    for dep in collector.collect():
-                        yield dep
-                except ExternalCommandNotFoundError:
-                    # Completely ignore missing auto collection commands.
-                    pass
-                except ExternalCommandError as e:
-                    # Warn about auto collection command failures.
-                    self.logger.warn(str(e))
+            for dep_type in sorted(auto_collect.keys()):
+                collectors.append(
+                    (auto_collect[dep_type](cache=cache,
+                                            vcs_resolver=self.vcs_resolver),
+                     False))
+
+        return collectors
+
+    def get_circuit_breaker(self):
+        from opbeatcli.retry import CircuitBreaker
+
+        if self.args.circuit_breaker:
+            return CircuitBreaker(server=self.args.server,
+                                  path=self.args.cache_dir)
+        return None
+
+    def get_cache(self):
+        from opbeatcli.deployment.cache import CollectionCache
+
+        if self.args.use_cache:
+            return CollectionCache(path=self.args.cache_dir)
+        return None
+
+    def group_explicit_collection(self, pairs, collectors, get_defaults,
+                                  what='dependency type'):
+        """
+        Group ``type[:value]`` pairs by type so that we can instantiate one
+        collector per type, and return a list of
+        ``(type, collector_class, values)``. A missing value means
+        the defaults of the collector class (``get_defaults(cls)``).
+
+        """
+        get_type = attrgetter('key')
+        get_value = attrgetter('value')
+        grouped = []
+        groups = groupby(sorted(pairs, key=get_type), key=get_type)
+        for dep_type, group in groups:
+            self.logger.debug('Explicit %r dependency collection', dep_type)
+            try:
+                collector_class = collectors[dep_type]
+            except KeyError:
+                raise InvalidArgumentError(
+                    'Unknown %s to collect: %r' % (what, dep_type))
+            custom_values = list(map(get_value, group))
+            if len(custom_values) != len(set(custom_values)):
+                raise InvalidArgumentError(
+                    'Duplicate %s: %s' % (what, dep_type))
+            values = []
+            for custom_value in custom_values:
+                if custom_value is None:
+                    # eg. 'python' => add all defaults for type
+                    values.extend(get_defaults(collector_class))
+                else:
+                    # eg. 'python:custom_command'
+                    values.append(custom_value)
+            grouped.append((dep_type, collector_class, values))
+        return grouped
 
     def get_packages_from_args(self):
         """
@@ -256,15 +655,9 @@ class DeploymentCommand(CommandBase):
                 attributes.append(KeyValue('name', self.args.legacy_module))
             components.append(attributes)
 
-        components = [
-            Component.from_spec(args_to_component_spec(attributes))
-            for attributes in components
-        ]
-
-        dependencies = [
-            BaseDependency.from_spec(args_to_dependency_spec(attributes))
-            for attributes in dependencies
-        ]
+        with profiling.phase('packages from arguments'):
+            components = self.get_components(components)
+            dependencies = self.get_dependencies(dependencies)
 
         self.logger.debug('Components from arguments: %d', len(components))
         for package in components:
@@ -276,6 +669,46 @@ class DeploymentCommand(CommandBase):
 
         return components + dependencies
 
+    def get_components(self, attribute_lists):
+        """Return a list of components from their attribute lists."""
+        from opbeatcli.deployment.packages.component import Component
+
+        # Validate all of them before doing any work.
+        specs = [args_to_component_spec(attributes)
+                 for attributes in attribute_lists]
+
+        # Reading VCS info runs VCS commands for some repositories, so do
+        # it concurrently. The first error (in the order of the arguments)
+        # is raised, and the order of the components is preserved.
+        vcs_resolver = self.vcs_resolver
+        return map_concurrently(
+            lambda spec: Component.from_spec(spec, vcs_resolver=vcs_resolver),
+            specs,
+            jobs=self.args.vcs_jobs,
+        )
+
+    def get_dependencies(self, attribute_lists):
+        """Return a list of dependencies from their attribute lists."""
+        from opbeatcli.deployment.packages.base import BaseDependency
+
+        return [
+            BaseDependency.from_spec(args_to_dependency_spec(attributes))
+            for attributes in attribute_lists
+        ]
+
+    @property
+    def vcs_resolver(self):
+        """
+        The ``VCSResolver`` shared by all the components and collectors.
+
+        """
+        from opbeatcli.deployment.vcs import VCSResolver
+
+        if not hasattr(self, '_vcs_resolver'):
+            #noinspection PyAttributeOutsideInit
+            self._vcs_resolver = VCSResolver()
+        return self._vcs_resolver
+
     DESCRIPTION = """
 Introduction:
     This command registers a deployment of an application to a machine with
@@ -318,7 +751,7 @@ Introduction:
             '--hostname',
             action='store',
             dest='hostname',
-            default=os.environ.get('OPBEAT_HOSTNAME', settings.HOSTNAME),
+            default=os.environ.get('OPBEAT_HOSTNAME'),
             help="""
             Override hostname of current machine. Can be set with environment
             variable OPBEAT_HOSTNAME.
@@ -332,7 +765,7 @@ Introduction:
             metavar='attribute:value',
             action='append',
             type=KeyValue.from_string,
-            help=r"""
+            help=LazyHelp(lambda: r"""
                 A description of a component of the app being deployed.
                 Multiple components can be specified by using this option
                 multiple times.
@@ -380,7 +813,7 @@ Introduction:
                         remote_url:git@github.com:opbeat/scheduler.git
 
             """
-            .format(vcs_types='|'.join(sorted(VCS_NAME_MAP.values()))),
+            .format(vcs_types='|'.join(sorted(get_vcs_types())))),
         )
 
         subparser.add_argument(
@@ -390,7 +823,7 @@ Introduction:
             metavar='attribute:value',
             action='append',
             type=KeyValue.from_string,
-            help=r"""
+            help=LazyHelp(lambda: r"""
                 A description of an installed third-party package that the app
                 being deployed depends on. Multiple dependencies can be
                 specified by using this option multiple times.
@@ -414,15 +847,15 @@ Introduction:
 
             """
             .format(
-                dependency_types='|'.join(sorted(DEPENDENCIES_BY_TYPE.keys()))
-            ),
+                dependency_types='|'.join(sorted(get_dependency_types()))
+            )),
         )
         subparser.add_argument(
             '--auto-collect-dependencies',
             default=True,
             dest='do_auto_collect',
             action='store_true',
-            help="""
+            help=LazyHelp(lambda: """
             (Re-)enable automatic collection of installed dependencies (on by
             default). These types of dependencies are attempted to be
             collected:
@@ -437,7 +870,7 @@ Introduction:
             """
             .format(
                 dependency_types=', '.join(
-                    sorted(DEPENDENCY_COLLECTORS.keys())),
+                    sorted(get_dependency_collectors().keys())),
                 default_commands_table=''.join(sorted(
                     "{type: >23}: {commands}\n"
                     .format(
@@ -446,9 +879,10 @@ Introduction:
                             collector.default_commands
                         )
                     ).replace('%', '%%')  #
-                    for dep_type, collector in DEPENDENCY_COLLECTORS.items()
+                    for dep_type, collector
+                    in get_dependency_collectors().items()
                 ))
-            )
+            ))
         )
         subparser.add_argument(
             '--no-auto-collect-dependencies',
@@ -508,6 +942,198 @@ Introduction:
 
             """
         )
+        subparser.add_argument(
+            '--collect-native',
+            nargs=argparse.ONE_OR_MORE,
+            metavar='type[:source]',
+            dest='native_collect',
+            type=KeyOptionalValue.from_string,
+            help=r"""
+            Collect dependencies of these types by reading the package
+            database directly instead of running the collection commands,
+            which is considerably faster. Like with --collect-dependencies,
+            the types are removed from automatic collection.
+
+            You can supply one or more custom sources for each type
+            ("type:source"). If only a type is specified ("type"), default
+            sources for the type will be used. Supported types and their
+            sources:
+
+                python: an installation prefix, e.g., a virtualenv
+                        (default: the prefix of the Python running opbeat),
+                        or a site-packages directory
+                nodejs: a project directory or a node_modules directory
+                        (default: the current directory)
+                  ruby: gem directories separated like in $GEM_PATH,
+                        incl. Bundler paths like vendor/bundle (default:
+                        $GEM_HOME and $GEM_PATH or the RubyGems defaults,
+                        and vendor/bundle)
+                   deb: the dpkg status file (default: /var/lib/dpkg/status)
+                   rpm: the rpmdb.sqlite file or the rpm database directory
+                        (default: /var/lib/rpm/rpmdb.sqlite or
+                        /usr/lib/sysimage/rpm/rpmdb.sqlite); only the SQLite
+                        rpmdb backend is supported
+
+            Examples:
+
+                --collect-native python:/webapp1/venv python
+
+            """
+        )
+        subparser.add_argument(
+            '--deb-multiarch',
+            action='store_true',
+            dest='deb_multiarch',
+            help="""
+            With --collect-native deb, qualify the names of packages
+            installed for more than one architecture with the architecture
+            (e.g., "libc6:amd64" and "libc6:i386"), instead of listing the
+            name once per architecture like dpkg-query does.
+
+            """
+        )
+        subparser.add_argument(
+            '--collect-jobs',
+            metavar='N',
+            dest='collect_jobs',
+            type=positive_int,
+            default=1,
+            help="""
+            Run up to N dependency collectors concurrently (default: 1, i.e.,
+            one after another). The collected dependencies are the same and
+            in the same order regardless of N. The nodejs native collector
+            also reads up to N packages concurrently.
+
+            """
+        )
+        subparser.add_argument(
+            '--manifest',
+            metavar='PATH',
+            help="""
+            Register deployments of many apps on this machine at once. The
+            manifest is a JSON file (or YAML, if PyYAML is installed) with
+            the app IDs and the components and dependencies of each app:
+
+                {"apps": [
+                    {"app_id": "ee676def91",
+                     "components": [{"path": "/srv/web", "name": "web"}],
+                     "dependencies": [{"type": "other", "name": "nginx",
+                                       "version": "1.5.3"}]}
+                ]}
+
+            Dependencies are collected only once and registered for all
+            the apps, as are any --component and --dependency. -a/--app-id
+            is not needed. The exit status is non-zero if any of the apps
+            could not be registered.
+
+            """
+        )
+        subparser.add_argument(
+            '--post-jobs',
+            metavar='N',
+            dest='post_jobs',
+            type=positive_int,
+            default=1,
+            help="""
+            With --manifest, send up to N deployments concurrently
+            (default: 1).
+
+            """
+        )
+        subparser.add_argument(
+            '--vcs-jobs',
+            metavar='N',
+            dest='vcs_jobs',
+            type=positive_int,
+            default=1,
+            help="""
+            Read VCS information of up to N --component paths concurrently
+            (default: 1). Useful with many components, some of which are not
+            Git repositories (or Git repositories that need git to be read).
+
+            """
+        )
+        subparser.add_argument(
+            '--cache',
+            default=False,
+            dest='use_cache',
+            action='store_true',
+            help="""
+            Cache collected dependencies, and reuse them on subsequent runs
+            as long as the files they were collected from (the package
+            database, site-packages, node_modules, etc.) have not changed.
+            Custom commands are never cached.
+
+            """
+        )
+        subparser.add_argument(
+            '--no-cache',
+            dest='use_cache',
+            action='store_false',
+            help="""
+            Do not use the dependency cache (the default).
+
+            """
+        )
+        subparser.add_argument(
+            '--cache-dir',
+            metavar='PATH',
+            default=settings.CACHE_DIR,
+            help="""
+            Where --cache stores collected dependencies, --skip-unchanged
+            the last registered deployments, and --circuit-breaker its state
+            (default: %(default)s).
+
+            """
+        )
+        add_spool_args(subparser)
+        subparser.add_argument(
+            '--defer',
+            default=False,
+            action='store_true',
+            help="""
+            Do not send the deployment, only spool it to --spool-dir, so
+            that the deployment does not wait for the Opbeat API. Use
+            `opbeat flush' to send it. Without --defer, only deployments
+            that could not be sent are spooled.
+
+            """
+        )
+        subparser.add_argument(
+            '--stream',
+            default=False,
+            action='store_true',
+            help="""
+            Send the deployment while the dependencies are being
+            collected, without keeping them all in memory, for hosts with
+            very many packages. Collection is not concurrent
+            (--collect-jobs), and failed requests are not retried.
+
+            """
+        )
+        subparser.add_argument(
+            '--circuit-breaker',
+            default=False,
+            action='store_true',
+            help="""
+            After {threshold} consecutive failed requests to the server
+            (e.g., because it is down), do not contact it for {timeout}s,
+            even on subsequent runs, and fail right away instead.
+
+            """.format(threshold=settings.CIRCUIT_BREAKER_THRESHOLD,
+                       timeout=settings.CIRCUIT_BREAKER_RESET_TIMEOUT)
+        )
+        subparser.add_argument(
+            '--skip-unchanged',
+            default=False,
+            action='store_true',
+            help="""
+            Do not send the deployment if it is exactly the same as the last
+            one successfully registered from this host for the app (e.g.,
+            when re-running CI jobs), and log what has changed otherwise.
+
+            """
+        )
 
         # Hidden aliases for --component to preserve
         # backward-compatibility with opbeatcli==1.1.5.
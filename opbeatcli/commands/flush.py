@@ -0,0 +1,138 @@
+from itertools import islice
+
+from opbeatcli import settings
+from opbeatcli.exceptions import OpbeatError
+from opbeatcli.utils.concurrency import map_concurrently
+from .base import CommandBase, positive_int
+
+
+def add_spool_args(subparser, required=False):
+    """Add the spool options shared by the commands."""
+    subparser.add_argument(
+        '--spool-dir',
+        metavar='PATH',
+        dest='spool_dir',
+        required=required,
+        help="""
+        The directory of requests to be sent later by `opbeat flush'.
+
+        """
+    )
+    subparser.add_argument(
+        '--spool-max-age',
+        metavar='SECONDS',
+        dest='spool_max_age',
+        type=positive_int,
+        default=settings.SPOOL_MAX_AGE,
+        help="""
+        Discard spooled requests older than this (default: %(default)s).
+
+        """
+    )
+    subparser.add_argument(
+        '--spool-max-size',
+        metavar='BYTES',
+        dest='spool_max_size',
+        type=positive_int,
+        default=settings.SPOOL_MAX_SIZE,
+        help="""
+        Discard the oldest spooled requests when the spool is larger
+        than this (default: %(default)s).
+
+        """
+    )
+
+
+class FlushCommand(CommandBase):
+
+    def run(self):
+        """
+        Send the spooled requests, the oldest first, and remove them.
+
+        :return: the exit status
+
+        """
+        from opbeatcli.core import EXIT_SUCCESS, get_exit_status
+        from opbeatcli.spool import Spool, is_spoolable
+
+        spool = Spool(self.args.spool_dir,
+                      max_age=self.args.spool_max_age,
+                      max_size=self.args.spool_max_size)
+        spool.prune()
+        self.logger.info('Flushing %d spooled requests from %s',
+                         len(spool.get_paths()), spool.path)
+        requests = spool.iter_requests()
+
+        jobs = self.args.jobs
+        sent, error = 0, None
+        # Shared by all the threads, with its connections and circuit
+        # breaker.
+        self.get_client()
+        # In batches of ``jobs`` concurrent requests, so that it's stopped
+        # soon when the server is not reachable or overloaded, and the rest
+        # is kept in order for the next flush. Only a batch is loaded at a
+        # time.
+        while True:
+            batch = list(islice(requests, jobs))
+            if not batch:
+                break
+            errors = map_concurrently(self.send, batch, jobs=jobs)
+            sent += errors.count(None)
+            error = error or next((e for e in errors if e), None)
+            # Only rejected requests don't stop it.
+            if any(e and is_spoolable(e) for e in errors):
+                break
+
+        self.logger.info('Sent %d, %d left in the spool',
+                         sent, len(spool.get_paths()))
+        if error:
+            return get_exit_status(error)
+        return EXIT_SUCCESS
+
+    def send(self, request):
+        """Send a ``SpooledRequest``, and return the error, if any."""
+        from opbeatcli.spool import is_spoolable
+
+        self.logger.info('Sending %r', request)
+        try:
+            self.client.post(
+                uri=request.uri,
+                data=request.data,
+                idempotency_key=request.idempotency_key,
+                **request.uri_params
+            )
+        except OpbeatError as e:
+            if not is_spoolable(e):
+                self.logger.error('Rejected by the server, it will not'
+                                  ' be sent again')
+                request.reject()
+            return e
+        if not self.args.dry_run:
+            request.remove()
+        return None
+
+    DESCRIPTION = """
+    Send requests spooled by `opbeat deployment --spool-dir', e.g., when
+    the Opbeat API was not reachable, or with --defer. They are sent in the
+    order they were spooled, and removed from the spool once sent.
+
+    """
+
+    @classmethod
+    def add_command_args(cls, subparser):
+        """
+        :type subparser: argparse.ArgumentParser
+
+        """
+        add_spool_args(subparser, required=True)
+        subparser.add_argument(
+            '--jobs',
+            metavar='N',
+            dest='jobs',
+            type=positive_int,
+            default=1,
+            help="""
+            Send up to N requests concurrently (default: 1).
+
+            """
+        )
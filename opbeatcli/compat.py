@@ -1,3 +1,4 @@
+import os
 import subprocess
 
 try:
@@ -27,19 +28,62 @@ except ImportError:  # Python 2.6
 
 try:
     #noinspection PyCompatibility
-    from urllib.request import Request, urlopen, URLError, HTTPError
-    #noinspection PyCompatibility
-    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlsplit, urlunsplit, unquote, quote
 except ImportError:  # Python < 3.0
     #noinspection PyCompatibility,PyUnresolvedReferences
-    from urllib2 import Request, urlopen, URLError, HTTPError
+    from urlparse import urlsplit, urlunsplit
     #noinspection PyCompatibility,PyUnresolvedReferences
-    from BaseHTTPServer import BaseHTTPRequestHandler
+    from urllib import unquote, quote
+
+
+try:
+    from shlex import quote as shell_quote
+except ImportError:  # Python < 3.3
+    #noinspection PyUnresolvedReferences
+    from pipes import quote as shell_quote
 
 
 try:
     #noinspection PyCompatibility
-    from urllib.parse import urlsplit, urlunsplit
+    from collections.abc import Mapping
+except ImportError:  # Python < 3.3
+    from collections import Mapping
+
+
+try:
+    scandir = os.scandir
+except AttributeError:  # Python < 3.5
+    scandir = None
+
+
+try:
+    from shutil import which
+except ImportError:  # Python < 3.3
+    #noinspection PyUnresolvedReferences
+    from distutils.spawn import find_executable as which
+
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+try:
+    from sys import intern
 except ImportError:  # Python < 3.0
-    #noinspection PyCompatibility,PyUnresolvedReferences
-    from urlparse import urlsplit, urlunsplit
+    _interned = {}
+
+    def intern(string):
+        """
+        Like the built-in ``intern()``, but also for ``unicode``. The
+        strings are kept until ``clear_interned()``.
+
+        """
+        return _interned.setdefault((type(string), string), string)
+
+    def clear_interned():
+        _interned.clear()
+else:
+    def clear_interned():
+        """Interned strings are released once no longer used anyway."""
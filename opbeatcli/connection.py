@@ -0,0 +1,188 @@
+"""
+A pool of persistent (keep-alive) HTTP connections to the Opbeat server.
+
+"""
+import errno
+import socket
+import threading
+from collections import namedtuple
+
+from opbeatcli.log import logger
+from opbeatcli import settings
+from opbeatcli.compat import urlsplit
+
+try:
+    #noinspection PyCompatibility
+    from http.client import (HTTPConnection, HTTPSConnection,
+                             HTTPException, BadStatusLine)
+except ImportError:  # Python < 3.0
+    #noinspection PyCompatibility,PyUnresolvedReferences
+    from httplib import (HTTPConnection, HTTPSConnection,
+                         HTTPException, BadStatusLine)
+
+
+CONNECTION_CLASSES = {
+    'http': HTTPConnection,
+    'https': HTTPSConnection,
+}
+
+# Errors of a reused connection that mean that the server has closed it
+# while it was idle, before it got our request.
+STALE_CONNECTION_ERRNOS = frozenset([
+    errno.ECONNRESET,
+    errno.ECONNABORTED,
+    errno.EPIPE,
+])
+
+# Errors meaning the connection could not be established, or the response
+# not received, within the timeout.
+TIMEOUT_ERRNOS = frozenset([
+    errno.EINPROGRESS,
+    errno.EAGAIN,
+    errno.ETIMEDOUT,
+])
+
+
+Response = namedtuple('Response', ['status', 'reason', 'headers', 'body'])
+
+
+def is_stale_connection_error(error):
+    return (isinstance(error, BadStatusLine)
+            or getattr(error, 'errno', None) in STALE_CONNECTION_ERRNOS)
+
+
+def is_timeout_error(error):
+    return (isinstance(error, socket.timeout)
+            or getattr(error, 'errno', None) in TIMEOUT_ERRNOS)
+
+
+class ConnectionPool(object):
+    """
+    Persistent connections to the server at ``url``, so that subsequent
+    requests don't have to do the DNS lookup, TCP and TLS handshakes again.
+
+    Up to ``maxsize`` idle connections are kept open; there can be more
+    connections at a time (when requests are made concurrently), but any
+    extra ones are closed once their request is done.
+
+    """
+
+    def __init__(self, url, timeout=settings.TIMEOUT,
+                 maxsize=settings.HTTP_POOL_SIZE):
+        scheme, netloc, path, _, _ = urlsplit(url)
+        try:
+            self.connection_class = CONNECTION_CLASSES[scheme]
+        except KeyError:
+            raise ValueError('unsupported server URL: %r' % url)
+        self.netloc = netloc
+        self.base_path = path.rstrip('/')
+        self.timeout = timeout
+        self.maxsize = maxsize
+
+        # The number of connections opened, for logging and tests.
+        self.connections_opened = 0
+
+        self._idle = []
+        self._lock = threading.Lock()
+        self.logger = logger.getChild('connection')
+
+    def new_connection(self):
+        with self._lock:
+            self.connections_opened += 1
+            number = self.connections_opened
+        self.logger.debug('Opening connection #%d to %s', number, self.netloc)
+        return self.connection_class(self.netloc, timeout=self.timeout)
+
+    def get_connection(self):
+        """Return ``(connection, reused)``."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self.new_connection(), False
+
+    def release(self, connection):
+        """Keep ``connection`` for reuse, unless the pool is full."""
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method, uri, body=None, headers=None):
+        """
+        Make a request and return the ``Response``.
+
+        ``body`` is either bytes, or an iterable of bytes chunks, which are
+        sent with chunked transfer encoding as they are produced.
+
+        A reused connection that turns out to have been closed by the
+        server is replaced with a new one, and the request is repeated,
+        unless the body is an iterable, which cannot be sent again.
+
+        :raises: ``socket.error`` or ``HTTPException`` on connection errors.
+
+        """
+        path = self.base_path + uri
+        replayable = body is None or isinstance(body, bytes)
+        connection, reused = self.get_connection()
+        while True:
+            try:
+                response, will_close = self._request(
+                    connection, method, path, body, headers or {})
+            except (socket.error, HTTPException) as e:
+                connection.close()
+                if reused and replayable and is_stale_connection_error(e):
+                    self.logger.debug('Reconnecting, the server has closed'
+                                      ' an idle connection: %r', e)
+                    connection, reused = self.new_connection(), False
+                    continue
+                raise
+            except Exception:
+                # E.g., an error producing the body; the request is
+                # incomplete, so the connection cannot be reused.
+                connection.close()
+                raise
+            break
+
+        if will_close:
+            connection.close()
+        else:
+            self.release(connection)
+
+        return response
+
+    def _request(self, connection, method, path, body, headers):
+        """Return ``(response, will_close)``."""
+        if body is None or isinstance(body, bytes):
+            connection.request(method, path, body, headers)
+        else:
+            self._send_chunked(connection, method, path, body, headers)
+        response = connection.getresponse()
+        # The whole body has to be read before the connection can be reused.
+        result = Response(
+            status=response.status,
+            reason=response.reason,
+            headers=dict((name.lower(), value)
+                         for name, value in response.getheaders()),
+            body=response.read(),
+        )
+        return result, response.will_close
+
+    def _send_chunked(self, connection, method, path, chunks, headers):
+        connection.putrequest(method, path)
+        for name, value in headers.items():
+            connection.putheader(name, value)
+        connection.putheader('Transfer-Encoding', 'chunked')
+        connection.endheaders()
+        for chunk in chunks:
+            if chunk:
+                connection.send(('%x\r\n' % len(chunk)).encode('ascii')
+                                + chunk + b'\r\n')
+        connection.send(b'0\r\n\r\n')
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
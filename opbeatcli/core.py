@@ -5,9 +5,11 @@ Invoke as `opbeat` or `python -m opbeatcli`.
 import sys
 import logging
 
+from opbeatcli import profiling
 from opbeatcli.log import logger
 from opbeatcli.cli import get_parser
-from opbeatcli.exceptions import OpbeatError, ClientConnectionError
+from opbeatcli.exceptions import (OpbeatError, ClientConnectionError,
+                                  ClientHTTPError)
 
 
 EXIT_SUCCESS, EXIT_ERROR = 0, 1
@@ -22,6 +24,15 @@ def get_command(args=sys.argv[1:]):
     return Command(parser=parser, args=args)
 
 
+def get_exit_status(error):
+    """Return the exit status for ``error`` raised by a command."""
+    if isinstance(error, ClientHTTPError):
+        return EXIT_SERVER_ERROR
+    if isinstance(error, ClientConnectionError):
+        return EXIT_CLIENT_ERROR
+    return EXIT_ERROR
+
+
 def main(args=sys.argv[1:]):
     """Run command and return exit status code."""
 
@@ -29,17 +40,21 @@ def main(args=sys.argv[1:]):
         get_parser().print_help()
         return EXIT_SUCCESS
 
+    started = profiling.snapshot()
     command = get_command(args)
+    if (command.args.profile or command.args.profile_json
+            or command.args.profile_stats):
+        profiling.start(stats_path=command.args.profile_stats)
+    if command.args.trace:
+        profiling.start_tracing(origin=started[0])
+    profiling.record('parse arguments', started)
 
     try:
-        command.run()
+        with profiling.phase(command.name):
+            status = command.run()
     except ClientConnectionError as e:
         # The error has already been logged by the client.
-        response_status = e.args[0]
-        if response_status < 400:
-            return EXIT_CLIENT_ERROR
-        else:
-            return EXIT_SERVER_ERROR
+        return get_exit_status(e)
     except OpbeatError as e:
         logger.error(e)
         if not command.args.verbose:
@@ -49,7 +64,25 @@ def main(args=sys.argv[1:]):
         logger.exception('Error executing command')
         return EXIT_ERROR
     else:
-        return EXIT_SUCCESS
+        return status or EXIT_SUCCESS
+    finally:
+        command.close()
+        report_profile(command.args)
+
+
+def report_profile(args):
+    """Report the --profile measurements and --trace, if any."""
+    tracer = profiling.stop_tracing()
+    if tracer is not None:
+        tracer.dump_json(args.trace)
+
+    profiler = profiling.stop()
+    if profiler is None:
+        return
+    if args.profile_json:
+        profiler.dump_json(args.profile_json)
+    if args.profile or args.profile_stats:
+        sys.stderr.write(profiler.format_table())
 
 
 if __name__ == '__main__':
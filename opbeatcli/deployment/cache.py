@@ -0,0 +1,187 @@
+"""
+A persistent cache of collected dependencies.
+
+Collectors that know which files their results depend on (a package
+database, site-packages directories, ``node_modules``, ...) have their
+results cached under a key derived from the command or source, and from
+a cheap fingerprint (``stat()``) of those files. As long as none of the
+files changes, the results are reused instead of being collected again.
+
+The cache is size-bounded with least-recently-used eviction, and safe for
+concurrent invocations: entries are written atomically and writers hold
+an exclusive lock on the cache directory.
+
+"""
+import os
+import json
+import hashlib
+from contextlib import contextmanager
+
+from opbeatcli import settings
+from opbeatcli.log import logger
+from opbeatcli.compat import fcntl
+from opbeatcli.exceptions import InvalidArgumentError
+from opbeatcli.utils.files import makedirs, write_atomically
+from .vcs import VCS
+
+
+# Bump when the entry format changes.
+CACHE_FORMAT_VERSION = 1
+
+
+def stat_fingerprint(paths):
+    """Return a JSON-serializable fingerprint of the ``stat()`` of ``paths``.
+
+    Missing paths are part of the fingerprint too, so that the fingerprint
+    changes when they get created.
+
+    """
+    fingerprint = []
+    for path in paths:
+        path = os.path.abspath(os.path.expanduser(path))
+        try:
+            st = os.stat(path)
+        except OSError:
+            fingerprint.append([path, None])
+        else:
+            mtime = getattr(st, 'st_mtime_ns', None) or repr(st.st_mtime)
+            fingerprint.append([path, mtime, st.st_size, st.st_ino])
+    return fingerprint
+
+
+class CollectionCache(object):
+
+    def __init__(self, path=settings.CACHE_DIR,
+                 max_size=settings.CACHE_MAX_SIZE):
+        self.path = os.path.join(os.path.expanduser(path), 'collect')
+        self.max_size = max_size
+        self.logger = logger.getChild('cache')
+
+    def make_key(self, collector, kind, value, paths):
+        """
+        Return a cache key for dependencies collected by ``collector``
+        from ``value`` (a command or a source, depending on ``kind``)
+        that depends on the files at ``paths``.
+
+        """
+        key_data = [
+            CACHE_FORMAT_VERSION,
+            '%s.%s' % (type(collector).__module__, type(collector).__name__),
+            kind,
+            value,
+            # Commands and sources can be relative to it.
+            os.getcwd(),
+            stat_fingerprint(paths),
+        ]
+        return hashlib.sha1(
+            json.dumps(key_data, sort_keys=True).encode('utf8')
+        ).hexdigest()
+
+    def get(self, key):
+        """Return a list of dependencies for ``key``, or ``None``."""
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+
+        try:
+            entry = json.loads(data.decode('utf8'))
+            dependencies = [self.load_dependency(item)
+                            for item in entry['dependencies']]
+        except (ValueError, KeyError, TypeError, AttributeError,
+                InvalidArgumentError) as e:
+            # E.g., truncated or edited by hand.
+            self.logger.debug('Removing invalid cache entry %s: %r', key, e)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        try:
+            # Mark as recently used.
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        self.logger.debug('Cache hit: %s', key)
+        return dependencies
+
+    def set(self, key, dependencies):
+        """Store ``dependencies`` for ``key``."""
+        entry = {
+            'dependencies': [self.dump_dependency(dep)
+                             for dep in dependencies],
+        }
+        content = json.dumps(entry, separators=(',', ':')).encode('utf8')
+
+        with self.lock():
+            write_atomically(self.entry_path(key), content)
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries while over ``max_size``.
+
+        Needs to be called with the lock held.
+
+        """
+        entries = []
+        for filename in os.listdir(self.path):
+            if filename.endswith('.json'):
+                path = os.path.join(self.path, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            self.logger.debug('Evicting: %s', path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+
+    @contextmanager
+    def lock(self):
+        makedirs(self.path)
+        with open(os.path.join(self.path, 'lock'), 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    @staticmethod
+    def dump_dependency(dep):
+        vcs = None
+        if dep.vcs:
+            vcs = {
+                'vcs_type': dep.vcs.vcs_type,
+                'rev': dep.vcs.rev,
+                'branch': dep.vcs.branch,
+                'remote_url': dep.vcs.remote_url,
+            }
+        return [dep.package_type, dep.name, dep.version, vcs]
+
+    @staticmethod
+    def load_dependency(item):
+        from .packages import DEPENDENCIES_BY_TYPE
+
+        package_type, name, version, vcs = item
+        return DEPENDENCIES_BY_TYPE[package_type](
+            name=name,
+            version=version,
+            vcs=VCS(**vcs) if vcs else None,
+        )
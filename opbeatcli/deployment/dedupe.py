@@ -0,0 +1,81 @@
+"""
+Removing duplicate packages, e.g., those collected by more than one
+command (``--collect-dependencies python:'venv/bin/pip freeze' python``),
+or found both among the global and the local Node.js modules.
+
+Packages are identical when they serialize to identical releases. Those
+from the arguments (``--component``, ``--dependency``) also take
+precedence over any collected ones of the same type and name.
+
+"""
+from opbeatcli.log import logger
+
+
+def get_package_key(package):
+    """
+    Return a hashable key identifying the release ``package`` serializes
+    to, which is also its canonical sort key: its type, name, path,
+    version, and VCS attributes.
+
+    """
+    vcs = package.vcs
+    values = (
+        package.package_type,
+        package.name,
+        getattr(package, 'path', None),
+        package.version,
+    ) + (vcs.key if vcs is not None else (None, None, None, None))
+    # ``None`` sorts before, and is never compared to, any string.
+    return tuple((value is not None, value) for value in values)
+
+
+def _iter_unique(explicit, collected):
+    """Yield ``(key, package)`` for ``iter_unique_packages()``."""
+    seen = set()
+    explicit_names = set()
+    duplicates = 0
+
+    for package in explicit:
+        key = get_package_key(package)
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        explicit_names.add((package.package_type, package.name))
+        yield key, package
+
+    for package in collected:
+        key = get_package_key(package)
+        if (key in seen
+                or (package.package_type, package.name) in explicit_names):
+            duplicates += 1
+            continue
+        seen.add(key)
+        yield key, package
+
+    if duplicates:
+        logger.getChild('dedupe').debug('Dropped %d duplicate packages',
+                                        duplicates)
+
+
+def iter_unique_packages(explicit, collected):
+    """
+    Yield the ``explicit`` packages (from the arguments), and then the
+    ``collected`` ones, without duplicates, and without collected ones
+    overridden by explicit ones.
+
+    Both can be consumed lazily (see ``--stream``).
+
+    """
+    for key, package in _iter_unique(explicit, collected):
+        yield package
+
+
+def dedupe_packages(explicit, collected):
+    """
+    Return a list of the packages of ``iter_unique_packages()`` in the
+    canonical order, so that equal deployments serialize identically.
+
+    """
+    index = dict(_iter_unique(explicit, collected))
+    return [index[key] for key in sorted(index)]
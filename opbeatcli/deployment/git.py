@@ -0,0 +1,247 @@
+"""
+Reading Git repository metadata directly from the repository files.
+
+This is what ``git rev-parse HEAD``, ``git branch``, and ``git config
+remote.origin.url`` would tell us, but without running ``git`` at all.
+Loose and packed refs, detached HEADs, and ``.git`` files pointing to
+the actual Git directory (worktrees and submodules) are supported.
+Anything else (e.g., the reftable ref storage or config includes) raises
+``UnsupportedGitLayout``, so that the caller can fall back to ``git``.
+
+"""
+import os
+import re
+
+
+SHA_RE = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+SYMREF_PREFIX = 'ref: '
+BRANCH_PREFIX = 'refs/heads/'
+MAX_SYMREF_DEPTH = 5
+
+# Refs stored in the worktree's own Git directory rather than the common one.
+PER_WORKTREE_REFS_RE = re.compile(r'^(HEAD|refs/(bisect|worktree|rewritten)/)')
+
+CONFIG_SECTION_RE = re.compile(
+    r'^\[\s*([-.\w]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]\s*(.*)$')
+CONFIG_VARIABLE_RE = re.compile(r'^([A-Za-z][-A-Za-z0-9]*)\s*(?:=\s*(.*))?$')
+
+
+class UnsupportedGitLayout(Exception):
+    """The repository cannot be read without ``git``."""
+
+
+def decode(data, path):
+    """
+    Return ``data`` read from ``path`` decoded as UTF-8.
+
+    :raises: UnsupportedGitLayout if it's in another encoding, e.g.,
+             a Latin-1 ``user.name`` in the config.
+
+    """
+    try:
+        return data.decode('utf8')
+    except UnicodeDecodeError as e:
+        raise UnsupportedGitLayout('non-UTF-8 %r: %s' % (path, e))
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return decode(f.read(), path).strip()
+
+
+def find_git_dir(path):
+    """
+    Return the Git directory of the working tree at ``path``, or ``None``.
+
+    ``.git`` can be a directory, or a file with a ``gitdir: <path>`` line
+    (worktrees and submodules).
+
+    """
+    dot_git = os.path.join(path, '.git')
+    if os.path.isdir(dot_git):
+        return dot_git
+    if os.path.isfile(dot_git):
+        content = read_file(dot_git)
+        if not content.startswith('gitdir:'):
+            raise UnsupportedGitLayout('invalid .git file: %r' % dot_git)
+        git_dir = os.path.join(path, content[len('gitdir:'):].strip())
+        return os.path.normpath(git_dir)
+    return None
+
+
+def get_common_dir(git_dir):
+    """Return the Git directory shared by all worktrees of the repository."""
+    commondir = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir):
+        return os.path.normpath(os.path.join(git_dir, read_file(commondir)))
+    return git_dir
+
+
+def read_packed_refs(common_dir):
+    """Return a ``{ref: sha}`` dict of refs in ``packed-refs``."""
+    refs = {}
+    path = os.path.join(common_dir, 'packed-refs')
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                line = decode(line, path).strip()
+                # Skip the header and peeled tags ("^<sha>").
+                if line and line[0] not in '#^':
+                    sha, ref = line.split(' ', 1)
+                    refs[ref] = sha
+    except (IOError, OSError):
+        pass
+    return refs
+
+
+class GitRepository(object):
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self.common_dir = get_common_dir(git_dir)
+        if os.path.isdir(os.path.join(self.common_dir, 'reftable')):
+            raise UnsupportedGitLayout('reftable ref storage')
+        self._packed_refs = None
+
+    @property
+    def packed_refs(self):
+        if self._packed_refs is None:
+            self._packed_refs = read_packed_refs(self.common_dir)
+        return self._packed_refs
+
+    def read_ref(self, ref):
+        """
+        Return the raw value of ``ref``: a SHA, or ``ref: <other ref>``
+        for symbolic refs, or ``None`` if it doesn't exist.
+
+        """
+        base_dir = (self.git_dir if PER_WORKTREE_REFS_RE.match(ref)
+                    else self.common_dir)
+        try:
+            return read_file(os.path.join(base_dir, ref))
+        except (IOError, OSError):
+            return self.packed_refs.get(ref)
+
+    def resolve(self, ref):
+        """
+        Return ``(sha, ref_name)`` for ``ref``, following symbolic refs,
+        where ``ref_name`` is the last ref in the chain.
+
+        """
+        for _ in range(MAX_SYMREF_DEPTH):
+            value = self.read_ref(ref)
+            if value is None:
+                # E.g., a branch without any commits yet.
+                raise UnsupportedGitLayout('unresolvable ref: %r' % ref)
+            if not value.startswith(SYMREF_PREFIX):
+                break
+            ref = value[len(SYMREF_PREFIX):].strip()
+        else:
+            raise UnsupportedGitLayout('symbolic ref loop: %r' % ref)
+
+        if not SHA_RE.match(value):
+            raise UnsupportedGitLayout('invalid ref %r: %r' % (ref, value))
+        return value, ref
+
+    def get_revision(self):
+        return self.resolve('HEAD')[0]
+
+    def get_branch(self):
+        """Return the current branch name, or ``None`` if detached."""
+        ref = self.resolve('HEAD')[1]
+        if ref.startswith(BRANCH_PREFIX):
+            return ref[len(BRANCH_PREFIX):]
+        return None
+
+    def get_config(self, section, subsection, name):
+        """
+        Return the last value of the config variable ``name`` in
+        ``[section "subsection"]``, or ``None``.
+
+        """
+        path = os.path.join(self.common_dir, 'config')
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        lines = decode(data, path).splitlines()
+
+        section, name = section.lower(), name.lower()
+        current = None
+        value = None
+        for line in lines:
+            line = line.strip()
+            if not line or line[0] in '#;':
+                continue
+
+            match = CONFIG_SECTION_RE.match(line)
+            if match:
+                current_section, current_subsection, line = match.groups()
+                current_section = current_section.lower()
+                if current_subsection is None and '.' in current_section:
+                    # The deprecated [section.subsection] syntax.
+                    current_section, current_subsection = (
+                        current_section.split('.', 1))
+                current = (current_section, current_subsection)
+                if current_section in ('include', 'includeif'):
+                    raise UnsupportedGitLayout('config includes')
+                if not line:
+                    continue
+
+            match = CONFIG_VARIABLE_RE.match(line)
+            if not match:
+                raise UnsupportedGitLayout('unsupported config: %r' % line)
+            variable, variable_value = match.groups()
+            if variable.lower() == 'insteadof':
+                # URL rewriting would change the remote URL.
+                raise UnsupportedGitLayout('url.<base>.insteadOf')
+            if current == (section, subsection) and variable.lower() == name:
+                value = parse_config_value(variable_value)
+        return value
+
+
+def parse_config_value(value):
+    """Unquote a config value and strip any trailing comment."""
+    if value is None:
+        # "[section] name" means true.
+        return 'true'
+    if '\\\n' in value or value.endswith('\\'):
+        raise UnsupportedGitLayout('multi-line config value')
+
+    result = []
+    in_quotes = False
+    i = 0
+    while i < len(value):
+        char = value[i]
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == '\\' and i + 1 < len(value):
+            i += 1
+            result.append({'n': '\n', 't': '\t', 'b': '\b'}.get(
+                value[i], value[i]))
+        elif char in '#;' and not in_quotes:
+            break
+        else:
+            result.append(char)
+        i += 1
+    return ''.join(result).strip()
+
+
+def read_git_metadata(path):
+    """
+    Return ``(rev, branch, remote_url)`` for the Git working tree at
+    ``path``.
+
+    :raises: UnsupportedGitLayout if ``git`` is needed to find out.
+
+    """
+    git_dir = find_git_dir(path)
+    if git_dir is None or not os.path.isdir(git_dir):
+        raise UnsupportedGitLayout('no Git directory in %r' % path)
+    repo = GitRepository(git_dir)
+    return (
+        repo.get_revision(),
+        repo.get_branch(),
+        repo.get_config('remote', 'origin', 'url'),
+    )
@@ -0,0 +1,127 @@
+"""
+Manifests describing deployments of many apps on the same host, so that
+they can be registered at once (``opbeat deployment --manifest``).
+
+A manifest is a JSON file (or a YAML one, if PyYAML is installed) like:
+
+    {
+        "apps": [
+            {
+                "app_id": "ee676def91",
+                "components": [
+                    {"path": "/srv/web", "name": "web"}
+                ],
+                "dependencies": [
+                    {"type": "other", "name": "nginx", "version": "1.5.3"}
+                ]
+            }
+        ]
+    }
+
+Components and dependencies have the same attributes as ``--component``
+and ``--dependency``.
+
+"""
+import io
+import json
+
+from opbeatcli.exceptions import InvalidArgumentError
+
+
+YAML_EXTENSIONS = ('.yaml', '.yml')
+
+
+def manifest_error(path, message):
+    return InvalidArgumentError(
+        '--manifest: {path!r}: {message}'.format(path=path, message=message))
+
+
+def read_manifest_file(path):
+    try:
+        with io.open(path, encoding='utf8') as f:
+            content = f.read()
+    except (IOError, OSError) as e:
+        raise manifest_error(path, e.strerror or str(e))
+
+    if path.lower().endswith(YAML_EXTENSIONS):
+        try:
+            import yaml
+        except ImportError:
+            raise manifest_error(
+                path, 'YAML manifests require PyYAML (pip install PyYAML)')
+        try:
+            return yaml.safe_load(content)
+        except yaml.YAMLError as e:
+            raise manifest_error(path, 'invalid YAML: %s' % e)
+
+    try:
+        return json.loads(content)
+    except ValueError as e:
+        raise manifest_error(path, 'invalid JSON: %s' % e)
+
+
+def get_attributes(path, app_id, what, package):
+    """
+    Return ``(key, value)`` pairs of the attributes of ``package`` with
+    string values, the same as if they came from the command line.
+
+    """
+    if not isinstance(package, dict) or not package:
+        raise manifest_error(
+            path, 'app {app_id}: each of {what} has to be a non-empty'
+            ' mapping of attributes'.format(app_id=app_id, what=what))
+    attributes = []
+    for key, value in sorted(package.items()):
+        if isinstance(value, (dict, list)) or value is None:
+            raise manifest_error(
+                path, 'app {app_id}: invalid value of {what} attribute'
+                ' {key!r}: {value!r}'
+                .format(app_id=app_id, what=what, key=key, value=value))
+        attributes.append((u'%s' % key, u'%s' % value))
+    return attributes
+
+
+def load_manifest(path):
+    """
+    Return a list of ``(app_id, components, dependencies)`` tuples, where
+    ``components`` and ``dependencies`` are lists of ``(key, value)``
+    attribute lists.
+
+    :raises: InvalidArgumentError if the manifest is invalid.
+
+    """
+    manifest = read_manifest_file(path)
+    apps = manifest.get('apps') if isinstance(manifest, dict) else None
+    if not isinstance(apps, list) or not apps:
+        raise manifest_error(path, 'a non-empty list of "apps" is required')
+
+    result = []
+    app_ids = set()
+    for app in apps:
+        if not isinstance(app, dict) or not app.get('app_id'):
+            raise manifest_error(path, 'each app has to have an "app_id"')
+        app_id = u'%s' % app['app_id']
+        unknown = set(app) - set(['app_id', 'components', 'dependencies'])
+        if unknown:
+            raise manifest_error(
+                path, 'app {app_id}: unknown keys: {keys}'.format(
+                    app_id=app_id, keys=', '.join(sorted(unknown))))
+        if app_id in app_ids:
+            raise manifest_error(path, 'duplicate app: %s' % app_id)
+        app_ids.add(app_id)
+
+        packages = {}
+        for what in ['components', 'dependencies']:
+            items = app.get(what)
+            if items is None:
+                items = []
+            if not isinstance(items, list):
+                raise manifest_error(
+                    path, 'app {app_id}: "{what}" has to be a list'
+                    .format(app_id=app_id, what=what))
+            packages[what] = [get_attributes(path, app_id, what, item)
+                              for item in items]
+
+        result.append((app_id, packages['components'],
+                       packages['dependencies']))
+    return result
@@ -1,21 +1,62 @@
+from importlib import import_module
+
+from opbeatcli.compat import Mapping
 from . import types
-from . import python, nodejs, ruby, deb, rpm, other
-
-
-DEPENDENCY_COLLECTORS = {
-    types.PYTHON_PACKAGE: python.PythonCollector,
-    types.NODE_PACKAGE: nodejs.NodeCollector,
-    types.RUBY_PACKAGE: ruby.RubyCollector,
-    types.DEB_PACKAGE: deb.DebCollector,
-    types.RPM_PACKAGE: rpm.RPMCollector,
-}
-
-
-DEPENDENCIES_BY_TYPE = {
-    types.PYTHON_PACKAGE: python.PythonDependency,
-    types.NODE_PACKAGE: nodejs.NodeDependency,
-    types.RUBY_PACKAGE: ruby.RubyDependency,
-    types.DEB_PACKAGE: deb.DebDependency,
-    types.RPM_PACKAGE: rpm.RPMDependency,
-    types.OTHER_PACKAGE: other.OtherDependency,
-}
+
+
+class LazyRegistry(Mapping):
+    """
+    A read-only ``{package_type: class}`` mapping whose classes are given
+    as ``'.module.Class'`` paths, and imported only when first accessed,
+    so that collectors we don't use are never imported.
+
+    """
+
+    def __init__(self, paths):
+        self._paths = paths
+        self._classes = {}
+
+    def __getitem__(self, package_type):
+        if package_type not in self._classes:
+            module, name = self._paths[package_type].rsplit('.', 1)
+            self._classes[package_type] = getattr(
+                import_module(module, __name__), name)
+        return self._classes[package_type]
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def copy(self):
+        return dict(self.items())
+
+
+DEPENDENCY_COLLECTORS = LazyRegistry({
+    types.PYTHON_PACKAGE: '.python.PythonCollector',
+    types.NODE_PACKAGE: '.nodejs.NodeCollector',
+    types.RUBY_PACKAGE: '.ruby.RubyCollector',
+    types.DEB_PACKAGE: '.deb.DebCollector',
+    types.RPM_PACKAGE: '.rpm.RPMCollector',
+})
+
+
+# Collectors that read package databases directly (--collect-native).
+NATIVE_DEPENDENCY_COLLECTORS = LazyRegistry({
+    types.PYTHON_PACKAGE: '.python.PythonSiteCollector',
+    types.NODE_PACKAGE: '.nodejs.NodeModulesCollector',
+    types.RUBY_PACKAGE: '.ruby.RubyGemsCollector',
+    types.DEB_PACKAGE: '.deb.DebStatusCollector',
+    types.RPM_PACKAGE: '.rpm.RPMDatabaseCollector',
+})
+
+
+DEPENDENCIES_BY_TYPE = LazyRegistry({
+    types.PYTHON_PACKAGE: '.python.PythonDependency',
+    types.NODE_PACKAGE: '.nodejs.NodeDependency',
+    types.RUBY_PACKAGE: '.ruby.RubyDependency',
+    types.DEB_PACKAGE: '.deb.DebDependency',
+    types.RPM_PACKAGE: '.rpm.RPMDependency',
+    types.OTHER_PACKAGE: '.other.OtherDependency',
+})
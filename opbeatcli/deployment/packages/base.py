@@ -1,12 +1,14 @@
 from __future__ import absolute_import
+import tempfile
 from subprocess import Popen, PIPE
 
+from opbeatcli import profiling
 from opbeatcli.log import logger
 from opbeatcli.exceptions import (
     InvalidArgumentError, DependencyParseError,
     ExternalCommandError, ExternalCommandNotFoundError
 )
-from ..vcs import VCS
+from ..vcs import VCS, VCSResolver, intern_string
 from .types import PACKAGE_TYPES
 
 
@@ -18,18 +20,31 @@ class BasePackage(object):
 
     """
 
+    # There can be tens of thousands of packages, so they have no instance
+    # ``__dict__`` (subclasses need to define ``__slots__``, too), their
+    # strings are interned, and equal ``VCS`` instances shared.
+    __slots__ = ('name', 'version', 'vcs')
+
     package_type = None
 
     def __init__(self, name, version=None, vcs=None):
         assert self.package_type in PACKAGE_TYPES
-        self.name = name
-        self.version = version
-        self.vcs = vcs
+        self.name = intern_string(name)
+        self.version = intern_string(version)
+        self.vcs = vcs.shared() if vcs is not None else None
 
     def __repr__(self):
         return (
             '{cls}(name={name!r}, version={version!r}, vcs={vcs!r})'
-            .format(cls=type(self).__name__, **self.__dict__)
+            .format(cls=type(self).__name__, **self.as_dict())
+        )
+
+    def as_dict(self):
+        """Return ``{attribute: value}``."""
+        return dict(
+            (attribute, getattr(self, attribute))
+            for cls in type(self).__mro__
+            for attribute in getattr(cls, '__slots__', ())
         )
 
     @classmethod
@@ -70,6 +85,8 @@ class BaseDependency(BasePackage):
     Each stack defines its own subclass.
 
     """
+    __slots__ = ()
+
     @classmethod
     def from_spec(cls, spec):
         # Dependency specs have a type which determines which dependency class
@@ -102,19 +119,35 @@ class BaseDependencyCollector(object):
     default_commands = []
     custom_commands = None
 
-    def __init__(self, custom_commands=None, ignore_missing=False):
+    #: Collectors whose output format is line-based set this to ``True``
+    #: and implement ``parse_lines()``, so that the output can be parsed
+    #: while the command is still running, without keeping all of it in
+    #: memory (see ``stream_command()``). The dependencies are yielded as
+    #: they are parsed, and the exit status is checked once the output
+    #: has been exhausted.
+    streaming = False
+
+    def __init__(self, custom_commands=None, ignore_missing=False,
+                 cache=None, vcs_resolver=None):
+        """
+        :type cache: opbeatcli.deployment.cache.CollectionCache
+        :type vcs_resolver: opbeatcli.deployment.vcs.VCSResolver
+
+        """
         self.logger = logger.getChild(type(self).__name__)
         self.custom_commands = custom_commands
         self.ignore_missing = ignore_missing
+        self.cache = cache
+        self.vcs_resolver = vcs_resolver or VCSResolver()
 
     def run_command(self, command):
-        COMMAND_NOT_FOUND = 127
-
+        """Run ``command`` and return its whole (stripped) output."""
         self.logger.debug('Executing command: %r', command)
 
-        process = Popen(command, shell=True, stdout=PIPE, stderr=PIPE)
-        stdout, stderr = process.communicate()
-        exit_status = process.poll()
+        with profiling.phase('run %s: %s' % (type(self).__name__, command)):
+            process = Popen(command, shell=True, stdout=PIPE, stderr=PIPE)
+            stdout, stderr = process.communicate()
+            exit_status = process.poll()
 
         stderr, stdout = stderr.strip().decode(), stdout.strip().decode()
         self.logger.debug('  exit status: %s', exit_status)
@@ -126,6 +159,59 @@ class BaseDependencyCollector(object):
             self.logger.debug('  stdout: \n    %s',
                               '\n    '.join(stdout.splitlines()))
 
+        self.check_exit_status(command, exit_status, stdout, stderr)
+
+        return stdout
+
+    def stream_command(self, command):
+        """
+        Run ``command`` and yield non-blank lines of its output as soon as
+        they are produced.
+
+        Stderr is spooled to a temporary file so that the command cannot
+        block on a full stderr pipe while we are reading stdout. The exit
+        status is checked once all of the output has been consumed.
+
+        """
+        # Not including what the caller does with the output in between
+        # (e.g., the parsing).
+        return profiling.iterate(
+            'run %s: %s' % (type(self).__name__, command),
+            self._stream_command(command))
+
+    def _stream_command(self, command):
+        self.logger.debug('Executing command (streaming): %r', command)
+
+        stderr_file = tempfile.TemporaryFile()
+        process = Popen(command, shell=True, bufsize=-1,
+                        stdout=PIPE, stderr=stderr_file)
+        try:
+            for line in iter(process.stdout.readline, b''):
+                line = line.decode().rstrip('\r\n')
+                if line.strip():
+                    yield line
+        finally:
+            process.stdout.close()
+            exit_status = process.wait()
+            stderr_file.seek(0)
+            stderr = stderr_file.read().strip().decode()
+            stderr_file.close()
+
+        self.logger.debug('  exit status: %s', exit_status)
+        if stderr:
+            self.logger.debug('  stderr: %s', stderr)
+
+        self.check_exit_status(command, exit_status, None, stderr)
+
+    def check_exit_status(self, command, exit_status, stdout, stderr):
+        """
+        :raises: ExternalCommandError if ``command`` failed.
+
+        ``stdout`` is ``None`` when the output has been streamed.
+
+        """
+        COMMAND_NOT_FOUND = 127
+
         if exit_status:
             msg = (
                 '{name} could not collect dependencies using the command:'
@@ -144,8 +230,6 @@ class BaseDependencyCollector(object):
             if not self.should_ignore_error(exit_status, stdout, stderr):
                 raise ExternalCommandError(msg)
 
-        return stdout
-
     def should_ignore_error(self, exit_status, stdout, stderr):
         """Called when a command exits with non-zero status."""
         return False
@@ -155,16 +239,86 @@ class BaseDependencyCollector(object):
 
         :raises: ParseError if the output cannot be parsed.
 
+        """
+        return self.parse_lines(output.splitlines())
+
+    def parse_lines(self, lines):
+        """Parse an iterable of command output lines and yield dependencies.
+
+        :raises: ParseError if the output cannot be parsed.
+
         """
         return []
 
+    def get_fingerprint_paths(self, command):
+        """
+        Return a list of files and directories the output of ``command``
+        depends on, or ``None`` if not known, in which case the results
+        are never cached.
+
+        """
+        return None
+
+    def collect_cached(self, kind, value, collect):
+        """
+        Yield dependencies collected from ``value`` (a command or a source,
+        depending on ``kind``) by calling ``collect()``, or from the cache
+        if enabled and none of the files they depend on has changed.
+
+        Results with VCS info are never cached, as the files the revisions
+        are read from aren't known in advance.
+
+        """
+        key = None
+        if self.cache is not None:
+            paths = self.get_fingerprint_paths(value)
+            if paths is not None:
+                key = self.cache.make_key(self, kind, value, paths)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    self.logger.debug('Using cached results for: %r', value)
+                    for dependency in cached:
+                        yield dependency
+                    return
+
+        dependencies = []
+        for dependency in collect():
+            if key:
+                dependencies.append(dependency)
+            yield dependency
+
+        if key:
+            if any(dependency.vcs for dependency in dependencies):
+                # The revisions of VCS checkouts (e.g., editable installs)
+                # change without any of the fingerprinted files changing.
+                self.logger.debug('Not caching results with VCS info: %r',
+                                  value)
+            else:
+                self.cache.set(key, dependencies)
+
+    def collect_command(self, command):
+        if self.streaming:
+            # ``stream_command()`` raises after the last line if the
+            # command has failed, so this can only be relied upon once
+            # exhausted (which is also when it gets cached).
+            return self.parse_lines(self.stream_command(command))
+        output = self.run_command(command)
+        with profiling.phase('parse %s: %s' % (type(self).__name__, command)):
+            return list(self.parse(output))
+
     def collect(self):
         """Return a list of dependencies."""
         commands = self.custom_commands or self.default_commands
         for command in commands:
-            output = self.run_command(command)
+            dependencies = self.collect_cached(
+                'command', command,
+                lambda: self.collect_command(command))
+            # Not including what the caller does with each dependency.
+            dependencies = profiling.iterate(
+                'collect %s: %s' % (type(self).__name__, command),
+                dependencies)
             try:
-                for dependency in self.parse(output):
+                for dependency in dependencies:
                     self.logger.debug('  %r', dependency)
                     yield dependency
             except DependencyParseError as e:
@@ -177,3 +331,61 @@ class BaseDependencyCollector(object):
                         message=str(e)
                     )
                 )
+
+
+class BaseNativeCollector(BaseDependencyCollector):
+    """
+    A collector that reads a package database directly instead of running
+    an external command and parsing its output.
+
+    Sources are collector-specific, e.g., a directory or a database file.
+
+    """
+
+    default_sources = []
+
+    def __init__(self, custom_sources=None, **kwargs):
+        super(BaseNativeCollector, self).__init__(**kwargs)
+        self.custom_sources = custom_sources
+
+    @classmethod
+    def get_default_sources(cls):
+        return list(cls.default_sources)
+
+    def read_source(self, source):
+        """Read ``source`` and yield dependencies.
+
+        :raises: DependencySourceNotFoundError if ``source`` doesn't exist.
+        :raises: DependencyParseError if ``source`` cannot be parsed.
+
+        """
+        return []
+
+    def get_fingerprint_paths(self, source):
+        return [source]
+
+    def collect(self):
+        """Return a list of dependencies."""
+        sources = self.custom_sources or self.get_default_sources()
+        for source in sources:
+            self.logger.debug('Reading source: %r', source)
+            dependencies = self.collect_cached(
+                'source', source,
+                lambda: self.read_source(source))
+            dependencies = profiling.iterate(
+                'collect %s: %s' % (type(self).__name__, source),
+                dependencies)
+            try:
+                for dependency in dependencies:
+                    self.logger.debug('  %r', dependency)
+                    yield dependency
+            except DependencyParseError as e:
+                raise DependencyParseError(
+                    '{name}: source {source!r} could'
+                    ' not be parsed: {message!r}'
+                    .format(
+                        name=type(self).__name__,
+                        source=source,
+                        message=str(e)
+                    )
+                )
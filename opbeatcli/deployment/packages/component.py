@@ -1,7 +1,7 @@
 import os
 
-from opbeatcli.exceptions import InvalidArgumentError
-from ..vcs import VCS, find_vcs_root
+from opbeatcli.exceptions import InvalidArgumentError, VCSError
+from ..vcs import VCSResolver, intern_string
 from .base import BasePackage
 from .types import COMPONENT_PACKAGE
 
@@ -11,10 +11,12 @@ class Component(BasePackage):
     A code component of the app being deployed.
 
     """
+    __slots__ = ('path',)
+
     package_type = COMPONENT_PACKAGE
 
     def __init__(self, path, *args, **kwargs):
-        self.path = path
+        self.path = intern_string(path)
         super(Component, self).__init__(*args, **kwargs)
 
     def __repr__(self):
@@ -23,14 +25,24 @@ class Component(BasePackage):
             ' version={version!r}, vcs={vcs!r})'
             .format(
                 cls=type(self).__name__,
-                **self.__dict__
+                **self.as_dict()
             )
         )
 
     @classmethod
-    def spec_to_kwargs(cls, spec):
+    def from_spec(cls, spec, vcs_resolver=None):
+        """
+        :arg spec: a ``dict`` of parsed and validated arguments.
+        :arg vcs_resolver: a ``VCSResolver`` shared by all the components.
+
+        """
+        return cls(**cls.spec_to_kwargs(spec, vcs_resolver=vcs_resolver))
+
+    @classmethod
+    def spec_to_kwargs(cls, spec, vcs_resolver=None):
         # Component specs have a path which can be used to fill in name
         # and VCS attributes.
+        vcs_resolver = vcs_resolver or VCSResolver()
 
         kwargs = super(Component, cls).spec_to_kwargs(spec)
 
@@ -41,9 +53,13 @@ class Component(BasePackage):
 
         # Try to fetch VCS info from path if no VCS attributes specified.
         vcs_from_path = None
-        vcs_root = find_vcs_root(path)
+        vcs_root = vcs_resolver.find_root(path)
         if not kwargs['vcs'] and vcs_root:
-            vcs_from_path = VCS.from_path(vcs_root)
+            try:
+                vcs_from_path = vcs_resolver.get_vcs(vcs_root)
+            except VCSError as e:
+                raise VCSError('--component: path:{path!r}: {error}'
+                               .format(path=path, error=e))
 
         if vcs_from_path:
             kwargs['vcs'] = vcs_from_path
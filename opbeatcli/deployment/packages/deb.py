@@ -1,5 +1,11 @@
-from opbeatcli.exceptions import DependencyParseError
-from .base import BaseDependency, BaseDependencyCollector
+import os
+import mmap
+import errno
+from collections import defaultdict
+
+from opbeatcli.exceptions import (DependencyParseError,
+                                  DependencySourceNotFoundError)
+from .base import BaseDependency, BaseDependencyCollector, BaseNativeCollector
 from .types import DEB_PACKAGE
 
 
@@ -8,9 +14,15 @@ class DebCollector(BaseDependencyCollector):
     default_commands = [
         r"dpkg-query --show --showformat='${package} ${version}\n'"
     ]
+    streaming = True
+
+    def get_fingerprint_paths(self, command):
+        if command in self.default_commands:
+            return DebStatusCollector.default_sources
+        return None
 
-    def parse(self, output):
-        for line in output.splitlines():
+    def parse_lines(self, lines):
+        for line in lines:
             try:
                 name, version = line.split()
             except ValueError:
@@ -19,5 +31,120 @@ class DebCollector(BaseDependencyCollector):
             yield DebDependency(name=name, version=version)
 
 
+# "<want> ok installed", where want is "install" or "hold".
+INSTALLED_STATUSES = set([
+    b'install ok installed',
+    b'hold ok installed',
+])
+
+
+def get_field(data, name, start, end):
+    """
+    Return the value of the field ``name`` of the stanza at
+    ``data[start:end]``, or ``None``. Only the value is copied out of
+    ``data``, which can be an ``mmap``.
+
+    Only single-line fields are supported. Lines of multi-line values
+    are indented, so they never match.
+
+    """
+    key = b'\n' + name + b': '
+    if data[start:start + len(key) - 1] == key[1:]:
+        # The first field of the stanza.
+        value_start = start + len(key) - 1
+    else:
+        value_start = data.find(key, start, end)
+        if value_start == -1:
+            return None
+        value_start += len(key)
+    value_end = data.find(b'\n', value_start, end)
+    if value_end == -1:
+        value_end = end
+    return data[value_start:value_end].strip()
+
+
+def iter_installed_packages(data):
+    """
+    Yield ``(package, version, architecture)`` byte strings for all the
+    installed packages in dpkg status ``data`` (the architecture is empty
+    if not known).
+
+    """
+    pos, size = 0, len(data)
+    while pos < size:
+        end = data.find(b'\n\n', pos)
+        if end == -1:
+            end = size
+
+        status = get_field(data, b'Status', pos, end)
+        if status in INSTALLED_STATUSES:
+            package = get_field(data, b'Package', pos, end)
+            version = get_field(data, b'Version', pos, end)
+            if not (package and version):
+                raise DependencyParseError(
+                    'invalid stanza at offset %d' % pos)
+            arch = get_field(data, b'Architecture', pos, end) or b''
+            yield package, version, arch
+
+        pos = end + 2
+        while data[pos:pos + 1] == b'\n':
+            pos += 1
+
+
+class DebStatusCollector(BaseNativeCollector):
+    """
+    Collect installed packages from the dpkg status database without
+    running ``dpkg-query``.
+
+    The database is memory-mapped and scanned stanza by stanza, so that
+    only the package names and versions are ever decoded.
+
+    With ``qualify_multiarch``, packages installed for more than one
+    architecture (multiarch, e.g., ``libc6`` for amd64 and i386) get their
+    names qualified with the architecture (``libc6:i386``). Otherwise,
+    like with ``dpkg-query --show``, the name is listed once per
+    architecture.
+
+    """
+    default_sources = ['/var/lib/dpkg/status']
+
+    def __init__(self, qualify_multiarch=False, **kwargs):
+        super(DebStatusCollector, self).__init__(**kwargs)
+        self.qualify_multiarch = qualify_multiarch
+
+    def read_source(self, source):
+        try:
+            f = open(source, 'rb')
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            raise DependencySourceNotFoundError(
+                '{name}: {source!r} not found'
+                .format(name=type(self).__name__, source=source)
+            )
+
+        with f:
+            if not os.fstat(f.fileno()).st_size:
+                # Empty files cannot be mapped.
+                return
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                packages = sorted(iter_installed_packages(data))
+            finally:
+                data.close()
+
+        architectures = defaultdict(set)
+        if self.qualify_multiarch:
+            for package, version, arch in packages:
+                architectures[package].add(arch)
+
+        for package, version, arch in packages:
+            name = package.decode('utf8')
+            if self.qualify_multiarch and len(architectures[package]) > 1:
+                name += ':' + arch.decode('utf8')
+            yield DebDependency(name=name, version=version.decode('utf8'))
+
+
 class DebDependency(BaseDependency):
+    __slots__ = ()
     package_type = DEB_PACKAGE
@@ -1,7 +1,13 @@
+import io
+import os
+import re
 import json
 
-from opbeatcli.exceptions import DependencyParseError
-from .base import BaseDependency, BaseDependencyCollector
+from opbeatcli.exceptions import (DependencyParseError,
+                                  DependencySourceNotFoundError)
+from opbeatcli.compat import scandir
+from opbeatcli.utils.concurrency import map_concurrently
+from .base import BaseDependency, BaseDependencyCollector, BaseNativeCollector
 from .types import NODE_PACKAGE
 
 
@@ -11,6 +17,18 @@ class NodeCollector(BaseDependencyCollector):
         'npm --json --local list',
     ]
 
+    def get_fingerprint_paths(self, command):
+        if command == 'npm --json --global list':
+            prefixes = [os.environ.get('NPM_CONFIG_PREFIX', ''),
+                        '/usr/local', '/usr']
+            return get_node_modules_fingerprint_paths([
+                os.path.join(prefix, 'lib', 'node_modules')
+                for prefix in prefixes if prefix
+            ])
+        if command == 'npm --json --local list':
+            return get_node_modules_fingerprint_paths(['node_modules'])
+        return None
+
     def should_ignore_error(self, exit_status, stdout, stderr):
         """
         Use `npm list` output as long as it is parseable JSON regardless
@@ -46,5 +64,222 @@ class NodeCollector(BaseDependencyCollector):
             yield NodeDependency(name=name, version=dep_data['version'])
 
 
+def get_node_modules_fingerprint_paths(node_modules_dirs):
+    """
+    Return files that change when packages in ``node_modules_dirs`` are
+    installed, removed or updated.
+
+    """
+    paths = []
+    for node_modules in node_modules_dirs:
+        project = os.path.dirname(os.path.abspath(node_modules))
+        paths.extend([
+            node_modules,
+            # Written by npm >= 7 on every change.
+            os.path.join(node_modules, '.package-lock.json'),
+            os.path.join(project, 'package.json'),
+            os.path.join(project, 'package-lock.json'),
+        ])
+    return paths
+
+
+def list_subdirs(path):
+    """Return a sorted list of ``(name, path)`` of directories in ``path``.
+
+    Symlinks to directories (e.g., ``npm link``) are included.
+
+    """
+    if scandir:
+        entries = [(entry.name, entry.path) for entry in scandir(path)
+                   if entry.is_dir()]
+    else:
+        entries = [(name, os.path.join(path, name))
+                   for name in os.listdir(path)
+                   if os.path.isdir(os.path.join(path, name))]
+    return sorted(entries)
+
+
+def list_packages(node_modules):
+    """Return a list of package directories in a ``node_modules``."""
+    packages = []
+    for name, path in list_subdirs(node_modules):
+        if name.startswith('.'):
+            # .bin, .cache, .pnpm, ...
+            continue
+        if name.startswith('@'):
+            # Scoped packages: node_modules/@scope/name
+            packages.extend(path for _, path in list_subdirs(path))
+        else:
+            packages.append(path)
+    return packages
+
+
+# Strings (possibly cut off at the end of what has been read so far), and
+# the characters structuring JSON. Numbers, literals and whitespace are
+# skipped over.
+JSON_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*(?P<end>"|\\?\Z)|[][{}:,]')
+
+READ_SIZE = 16 * 1024
+
+
+def read_top_level_strings(f, keys, read_size=READ_SIZE):
+    """
+    Return ``{key: value}`` of those of ``keys`` found in the top-level
+    JSON object read from ``f``. It is read in a single forward pass only
+    up to where all of them are found.
+
+    Return ``None`` if it cannot be told without parsing the JSON, e.g.,
+    when one of the ``keys`` has a value that isn't a string.
+
+    """
+    found = {}
+    depth = 0
+    # The last token in the top-level object, and the last key.
+    previous = key = None
+    buffered, pos, eof = '', 0, False
+    while len(found) < len(keys):
+        match = JSON_TOKEN_RE.search(buffered, pos)
+        if match is None or match.group('end') in ('', '\\'):
+            # The rest of the token, if any, hasn't been read yet.
+            if eof:
+                return None
+            buffered = buffered[match.start():] if match else ''
+            chunk = f.read(read_size)
+            eof = not chunk
+            buffered += chunk
+            pos = 0
+            continue
+
+        token, pos = match.group(), match.end()
+        if depth == 0 and token != '{':
+            return None
+        if depth == 1:
+            if token.startswith('"'):
+                try:
+                    string = json.loads(token)
+                except ValueError:
+                    return None
+                if previous == ':':
+                    if key in keys:
+                        found[key] = string
+                else:
+                    key = string
+            elif previous == ':' and key in keys:
+                return None
+            previous = token
+
+        if token in ('{', '['):
+            depth += 1
+        elif token in ('}', ']'):
+            depth -= 1
+            if not depth:
+                # The end of the object, without the rest of the keys.
+                break
+    return found
+
+
+def read_package_json(path):
+    """
+    Return ``(name, version)`` from a ``package.json``.
+
+    Manifests can be large (npm used to store whole READMEs in them) so
+    only as much of it is read as is needed to find both fields in the
+    top-level object, and the JSON is only parsed if that doesn't work.
+
+    """
+    with io.open(path, encoding='utf8', errors='replace') as f:
+        fields = read_top_level_strings(f, ('name', 'version'))
+        if fields is None:
+            f.seek(0)
+            try:
+                fields = json.load(f)
+            except ValueError as e:
+                raise DependencyParseError('%s: %s' % (path, e))
+    if not isinstance(fields, dict):
+        raise DependencyParseError('%s: not a JSON object' % path)
+    return fields.get('name'), fields.get('version')
+
+
+class NodeModulesCollector(BaseNativeCollector):
+    """
+    Collect installed node.js packages by walking ``node_modules``
+    directories instead of running ``npm list``.
+
+    A source is a project directory or a ``node_modules`` directory (e.g.,
+    the global ``/usr/local/lib/node_modules``). Hoisted, scoped and nested
+    packages are all included, each name and version once. The top-level
+    packages are walked by ``jobs`` threads (--collect-jobs).
+
+    """
+    default_sources = ['.']
+
+    def __init__(self, jobs=1, **kwargs):
+        super(NodeModulesCollector, self).__init__(**kwargs)
+        self.jobs = jobs
+
+    def get_node_modules(self, source):
+        node_modules = os.path.abspath(source)
+        if os.path.basename(node_modules) != 'node_modules':
+            node_modules = os.path.join(node_modules, 'node_modules')
+        return node_modules
+
+    def get_fingerprint_paths(self, source):
+        return get_node_modules_fingerprint_paths(
+            [self.get_node_modules(source)])
+
+    def read_source(self, source):
+        node_modules = self.get_node_modules(source)
+        if not os.path.isdir(node_modules):
+            raise DependencySourceNotFoundError(
+                '{name}: {path!r} not found'
+                .format(name=type(self).__name__, path=node_modules)
+            )
+
+        results = map_concurrently(
+            self.walk_package,
+            list_packages(node_modules),
+            jobs=self.jobs
+        )
+
+        packages = set()
+        for result in results:
+            packages.update(result)
+
+        for name, version in sorted(packages):
+            yield NodeDependency(name=name, version=version)
+
+    def walk_package(self, path):
+        """
+        Return a set of ``(name, version)`` for the package at ``path``
+        and all packages nested in its ``node_modules``.
+
+        """
+        packages = set()
+        visited = set()
+        stack = [path]
+        while stack:
+            path = stack.pop()
+            real_path = os.path.realpath(path)
+            if real_path in visited:
+                # Symlink cycle.
+                continue
+            visited.add(real_path)
+
+            manifest = os.path.join(path, 'package.json')
+            if os.path.isfile(manifest):
+                name, version = read_package_json(manifest)
+                if name and version:
+                    packages.add((name, version))
+                else:
+                    self.logger.debug('No name or version in %r', manifest)
+
+            nested = os.path.join(path, 'node_modules')
+            if os.path.isdir(nested):
+                stack.extend(list_packages(nested))
+
+        return packages
+
+
 class NodeDependency(BaseDependency):
+    __slots__ = ()
     package_type = NODE_PACKAGE
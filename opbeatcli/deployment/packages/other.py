@@ -6,4 +6,6 @@ from .types import OTHER_PACKAGE
 
 class OtherDependency(BaseDependency):
 
+    __slots__ = ()
+
     package_type = OTHER_PACKAGE
@@ -4,9 +4,17 @@ Python requirements and their discovery.
 http://www.pip-installer.org/en/latest/requirements.html#the-requirements-file-format
 
 """
-from opbeatcli.exceptions import DependencyParseError
-from opbeatcli.compat import urlsplit
-from .base import BaseDependencyCollector, BaseDependency
+import io
+import os
+import sys
+import json
+from glob import glob
+
+from opbeatcli.exceptions import (DependencyParseError,
+                                  DependencySourceNotFoundError)
+from opbeatcli.compat import urlsplit, unquote, which
+from .base import (BaseDependencyCollector, BaseNativeCollector,
+                   BaseDependency)
 from .types import PYTHON_PACKAGE
 from ..vcs import VCS, VCS_NAME_MAP
 
@@ -79,10 +87,21 @@ class PythonCollector(BaseDependencyCollector):
     default_commands = [
         'pip freeze'
     ]
+    streaming = True
+
+    def get_fingerprint_paths(self, command):
+        if command not in self.default_commands:
+            return None
+        pip = which('pip')
+        if not pip:
+            return None
+        # <prefix>/bin/pip, and `pip freeze' includes the user site too.
+        prefix = os.path.dirname(os.path.dirname(pip))
+        return [pip] + find_site_dirs(prefix) + find_site_dirs('~/.local')
 
-    def parse(self, output):
+    def parse_lines(self, lines):
         # Note: we only parse `pip freeze' output, not raw dependency specs.
-        for line in output.splitlines():
+        for line in lines:
             line = line.strip()
             if not line or line.startswith('#'):
                 continue
@@ -109,5 +128,218 @@ class PythonCollector(BaseDependencyCollector):
 
 class PythonDependency(BaseDependency):
 
+    __slots__ = ()
+
     package_type = PYTHON_PACKAGE
 
+
+# Where site directories live relative to an installation prefix.
+SITE_DIR_PATTERNS = [
+    'lib/python*/site-packages',
+    'lib/python*/dist-packages',
+    'lib64/python*/site-packages',
+    'local/lib/python*/dist-packages',
+    'Lib/site-packages',
+]
+
+
+# The distributions `pip freeze' leaves out.
+FREEZE_EXCLUDED = frozenset(['pip', 'setuptools', 'distribute', 'wheel',
+                             'python'])
+
+
+def find_site_dirs(path):
+    """
+    Return a list of site directories for ``path``, which is either an
+    installation prefix (e.g., a virtualenv) or a site directory itself.
+
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    if not os.path.isdir(path):
+        return []
+
+    if os.path.basename(path) in ('site-packages', 'dist-packages'):
+        return [path]
+
+    site_dirs, seen = [], set()
+    for pattern in SITE_DIR_PATTERNS:
+        for site_dir in sorted(glob(os.path.join(path, pattern))):
+            # lib64 is often a symlink to lib.
+            real_path = os.path.realpath(site_dir)
+            if real_path not in seen and os.path.isdir(site_dir):
+                seen.add(real_path)
+                site_dirs.append(site_dir)
+
+    if not site_dirs and any(
+            entry.endswith(('.dist-info', '.egg-info', '.egg-link'))
+            for entry in os.listdir(path)):
+        # A site directory with a custom name (e.g., from PYTHONPATH).
+        site_dirs.append(path)
+
+    return site_dirs
+
+
+def read_metadata(path):
+    """
+    Return ``(name, version)`` from the headers of a ``PKG-INFO`` or
+    ``METADATA`` file. Only the headers are read, not the long description.
+
+    """
+    name = version = None
+    with io.open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if not line.strip():
+                break
+            if line.startswith('Name:'):
+                name = line[5:].strip()
+            elif line.startswith('Version:'):
+                version = line[8:].strip()
+            if name and version:
+                break
+    return name, version
+
+
+def editable_kwargs(project_dir, vcs_resolver):
+    """
+    Return the same VCS-related keyword arguments for an editable
+    installed from ``project_dir`` as ``parse_editable()`` does for
+    its ``pip freeze`` line, or ``None`` if it isn't a VCS checkout.
+
+    :type vcs_resolver: opbeatcli.deployment.vcs.VCSResolver
+    :raises: VCSError if the VCS info cannot be read.
+
+    """
+    vcs_root = vcs_resolver.find_root(project_dir)
+    vcs = vcs_resolver.get_vcs(vcs_root) if vcs_root else None
+    if not vcs:
+        return None
+    return {
+        # See parse_editable().
+        'version': None if vcs.vcs_type == VCS_NAME_MAP['svn'] else 'dev',
+        'vcs': VCS(
+            vcs_type=vcs.vcs_type,
+            rev=vcs.rev,
+            remote_url=vcs.remote_url,
+        ),
+    }
+
+
+class PythonSiteCollector(BaseNativeCollector):
+    """
+    Collect installed Python distributions by reading their metadata from
+    site directories directly, i.e., without running ``pip freeze``.
+
+    A source is an installation prefix (e.g., a virtualenv directory or
+    ``sys.prefix``) or a site directory. These are understood:
+
+        *.dist-info/METADATA (+ PEP 610 direct_url.json)
+        *.egg-info/PKG-INFO, *.egg-info files, *.egg/EGG-INFO/PKG-INFO
+        *.egg-link (``setup.py develop``/``pip install -e``)
+
+    Like ``pip freeze``, it leaves out pip itself and the packaging tools
+    (``FREEZE_EXCLUDED``).
+
+    """
+
+    @classmethod
+    def get_default_sources(cls):
+        return [sys.prefix]
+
+    def get_fingerprint_paths(self, source):
+        return find_site_dirs(source)
+
+    def read_source(self, source):
+        site_dirs = find_site_dirs(source)
+        if not site_dirs:
+            raise DependencySourceNotFoundError(
+                '{name}: no site directory found in {source!r}'
+                .format(name=type(self).__name__, source=source)
+            )
+
+        dependencies = {}
+        for site_dir in site_dirs:
+            for dependency in self.read_site_dir(site_dir):
+                key = dependency.name.lower()
+                if key in FREEZE_EXCLUDED:
+                    continue
+                # Like with `sys.path', the first one found wins.
+                dependencies.setdefault(key, dependency)
+
+        # `pip freeze' order.
+        for key in sorted(dependencies):
+            yield dependencies[key]
+
+    def read_site_dir(self, site_dir):
+        for entry in os.listdir(site_dir):
+            path = os.path.join(site_dir, entry)
+            direct_url_path = None
+            project_dir = None
+
+            if entry.endswith('.dist-info'):
+                metadata_path = os.path.join(path, 'METADATA')
+                direct_url_path = os.path.join(path, 'direct_url.json')
+            elif entry.endswith('.egg-info'):
+                metadata_path = (os.path.join(path, 'PKG-INFO')
+                                 if os.path.isdir(path) else path)
+            elif entry.endswith('.egg'):
+                metadata_path = os.path.join(path, 'EGG-INFO', 'PKG-INFO')
+            elif entry.endswith('.egg-link'):
+                project_dir = self.read_egg_link(path)
+                metadata_path = project_dir and self.find_egg_info(
+                    project_dir)
+            else:
+                continue
+
+            if not metadata_path or not os.path.isfile(metadata_path):
+                self.logger.debug('No metadata found for %r', path)
+                continue
+
+            name, version = read_metadata(metadata_path)
+            if not name:
+                self.logger.debug('Invalid metadata in %r', metadata_path)
+                continue
+
+            kwargs = {'name': name, 'version': version}
+
+            if direct_url_path and os.path.isfile(direct_url_path):
+                direct_url = self.read_direct_url(direct_url_path)
+                if direct_url.get('dir_info', {}).get('editable'):
+                    project_dir = unquote(urlsplit(direct_url['url']).path)
+                elif 'vcs_info' in direct_url:
+                    vcs_info = direct_url['vcs_info']
+                    kwargs['vcs'] = VCS(
+                        vcs_type=VCS_NAME_MAP.get(vcs_info.get('vcs')),
+                        rev=vcs_info.get('commit_id'),
+                        remote_url=direct_url.get('url'),
+                    )
+
+            if project_dir:
+                kwargs.update(
+                    editable_kwargs(project_dir, self.vcs_resolver) or {})
+
+            yield PythonDependency(**kwargs)
+
+    def read_egg_link(self, path):
+        """Return the project directory an ``.egg-link`` points to."""
+        with io.open(path, encoding='utf-8', errors='replace') as f:
+            project_dir = f.readline().strip()
+        if project_dir:
+            return os.path.normpath(
+                os.path.join(os.path.dirname(path), project_dir))
+
+    def find_egg_info(self, project_dir):
+        egg_infos = sorted(glob(os.path.join(project_dir, '*.egg-info')))
+        if not egg_infos:
+            # E.g., projects using `package_dir={"": "src"}'.
+            egg_infos = sorted(
+                glob(os.path.join(project_dir, '*', '*.egg-info')))
+        if egg_infos:
+            return os.path.join(egg_infos[0], 'PKG-INFO')
+
+    def read_direct_url(self, path):
+        try:
+            with io.open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except ValueError as e:
+            raise DependencyParseError('%s: %s' % (path, e))
+        return data if isinstance(data, dict) else {}
@@ -1,16 +1,36 @@
-from opbeatcli.exceptions import DependencyParseError
-from .base import BaseDependency, BaseDependencyCollector
+import os
+import struct
+
+from opbeatcli.exceptions import (DependencyParseError,
+                                  DependencySourceNotFoundError)
+from opbeatcli.compat import quote, shell_quote
+from .base import BaseDependency, BaseDependencyCollector, BaseNativeCollector
 from .types import RPM_PACKAGE
 
 
+RPM_QUERY_ARGS = (
+    r"--query --all --queryformat='%{NAME} %{VERSION}%{RELEASE}\n'"
+)
+
+
 class RPMCollector(BaseDependencyCollector):
 
     default_commands = [
-        r"rpm --query --all --queryformat='%{NAME} %{VERSION}%{RELEASE}\n'"
+        'rpm ' + RPM_QUERY_ARGS
     ]
+    streaming = True
+
+    def get_fingerprint_paths(self, command):
+        if command in self.default_commands:
+            return [
+                os.path.join(os.path.dirname(path), filename)
+                for path in RPMDatabaseCollector.default_sources
+                for filename in RPM_DATABASE_FILES
+            ]
+        return None
 
-    def parse(self, output):
-        for line in output.splitlines():
+    def parse_lines(self, lines):
+        for line in lines:
             try:
                 name, version = line.split()
             except ValueError:
@@ -18,5 +38,156 @@ class RPMCollector(BaseDependencyCollector):
             yield RPMDependency(name=name, version=version)
 
 
+# Files whose changes mean that the installed packages have changed, for
+# each of the rpmdb backends (sqlite, ndb and bdb).
+RPM_DATABASE_FILES = [
+    'rpmdb.sqlite',
+    'rpmdb.sqlite-wal',
+    'Packages.db',
+    'Packages',
+]
+
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+
+RPM_STRING_TYPE = 6
+RPM_I18NSTRING_TYPE = 9
+
+HEADER_INTRO = struct.Struct('>ii')  # index length, data length
+HEADER_INDEX_ENTRY = struct.Struct('>iiii')  # tag, type, offset, count
+
+
+def read_header_strings(blob, tags):
+    """
+    Return a ``{tag: value}`` dict of string ``tags`` found in an RPM
+    header ``blob`` (as stored in the rpmdb, i.e., without the magic).
+
+    """
+    try:
+        index_length, data_length = HEADER_INTRO.unpack_from(blob, 0)
+        data_start = HEADER_INTRO.size + index_length * HEADER_INDEX_ENTRY.size
+        if index_length < 0 or data_start + data_length > len(blob):
+            raise struct.error('invalid header lengths')
+
+        values = {}
+        for i in range(index_length):
+            tag, tag_type, offset, count = HEADER_INDEX_ENTRY.unpack_from(
+                blob, HEADER_INTRO.size + i * HEADER_INDEX_ENTRY.size)
+            if (tag in tags
+                    and tag_type in (RPM_STRING_TYPE, RPM_I18NSTRING_TYPE)):
+                start = data_start + offset
+                end = blob.find(b'\0', start, data_start + data_length)
+                if end == -1:
+                    raise struct.error('unterminated string')
+                values[tag] = blob[start:end].decode('utf8', 'replace')
+    except struct.error as e:
+        raise DependencyParseError('invalid RPM header: %s' % e)
+    return values
+
+
+def connect_read_only(path):
+    """
+    Return a connection to the SQLite database at ``path``, opened so that
+    it's never written to, or ``None`` if that isn't possible: without
+    the ``sqlite3`` module, or on Python < 3.4, where it cannot open
+    databases read-only.
+
+    """
+    try:
+        import sqlite3
+    except ImportError:  # Python built without SQLite
+        return None
+    try:
+        return sqlite3.connect(
+            'file:%s?mode=ro' % quote(os.path.abspath(path)),
+            uri=True)
+    except TypeError:  # Python < 3.4
+        return None
+
+
+class RPMDatabaseCollector(BaseNativeCollector):
+    """
+    Collect installed packages by reading the rpmdb directly, read-only,
+    without running ``rpm --query --all`` (which is slow and locks the
+    database).
+
+    Only the SQLite backend (``rpmdb.sqlite``; Fedora 33+, RHEL 9+) is
+    supported. A source is the database file or the rpm dbpath directory.
+
+    Where the database cannot be opened read-only (see
+    ``connect_read_only()``), ``rpm --query --all`` is run instead.
+
+    """
+    default_sources = [
+        '/var/lib/rpm/rpmdb.sqlite',
+        '/usr/lib/sysimage/rpm/rpmdb.sqlite',
+    ]
+
+    @classmethod
+    def get_default_sources(cls):
+        # Only one of the locations is used on any given host.
+        for source in cls.default_sources:
+            if os.path.exists(source):
+                return [source]
+        return cls.default_sources[:1]
+
+    def get_fingerprint_paths(self, source):
+        if os.path.isdir(source):
+            source = os.path.join(source, 'rpmdb.sqlite')
+        return [source, source + '-wal']
+
+    def read_source(self, source):
+        if os.path.isdir(source):
+            source = os.path.join(source, 'rpmdb.sqlite')
+        if not os.path.isfile(source):
+            raise DependencySourceNotFoundError(
+                '{name}: {source!r} not found (note that only the SQLite'
+                ' rpmdb backend is supported)'
+                .format(name=type(self).__name__, source=source)
+            )
+
+        connection = self.connect(source)
+        if connection is None:
+            self.logger.debug('Cannot open %r read-only, querying rpm',
+                              source)
+            for dependency in self.query_rpm(source):
+                yield dependency
+            return
+
+        import sqlite3
+
+        tags = (RPMTAG_NAME, RPMTAG_VERSION, RPMTAG_RELEASE)
+        try:
+            rows = connection.execute(
+                'SELECT blob FROM Packages ORDER BY hnum')
+            for (blob,) in rows:
+                values = read_header_strings(bytes(blob), tags)
+                if RPMTAG_NAME not in values:
+                    raise DependencyParseError('package without a name')
+                yield RPMDependency(
+                    name=values[RPMTAG_NAME],
+                    # The same as the default command's
+                    # %{VERSION}%{RELEASE}.
+                    version=(values.get(RPMTAG_VERSION, '')
+                             + values.get(RPMTAG_RELEASE, '')),
+                )
+        except sqlite3.DatabaseError as e:
+            raise DependencyParseError(str(e))
+        finally:
+            connection.close()
+
+    def connect(self, source):
+        return connect_read_only(source)
+
+    def query_rpm(self, source):
+        """Return dependencies from the rpm database ``source``."""
+        command = 'rpm --dbpath %s %s' % (
+            shell_quote(os.path.dirname(os.path.abspath(source))),
+            RPM_QUERY_ARGS)
+        return list(RPMCollector().parse_lines(self.stream_command(command)))
+
+
 class RPMDependency(BaseDependency):
+    __slots__ = ()
     package_type = RPM_PACKAGE
@@ -1,7 +1,11 @@
+import os
 import re
+from glob import glob
+from collections import defaultdict
 
-from opbeatcli.exceptions import DependencyParseError
-from .base import BaseDependencyCollector, BaseDependency
+from opbeatcli.exceptions import (DependencyParseError,
+                                  DependencySourceNotFoundError)
+from .base import BaseDependencyCollector, BaseNativeCollector, BaseDependency
 from .types import RUBY_PACKAGE
 
 
@@ -14,9 +18,15 @@ class RubyCollector(BaseDependencyCollector):
     default_commands = [
         'gem list'
     ]
+    streaming = True
 
-    def parse(self, output):
-        for line in output.strip().splitlines():
+    def get_fingerprint_paths(self, command):
+        if command in self.default_commands:
+            return get_specification_dirs(find_gem_dirs())
+        return None
+
+    def parse_lines(self, lines):
+        for line in lines:
             if not GEM_RE.match(line):
                 raise DependencyParseError(line)
             i = line.index(' ')
@@ -26,5 +36,192 @@ class RubyCollector(BaseDependencyCollector):
                 yield RubyDependency(name=name, version=version)
 
 
+# Where RubyGems and Bundler install gems when not configured otherwise.
+DEFAULT_GEM_DIR_PATTERNS = [
+    '/var/lib/gems/*',
+    '/usr/lib/ruby/gems/*',
+    '/usr/lib64/ruby/gems/*',
+    '/usr/local/lib/ruby/gems/*',
+    '~/.gem/ruby/*',
+]
+BUNDLER_GEM_DIR_PATTERN = 'ruby/*'
+
+
+def expand_gem_dir(path):
+    """
+    Return a list of gem directories (i.e., with ``specifications``) for
+    ``path``, which can also be a Bundler path such as ``vendor/bundle``.
+
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    if os.path.isdir(os.path.join(path, 'specifications')):
+        return [path]
+    return [gem_dir for gem_dir in sorted(
+        glob(os.path.join(path, BUNDLER_GEM_DIR_PATTERN)))
+        if os.path.isdir(os.path.join(gem_dir, 'specifications'))]
+
+
+def find_gem_dirs():
+    """
+    Return a list of gem directories the same way RubyGems does, i.e.,
+    $GEM_HOME and $GEM_PATH if set, otherwise the default locations,
+    plus the project's Bundler ``vendor/bundle``.
+
+    """
+    paths = [os.environ.get('GEM_HOME', '')]
+    paths.extend(os.environ.get('GEM_PATH', '').split(os.pathsep))
+    paths = [path for path in paths if path]
+
+    if not paths:
+        for pattern in DEFAULT_GEM_DIR_PATTERNS:
+            paths.extend(sorted(glob(os.path.expanduser(pattern))))
+
+    paths.append(os.environ.get('BUNDLE_PATH', 'vendor/bundle'))
+
+    gem_dirs = []
+    for path in paths:
+        for gem_dir in expand_gem_dir(path):
+            if gem_dir not in gem_dirs:
+                gem_dirs.append(gem_dir)
+    return gem_dirs
+
+
+def get_specification_dirs(gem_dirs):
+    """Return a list of gem specification directories in ``gem_dirs``."""
+    spec_dirs = []
+    for gem_dir in gem_dirs:
+        specifications = os.path.join(gem_dir, 'specifications')
+        spec_dirs.extend([specifications,
+                          os.path.join(specifications, 'default')])
+    return spec_dirs
+
+
+# Gem versions cannot contain dashes (pre-releases use dots: 1.0.0.rc1).
+GEM_VERSION_RE = re.compile(r'^[0-9]+(\.[0-9A-Za-z]+)*$')
+
+
+def is_gem_platform(parts):
+    """
+    Return whether the dash-separated ``parts`` are those of a gem
+    platform (cpu-os[-version], e.g., ``x86_64-linux``, ``arm64-darwin-21``
+    or ``java``), or there are none.
+
+    """
+    return (len(parts) <= 3
+            and all(part and not part[:1].isdigit() for part in parts[:2]))
+
+
+def parse_gemspec_filename(filename):
+    """
+    Return ``(name, version)`` from a specification file name, such as
+    ``net-http-persistent-2.9.gemspec`` or
+    ``nokogiri-1.13.1-x86_64-linux.gemspec`` (the platform is dropped).
+
+    Names can contain dashes followed by digits (``foo-2fa-1.0.gemspec``),
+    so the version is the first part that is a version and is followed
+    only by a platform, if anything.
+
+    """
+    parts = filename[:-len('.gemspec')].split('-')
+    for i in range(1, len(parts)):
+        if GEM_VERSION_RE.match(parts[i]) and is_gem_platform(parts[i + 1:]):
+            return '-'.join(parts[:i]), parts[i]
+    raise DependencyParseError('invalid gem specification: %r' % filename)
+
+
+# The segments of a gem version, e.g., 1, 0, 0, 'rc', 1 for 1.0.0.rc1.
+GEM_VERSION_SEGMENT_RE = re.compile(r'[0-9]+|[A-Za-z]+')
+
+
+class GemVersionKey(object):
+    """
+    A sort key ordering gem versions the same way ``Gem::Version`` does:
+    missing segments count as 0, and letters (pre-releases) come before
+    any number, so that e.g. 1.0.0.rc1 < 1.0.0 < 1.0.0.1.
+
+    """
+    __slots__ = ('segments',)
+
+    # Numbers sort after letters.
+    ZERO = (1, 0)
+
+    def __init__(self, version):
+        segments = [
+            (1, int(segment)) if segment.isdigit() else (0, segment)
+            for segment in GEM_VERSION_SEGMENT_RE.findall(version)
+        ]
+        # Like ``Gem::Version#canonical_segments``, without the trailing
+        # zeros of the release and of the pre-release part (1.0.0.0.a is
+        # the same as 1.a).
+        split = next((i for i, segment in enumerate(segments)
+                      if segment < self.ZERO), len(segments))
+        self.segments = (self.strip_zeros(segments[:split])
+                         + self.strip_zeros(segments[split:]))
+
+    @classmethod
+    def strip_zeros(cls, segments):
+        while segments and segments[-1] == cls.ZERO:
+            segments = segments[:-1]
+        return segments
+
+    def __lt__(self, other):
+        length = max(len(self.segments), len(other.segments))
+        return (
+            self.segments + [self.ZERO] * (length - len(self.segments))
+            < other.segments + [self.ZERO] * (length - len(other.segments))
+        )
+
+
+class RubyGemsCollector(BaseNativeCollector):
+    """
+    Collect installed gems from the file names in gem specification
+    directories instead of running ``gem list``.
+
+    A source is a list of gem directories (or Bundler paths), separated
+    the same way as in $GEM_PATH. The default one is found the same way
+    RubyGems would find it (see ``find_gem_dirs()``). Default gems are
+    included, and the output is the same as that of ``gem list``: sorted
+    by name, and with the newest version first.
+
+    """
+
+    @classmethod
+    def get_default_sources(cls):
+        return [os.pathsep.join(find_gem_dirs())]
+
+    def get_gem_dirs(self, source):
+        gem_dirs = []
+        for path in source.split(os.pathsep):
+            if path:
+                gem_dirs.extend(expand_gem_dir(path))
+        return gem_dirs
+
+    def get_fingerprint_paths(self, source):
+        return get_specification_dirs(self.get_gem_dirs(source))
+
+    def read_source(self, source):
+        gem_dirs = self.get_gem_dirs(source)
+        if not gem_dirs:
+            raise DependencySourceNotFoundError(
+                '{name}: no gem directories found in {source!r}'
+                .format(name=type(self).__name__, source=source)
+            )
+
+        versions = defaultdict(set)
+        for spec_dir in get_specification_dirs(gem_dirs):
+            if not os.path.isdir(spec_dir):
+                continue
+            for filename in os.listdir(spec_dir):
+                if filename.endswith('.gemspec'):
+                    name, version = parse_gemspec_filename(filename)
+                    versions[name].add(version)
+
+        for name in sorted(versions):
+            for version in sorted(versions[name], key=GemVersionKey,
+                                  reverse=True):
+                yield RubyDependency(name=name, version=version)
+
+
 class RubyDependency(BaseDependency):
+    __slots__ = ()
     package_type = RUBY_PACKAGE
@@ -4,6 +4,8 @@ Serialization of objects to the data format required by the API.
 This implementation is for version 1 of the API.
 
 """
+import json
+
 from .packages.component import Component
 
 
@@ -17,6 +19,32 @@ def deployment(local_hostname, packages):
     }
 
 
+def iter_deployment_json(local_hostname, packages, separators=(',', ':')):
+    """
+    Yield the JSON of ``deployment()`` with sorted keys in fragments, one
+    per package, so that ``packages`` can be consumed (and collected)
+    lazily, and the whole data is never in memory at once.
+
+    """
+    item_separator, key_separator = separators
+
+    def dumps(obj):
+        return json.dumps(obj, separators=separators, sort_keys=True)
+
+    yield ''.join([
+        '{',
+        dumps('machines'), key_separator,
+        dumps([{'hostname': local_hostname}]), item_separator,
+        dumps('releases'), key_separator,
+        '[',
+    ])
+    separator = ''
+    for pkg in packages:
+        yield separator + dumps(package(pkg))
+        separator = item_separator
+    yield ']}'
+
+
 def package(pkg):
     """
     :type pkg: BasePackage
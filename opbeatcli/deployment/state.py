@@ -0,0 +1,131 @@
+"""
+The last deployment successfully registered for an app on a host.
+
+With ``--skip-unchanged``, a canonical hash of the serialized deployment
+is compared against the one stored for the same server, organization,
+app and hostname, and the deployment is not sent again when nothing has
+changed. Otherwise, the releases are diffed against the stored ones so
+that what has changed is reported.
+
+"""
+import os
+import json
+import hashlib
+
+from opbeatcli import settings
+from opbeatcli.utils.files import makedirs, write_atomically
+
+
+def canonical_json(data):
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+
+def release_key(release):
+    """Identify a release by its module type, name, and path."""
+    module = release['module']
+    return module['type'], module['name'], release.get('path', '')
+
+
+def canonical_releases(releases):
+    """
+    Return ``releases`` as a sorted list of ``(key, canonical_json)``
+    tuples, which makes them independent of the collection order.
+
+    """
+    return sorted((release_key(release), canonical_json(release))
+                  for release in releases)
+
+
+def canonical_hash(data):
+    """Return a SHA-256 hex digest of the serialized deployment ``data``."""
+    canonical = dict(data, releases=[
+        value for key, value in canonical_releases(data['releases'])])
+    return hashlib.sha256(canonical_json(canonical).encode('utf8')).hexdigest()
+
+
+def merge_diff(old, new, key=lambda item: item):
+    """
+    Compare the sorted lists ``old`` and ``new`` by ``key`` in a single,
+    linear, sorted-merge pass.
+
+    :return: ``(only_old, only_new, pairs)``, where ``pairs`` has
+             ``(old_item, new_item)`` tuples of items with equal keys.
+
+    """
+    only_old, only_new, pairs = [], [], []
+    i, j = 0, 0
+    while i < len(old) and j < len(new):
+        old_key, new_key = key(old[i]), key(new[j])
+        if old_key < new_key:
+            only_old.append(old[i])
+            i += 1
+        elif new_key < old_key:
+            only_new.append(new[j])
+            j += 1
+        else:
+            pairs.append((old[i], new[j]))
+            i += 1
+            j += 1
+    only_old.extend(old[i:])
+    only_new.extend(new[j:])
+    return only_old, only_new, pairs
+
+
+def diff_releases(old, new):
+    """
+    Diff two lists of canonical releases (see ``canonical_releases()``).
+
+    :return:
+        ``(added, removed, changed)`` lists of canonical releases, where
+        ``changed`` has ``(old, new)`` tuples of releases with the same
+        key (e.g., a package with a different version).
+
+    """
+    removed, added, _ = merge_diff(old, new)
+    removed, added, changed = merge_diff(removed, added,
+                                         key=lambda item: item[0])
+    return added, removed, changed
+
+
+class DeploymentState(object):
+    """
+    The stored state of the last deployment registered for ``server``,
+    ``organization_id``, ``app_id``, and ``hostname``.
+
+    """
+
+    def __init__(self, server, organization_id, app_id, hostname,
+                 path=settings.CACHE_DIR):
+        self.identity = [server, organization_id, app_id, hostname]
+        self.path = os.path.join(
+            os.path.expanduser(path),
+            'deployments',
+            hashlib.sha1(canonical_json(self.identity).encode('utf8'))
+            .hexdigest() + '.json'
+        )
+
+    def load(self):
+        """
+        Return a ``(hash, canonical_releases)`` tuple of the last
+        registered deployment, or ``None``.
+
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                state = json.loads(f.read().decode('utf8'))
+            if state['identity'] != self.identity:
+                return None
+            return state['hash'], [(tuple(key), value)
+                                   for key, value in state['releases']]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, data):
+        """Store serialized deployment ``data`` as the last registered."""
+        state = {
+            'identity': self.identity,
+            'hash': canonical_hash(data),
+            'releases': canonical_releases(data['releases']),
+        }
+        makedirs(os.path.dirname(self.path))
+        write_atomically(self.path, canonical_json(state).encode('utf8'))
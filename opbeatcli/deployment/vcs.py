@@ -1,11 +1,15 @@
 import os
-from pip import InstallationError
+import sys
+import weakref
+import threading
+from subprocess import CalledProcessError
 
-from pip.vcs import vcs
-
-from opbeatcli.exceptions import InvalidArgumentError
+from opbeatcli import profiling
+from opbeatcli.exceptions import InvalidArgumentError, VCSError
 from opbeatcli.utils.ssh_config import SSHConfig
-from opbeatcli.compat import urlsplit, urlunsplit, check_output
+from opbeatcli.compat import urlsplit, urlunsplit, check_output, intern
+from opbeatcli.log import logger
+from .git import read_git_metadata, UnsupportedGitLayout
 
 
 # {'commonly used short name': 'long name'}
@@ -26,16 +30,118 @@ os.environ.pop('GIT_DIR', None)
 os.environ.pop('GIT_WORK_TREE', None)
 
 
+# The files or directories that make a directory a VCS root, in the same
+# order in which pip checks them.
+VCS_MARKERS = [
+    ('.git', 'git'),
+    ('.hg', 'hg'),
+    ('.svn', 'svn'),
+    ('.bzr', 'bzr'),
+]
+
+
 def find_vcs_root(path):
-    """Walk up the hierarchy and return the first VCS root found."""
-    while path and path != '/':
-        if is_vcs_root(path):
-            return path
-        path = os.path.split(path)[0]
+    """
+    Walk up the hierarchy and return the first VCS root found.
+
+    Nothing is remembered, so use a ``VCSResolver`` for many paths.
+
+    """
+    return VCSResolver().find_root(path)
 
 
 def is_vcs_root(path):
-    return vcs.get_backend_name(path) is not None
+    return get_vcs_marker(path) is not None
+
+
+def is_vcs_error(error):
+    """
+    Return whether ``error`` raised by ``VCS.from_path()`` means that the
+    VCS info cannot be read (e.g., a failed or missing VCS command), as
+    opposed to a bug.
+
+    """
+    if isinstance(error, (EnvironmentError, ValueError, CalledProcessError)):
+        return True
+    # Raised by pip's VCS backends, so pip has been imported if it's one.
+    pip_exceptions = sys.modules.get('pip.exceptions')
+    return (pip_exceptions is not None
+            and isinstance(error, pip_exceptions.PipError))
+
+
+def get_vcs_marker(path):
+    """Return the short name of the VCS with a marker in ``path``, if any."""
+    for marker, name in VCS_MARKERS:
+        if os.path.exists(os.path.join(path, marker)):
+            return name
+    return None
+
+
+class VCSResolver(object):
+    """
+    Find VCS roots and their VCS info, remembering the results for the
+    lifetime of the resolver (i.e., one run).
+
+    Each directory is checked for VCS markers at most once, and ``VCS``
+    info is read only once per root, so that components under the same
+    checkout share it. It can be used from multiple threads.
+
+    """
+
+    def __init__(self):
+        # {directory: root or None}
+        self._roots = {}
+        # {root: VCS or None, or the VCSError raised}
+        self._vcs = {}
+        # {root: Lock}
+        self._root_locks = {}
+        self._lock = threading.Lock()
+
+    def find_root(self, path):
+        """Walk up the hierarchy and return the first VCS root found."""
+        visited = []
+        root = None
+        while path and path != '/':
+            if path in self._roots:
+                root = self._roots[path]
+                break
+            visited.append(path)
+            if is_vcs_root(path):
+                root = path
+                break
+            path = os.path.split(path)[0]
+
+        for directory in visited:
+            self._roots[directory] = root
+        return root
+
+    def get_vcs(self, root):
+        """
+        Return ``VCS`` info for the VCS root ``root``.
+
+        :raises: VCSError if it cannot be read.
+
+        """
+        with self._lock:
+            root_lock = self._root_locks.setdefault(root, threading.Lock())
+
+        # Other threads asking about the same root wait for the result.
+        with root_lock:
+            if root not in self._vcs:
+                try:
+                    with profiling.phase('vcs %s' % root):
+                        self._vcs[root] = VCS.from_path(root)
+                except Exception as e:
+                    if not is_vcs_error(e):
+                        raise
+                    self._vcs[root] = VCSError(
+                        'cannot read VCS info of {root!r}: {error}'
+                        .format(root=root, error=str(e) or repr(e)))
+            result = self._vcs[root]
+
+        if isinstance(result, VCSError):
+            raise result
+        return result
 
 
 def get_branch(backend, path):
@@ -62,7 +168,29 @@ def get_branch(backend, path):
                 return line.split('/')[-1]
 
 
+def intern_string(string):
+    """Return ``string`` interned, or ``None`` if it's ``None``."""
+    return intern(string) if string is not None else None
+
+
 class VCS(object):
+    """
+    The VCS checkout a package is installed from.
+
+    Many packages come from the same checkout (and e.g. all of the
+    dependencies loaded from the cache have their own copy), so equal
+    instances are compared by value and can be replaced with a single
+    ``shared()`` one.
+
+    """
+
+    ATTRIBUTES = ('vcs_type', 'rev', 'branch', 'remote_url')
+
+    __slots__ = ATTRIBUTES + ('__weakref__',)
+
+    # {key: VCS} of the instances returned by ``shared()`` that are still
+    # in use, so that long-running processes don't keep all of them.
+    _shared = weakref.WeakValueDictionary()
 
     def __init__(self, rev, vcs_type=None, branch=None, remote_url=None):
 
@@ -75,10 +203,10 @@ class VCS(object):
                     ', '.join(types),
                 )
             )
-        self.vcs_type = vcs_type
-        self.rev = rev
-        self.branch = branch
-        self.remote_url = (
+        self.vcs_type = intern_string(vcs_type)
+        self.rev = intern_string(rev)
+        self.branch = intern_string(branch)
+        self.remote_url = intern_string(
             expand_ssh_host_alias(remote_url)
             if remote_url else None
         )
@@ -89,12 +217,53 @@ class VCS(object):
             ' branch={branch!r}, remote_url={remote_url!r})'
             .format(
                 cls=type(self).__name__,
-                **self.__dict__
+                **self.as_dict()
             )
         )
 
+    def __eq__(self, other):
+        if not isinstance(other, VCS):
+            return NotImplemented
+        return self.key == other.key
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(self.key)
+
+    @property
+    def key(self):
+        return (self.vcs_type, self.rev, self.branch, self.remote_url)
+
+    def as_dict(self):
+        return dict(zip(self.ATTRIBUTES, self.key))
+
+    def shared(self):
+        """Return the instance shared by all equal ones."""
+        return VCS._shared.setdefault(self.key, self)
+
     @classmethod
     def from_path(cls, path):
+        if os.path.exists(os.path.join(path, '.git')):
+            try:
+                rev, branch, remote_url = read_git_metadata(path)
+            except UnsupportedGitLayout as e:
+                logger.getChild('vcs').debug(
+                    'Falling back to git for %r: %s', path, e)
+            else:
+                return VCS(
+                    vcs_type=VCS_NAME_MAP['git'],
+                    rev=rev,
+                    remote_url=remote_url,
+                    branch=branch,
+                )
+
+        # pip is slow to import, and not needed for most Git checkouts.
+        from pip import InstallationError
+        from pip.vcs import vcs
+
         backend_class = vcs.get_backend_from_location(path)
         if backend_class:
             backend = backend_class()
@@ -26,6 +26,14 @@ class ClientHTTPError(ClientConnectionError):
     """Raised when response status >= 400."""
 
 
+class CircuitBreakerOpenError(ClientConnectionError):
+    """The server is not contacted, because it seems to be down."""
+
+
+class VCSError(OpbeatError):
+    """VCS information could not be read from a repository."""
+
+
 class ExternalCommandError(OpbeatError):
     """Error running an external command."""
 
@@ -34,5 +42,9 @@ class ExternalCommandNotFoundError(ExternalCommandError):
     """Dependency collector command not found."""
 
 
+class DependencySourceNotFoundError(ExternalCommandNotFoundError):
+    """Native dependency collector source (e.g., a directory) not found."""
+
+
 class DependencyParseError(ExternalCommandError):
     """Unparseable output."""
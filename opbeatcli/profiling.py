@@ -0,0 +1,462 @@
+"""
+Measuring where the time of a command goes (--profile, --trace).
+
+The code marks its phases with ``phase(name)``, e.g., each VCS lookup
+and each collector command, or with ``iterate(name, iterable)`` for the
+producing of items handed over to other code one by one. When profiling,
+the wall time, CPU time, CPU time of child processes (i.e., of the
+external commands), and peak memory allocated by Python (on top of what
+already was allocated) is recorded for each of them. When tracing, each
+run of a phase is recorded as a span on the timeline of its thread.
+Otherwise, ``phase()`` does nothing.
+
+Phases are nested in the phase of the same thread they run in, and
+their measurements are included in the outer phase's ones. Phases of
+other threads are not nested in the phase that started the thread.
+
+The CPU times and memory are those of the whole process, so phases
+running concurrently (--collect-jobs, --vcs-jobs) are measured together.
+
+"""
+import os
+import time
+import threading
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# ``time.perf_counter()`` is only available on Python 3.3+.
+get_wall_time = getattr(time, 'perf_counter', time.time)
+
+# Shorter spans of ``iterate()`` are not traced, so that e.g. iterating
+# over thousands of cached results doesn't flood the trace. (The time is
+# still included in the --profile measurements.)
+MIN_ITERATION_SPAN = 0.0001
+
+# The ``Profiler`` while profiling, and the ``Tracer`` while tracing.
+_profiler = None
+_tracer = None
+
+
+def get_cpu_times():
+    """Return ``(own_cpu_time, children_cpu_time)`` of the process."""
+    times = os.times()
+    if resource is not None:
+        # The waited-for child processes, i.e., the finished commands.
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        children = usage.ru_utime + usage.ru_stime
+    else:
+        children = times[2] + times[3]
+    return times[0] + times[1], children
+
+
+def snapshot():
+    """Return the counters a phase is measured from."""
+    cpu, children_cpu = get_cpu_times()
+    return get_wall_time(), cpu, children_cpu
+
+
+def get_tracemalloc():
+    """
+    Return the ``tracemalloc`` module if it can measure the peak memory
+    of individual phases, i.e., on Python 3.9+, or ``None``.
+
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    if not hasattr(tracemalloc, 'reset_peak'):
+        return None
+    return tracemalloc
+
+
+class Phase(object):
+    """
+    The measurements of all the runs of a phase with the same name, in
+    the same outer phases.
+
+    """
+
+    def __init__(self, path):
+        # The names of the outer phases, and of this one.
+        self.path = path
+        self.name = path[-1]
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.children_cpu = 0.0
+        # The most memory allocated on top of what was allocated when it
+        # started, in bytes, or ``None`` if not measured.
+        self.memory_peak = None
+
+    @property
+    def depth(self):
+        return len(self.path) - 1
+
+    def add(self, started, finished, memory_peak=None):
+        """Add the measurements of (a part of) a run."""
+        self.wall += finished[0] - started[0]
+        self.cpu += finished[1] - started[1]
+        self.children_cpu += finished[2] - started[2]
+        if memory_peak is not None:
+            self.memory_peak = max(self.memory_peak or 0, memory_peak)
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'count': self.count,
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'children_cpu': self.children_cpu,
+            'memory_peak': self.memory_peak,
+        }
+
+
+class _NoPhase(object):
+    """What ``phase()`` returns when neither profiling nor tracing."""
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+class _RunningPhase(object):
+    """
+    A run of a phase, which is measured while it's resumed, i.e.,
+    possibly in multiple parts, until it's finished.
+
+    """
+
+    def __init__(self, profiler, tracer, name, min_span=0):
+        self.profiler = profiler
+        self.tracer = tracer
+        self.name = name
+        # The shortest part of the run that is traced, in seconds.
+        self.min_span = min_span
+        # Set by the profiler when first resumed.
+        self.path = None
+        # The traced memory when it was resumed, and the highest peak.
+        self.memory_start = 0
+        self.memory_peak = 0
+
+    def __enter__(self):
+        self.resume()
+
+    def __exit__(self, *exc_info):
+        self.pause()
+        self.finish()
+
+    def resume(self):
+        if self.profiler:
+            self.profiler.enter(self)
+        self.started = snapshot()
+
+    def pause(self):
+        paused = snapshot()
+        if self.profiler:
+            self.profiler.exit(self, paused)
+        if self.tracer and paused[0] - self.started[0] >= self.min_span:
+            self.tracer.add_span(self.name, self.started[0], paused[0])
+
+    def finish(self):
+        if self.profiler:
+            self.profiler.finish(self)
+
+
+class Profiler(object):
+    """
+    Records ``Phase``s, and optionally the ``cProfile`` stats of the
+    main thread, which are written to ``stats_path``.
+
+    """
+
+    def __init__(self, trace_memory=True, stats_path=None):
+        self.phases = {}
+        self.stats_path = stats_path
+        self.tracemalloc = get_tracemalloc() if trace_memory else None
+        self._cprofile = None
+        self._stop_tracing = False
+        # The phases of all threads that are running.
+        self._running = []
+        # The ``stack`` of the running phases of each thread.
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.tracemalloc and not self.tracemalloc.is_tracing():
+            self.tracemalloc.start()
+            self._stop_tracing = True
+        if self.stats_path:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.stats_path)
+            self._cprofile = None
+        if self._stop_tracing:
+            self.tracemalloc.stop()
+            self._stop_tracing = False
+
+    def get_stack(self):
+        """Return the running phases of the current thread, outermost first."""
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def get_path(self, name):
+        """Return the path of the phase ``name`` if it started now."""
+        stack = self.get_stack()
+        return (stack[-1].path if stack else ()) + (name,)
+
+    def enter(self, running):
+        if running.path is None:
+            running.path = self.get_path(running.name)
+        self.get_stack().append(running)
+        with self._lock:
+            if self.tracemalloc:
+                # The peak is reset for the new phase, so first record it
+                # for the ones already running.
+                current, peak = self.tracemalloc.get_traced_memory()
+                for other in self._running:
+                    other.memory_peak = max(other.memory_peak, peak)
+                self.tracemalloc.reset_peak()
+                running.memory_start = running.memory_peak = current
+            self._running.append(running)
+
+    def exit(self, running, paused):
+        self.get_stack().remove(running)
+        with self._lock:
+            self._running.remove(running)
+            memory_peak = None
+            if self.tracemalloc:
+                peak = max(running.memory_peak,
+                           self.tracemalloc.get_traced_memory()[1])
+                memory_peak = peak - running.memory_start
+            self.get_phase(running.path).add(
+                running.started, paused, memory_peak)
+
+    def finish(self, running):
+        with self._lock:
+            self.get_phase(running.path).count += 1
+
+    def get_phase(self, path):
+        if path not in self.phases:
+            self.phases[path] = Phase(path)
+        return self.phases[path]
+
+    def record(self, name, started, finished=None, memory_peak=None):
+        """Record a phase measured from the ``snapshot()``s given."""
+        path = self.get_path(name)
+        with self._lock:
+            phase = self.get_phase(path)
+            phase.add(started, finished or snapshot(), memory_peak)
+            phase.count += 1
+
+    def get_phases(self):
+        """
+        Return the ``Phase``s, each followed by the ones nested in it, the
+        longest (in wall time) first among those in the same outer phase.
+
+        """
+        nested = {}
+        for phase in self.phases.values():
+            parent = phase.path[:-1]
+            # E.g., an outer phase still running when profiling stopped.
+            while parent and parent not in self.phases:
+                parent = parent[:-1]
+            nested.setdefault(parent, []).append(phase)
+
+        phases = []
+
+        def add(parent):
+            for phase in sorted(nested.get(parent, []),
+                                key=lambda phase: (-phase.wall, phase.name)):
+                phases.append(phase)
+                add(phase.path)
+
+        add(())
+        return phases
+
+    def format_table(self):
+        lines = ['%-50s %5s %9s %9s %9s %9s' % (
+            'phase', 'count', 'wall', 'cpu', 'children', 'memory')]
+        for phase in self.get_phases():
+            # Nested phases are indented under their outer phase.
+            name = '  ' * phase.depth + phase.name
+            if len(name) > 50:
+                name = name[:47] + '...'
+            lines.append('%-50s %5d %8.3fs %8.3fs %8.3fs %9s' % (
+                name, phase.count, phase.wall, phase.cpu,
+                phase.children_cpu, format_size(phase.memory_peak)))
+        return '\n'.join(lines) + '\n'
+
+    def dump_json(self, path):
+        import json
+        from opbeatcli.utils.files import write_atomically
+
+        # Each phase with the ones nested in it as its ``phases``.
+        root = {'phases': []}
+        nodes = {}
+        for phase in self.get_phases():
+            node = nodes[phase.path] = phase.as_dict()
+            node['phases'] = []
+            parent = phase.path[:-1]
+            while parent and parent not in nodes:
+                parent = parent[:-1]
+            nodes.get(parent, root)['phases'].append(node)
+
+        write_atomically(path, json.dumps(
+            root, indent=2, sort_keys=True).encode('utf8'))
+
+
+class Tracer(object):
+    """
+    Records spans of phases as Chrome trace events, which can be viewed
+    with e.g. ``chrome://tracing`` or https://ui.perfetto.dev.
+
+    The timestamps are relative to the wall time ``origin``.
+
+    """
+
+    def __init__(self, origin=None):
+        self.origin = get_wall_time() if origin is None else origin
+        self.events = []
+        self.pid = os.getpid()
+        self._thread_ids = set()
+        self._lock = threading.Lock()
+
+    def add_span(self, name, started, finished):
+        """Add a span of the current thread, with wall times given."""
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': name.split(' ', 1)[0],
+            'ph': 'X',
+            'ts': (started - self.origin) * 1e6,
+            'dur': (finished - started) * 1e6,
+            'pid': self.pid,
+            'tid': thread.ident,
+        }
+        with self._lock:
+            if thread.ident not in self._thread_ids:
+                self._thread_ids.add(thread.ident)
+                self.events.append({
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': self.pid,
+                    'tid': thread.ident,
+                    'args': {'name': thread.name},
+                })
+            self.events.append(event)
+
+    def dump_json(self, path):
+        import json
+        from opbeatcli.utils.files import write_atomically
+
+        write_atomically(path, json.dumps({
+            'traceEvents': self.events,
+            'displayTimeUnit': 'ms',
+        }).encode('utf8'))
+
+
+def format_size(size):
+    if size is None:
+        return '-'
+    if size < 1024:
+        return '%d B' % size
+    for unit in ['KiB', 'MiB']:
+        size /= 1024.0
+        if size < 1024:
+            return '%.1f %s' % (size, unit)
+    return '%.1f GiB' % (size / 1024.0)
+
+
+def start(trace_memory=True, stats_path=None):
+    """Start profiling, and return the ``Profiler``."""
+    global _profiler
+    _profiler = Profiler(trace_memory=trace_memory, stats_path=stats_path)
+    _profiler.start()
+    return _profiler
+
+
+def stop():
+    """Stop profiling, and return the ``Profiler``, if any."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def start_tracing(origin=None):
+    """Start tracing, and return the ``Tracer``."""
+    global _tracer
+    _tracer = Tracer(origin=origin)
+    return _tracer
+
+
+def stop_tracing():
+    """Stop tracing, and return the ``Tracer``, if any."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def record(name, started):
+    """Record the phase ``name`` that started at the ``snapshot()``."""
+    if _profiler is None and _tracer is None:
+        return
+    finished = snapshot()
+    if _profiler is not None:
+        _profiler.record(name, started, finished)
+    if _tracer is not None:
+        _tracer.add_span(name, started[0], finished[0])
+
+
+def phase(name):
+    """Return a context manager measuring the phase ``name``."""
+    if _profiler is None and _tracer is None:
+        return _NO_PHASE
+    return _RunningPhase(_profiler, _tracer, name)
+
+
+def iterate(name, iterable):
+    """
+    Yield the items of ``iterable``, measuring as a run of the phase
+    ``name`` only the time it takes to produce them, and not what the
+    caller does with each one in between. When tracing, each item that
+    takes at least ``MIN_ITERATION_SPAN`` to produce gets its own span.
+
+    """
+    if _profiler is None and _tracer is None:
+        for item in iterable:
+            yield item
+        return
+
+    running = _RunningPhase(_profiler, _tracer, name,
+                            min_span=MIN_ITERATION_SPAN)
+    iterator = iter(iterable)
+    try:
+        while True:
+            running.resume()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                running.pause()
+            yield item
+    finally:
+        running.finish()
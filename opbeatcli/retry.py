@@ -0,0 +1,161 @@
+"""
+Retrying failed requests, and not making them at all while the server
+seems to be down.
+
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from email.utils import parsedate_tz, mktime_tz
+
+from opbeatcli import settings
+from opbeatcli.exceptions import CircuitBreakerOpenError
+from opbeatcli.utils.files import makedirs, write_atomically
+
+
+# Responses to requests that may succeed if retried later.
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+def parse_retry_after(value):
+    """
+    Return the number of seconds to wait according to a ``Retry-After``
+    header, which is either a number of seconds or an HTTP date, or ``None``
+    if it's invalid.
+
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0, mktime_tz(date) - time.time())
+
+
+class RetryPolicy(object):
+    """
+    Up to ``retries`` retries with exponential backoff and full jitter:
+    the n-th retry waits a random time between 0 and ``backoff * 2 ** n``
+    seconds (at most ``max_backoff``), so that many clients failing at the
+    same time don't retry at the same time, too.
+
+    A ``Retry-After`` of 429 and 503 responses is honored, unless it's
+    longer than ``max_retry_after``, in which case it's not retried.
+
+    """
+
+    def __init__(self, retries=settings.RETRIES,
+                 backoff=settings.RETRY_BACKOFF,
+                 max_backoff=settings.RETRY_MAX_BACKOFF,
+                 max_retry_after=settings.RETRY_MAX_RETRY_AFTER,
+                 rand=random.random):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.rand = rand
+
+    def get_delay(self, retry, response=None):
+        """
+        Return the seconds to wait before the ``retry``-th (from 0) retry of
+        a request that failed with ``response`` (``None`` on connection
+        errors), or ``None`` if it should not be retried.
+
+        """
+        if retry >= self.retries:
+            return None
+        if response is not None and response.status not in RETRY_STATUSES:
+            return None
+
+        delay = self.rand() * min(self.max_backoff,
+                                  self.backoff * 2 ** retry)
+
+        if response is not None and response.status in (429, 503):
+            retry_after = parse_retry_after(
+                response.headers.get('retry-after'))
+            if retry_after is not None:
+                if retry_after > self.max_retry_after:
+                    return None
+                delay = max(delay, retry_after)
+
+        return delay
+
+
+class CircuitBreaker(object):
+    """
+    Stops requests to ``server`` after ``threshold`` consecutive failed
+    ones, until ``reset_timeout`` seconds have passed. Then a request is
+    let through again, and it either closes the circuit, or opens it for
+    another ``reset_timeout``.
+
+    The state is stored under ``path``, so that the server is not
+    contacted by subsequent runs of the command either (e.g., on all the
+    hosts of a fleet, while it's down).
+
+    """
+
+    def __init__(self, server, path=settings.CACHE_DIR,
+                 threshold=settings.CIRCUIT_BREAKER_THRESHOLD,
+                 reset_timeout=settings.CIRCUIT_BREAKER_RESET_TIMEOUT,
+                 clock=time.time):
+        self.server = server
+        self.path = os.path.join(
+            os.path.expanduser(path),
+            'circuits',
+            hashlib.sha1(server.encode('utf8')).hexdigest() + '.json'
+        )
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return ``(failures, opened_at)``."""
+        try:
+            with open(self.path, 'rb') as f:
+                state = json.loads(f.read().decode('utf8'))
+            return int(state['failures']), state['opened_at']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return 0, None
+
+    def save(self, failures, opened_at):
+        makedirs(os.path.dirname(self.path))
+        write_atomically(self.path, json.dumps({
+            'server': self.server,
+            'failures': failures,
+            'opened_at': opened_at,
+        }).encode('utf8'))
+
+    def check(self):
+        """
+        :raises: CircuitBreakerOpenError if requests should not be made.
+
+        """
+        failures, opened_at = self.load()
+        if opened_at is not None:
+            remaining = opened_at + self.reset_timeout - self.clock()
+            if remaining > 0:
+                raise CircuitBreakerOpenError(
+                    'not contacting the server for another {remaining:.0f}s'
+                    ' after {failures} consecutive failed requests'
+                    ' (--circuit-breaker)'
+                    .format(remaining=remaining, failures=failures))
+
+    def record_success(self):
+        with self._lock:
+            if self.load() != (0, None):
+                self.save(0, None)
+
+    def record_failure(self):
+        with self._lock:
+            failures, opened_at = self.load()
+            failures += 1
+            if failures >= self.threshold:
+                opened_at = self.clock()
+            self.save(failures, opened_at)
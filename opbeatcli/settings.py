@@ -4,17 +4,43 @@ Default values for all Opbeat settings.
 """
 
 import os
-import socket
 
 
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 
 TIMEOUT = 30
-HOSTNAME = socket.gethostname()
+
+# The number of idle keep-alive connections the client keeps open.
+HTTP_POOL_SIZE = 4
+
+# Retries of failed requests, with exponential backoff starting at
+# RETRY_BACKOFF seconds. A longer Retry-After than RETRY_MAX_RETRY_AFTER
+# is not waited for.
+RETRIES = 3
+RETRY_BACKOFF = 1
+RETRY_MAX_BACKOFF = 30
+RETRY_MAX_RETRY_AFTER = 120
+
+# --circuit-breaker stops requests for CIRCUIT_BREAKER_RESET_TIMEOUT
+# seconds after CIRCUIT_BREAKER_THRESHOLD consecutive failed ones.
+CIRCUIT_BREAKER_THRESHOLD = 5
+CIRCUIT_BREAKER_RESET_TIMEOUT = 300
 
 # This should be the schema+host of the Opbeat server
 SERVER = 'https://opbeat.com'
 
+# Where --cache stores collected dependencies, and its size limit in bytes.
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join('~', '.cache')),
+    'opbeatcli'
+)
+CACHE_MAX_SIZE = 32 * 1024 * 1024
+
+# Requests older than SPOOL_MAX_AGE seconds are discarded from --spool-dir,
+# as are the oldest ones when it is larger than SPOOL_MAX_SIZE bytes.
+SPOOL_MAX_AGE = 7 * 24 * 60 * 60
+SPOOL_MAX_SIZE = 256 * 1024 * 1024
+
 # Deployment Tracking API path
 DEPLOYMENT_API_URI = \
     '/api/v1/organizations/{organization_id}/apps/{app_id}/deployments/'
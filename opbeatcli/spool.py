@@ -0,0 +1,164 @@
+"""
+A directory of requests that could not be sent (or were deliberately
+not sent) yet, to be sent later by ``opbeat flush``.
+
+"""
+import os
+import json
+import errno
+import time
+import gzip
+import itertools
+
+from opbeatcli import settings
+from opbeatcli.log import logger
+from opbeatcli.exceptions import ClientHTTPError
+from opbeatcli.retry import RETRY_STATUSES
+from opbeatcli.client import encode_json, gzip_compress
+from opbeatcli.utils.files import makedirs, write_atomically
+
+
+SUFFIX = '.json.gz'
+REJECTED_SUFFIX = '.rejected'
+
+_sequence = itertools.count()
+
+
+def is_spoolable(error):
+    """
+    Return whether a request that failed with ``error`` may succeed
+    later, i.e., it's not rejected by the server.
+
+    """
+    return (not isinstance(error, ClientHTTPError)
+            or error.args[0] in RETRY_STATUSES)
+
+
+class SpooledRequest(object):
+    """A POST of ``data`` to ``uri`` with ``uri_params``."""
+
+    def __init__(self, path, uri, data, uri_params, idempotency_key,
+                 created):
+        self.path = path
+        self.uri = uri
+        self.data = data
+        self.uri_params = uri_params
+        self.idempotency_key = idempotency_key
+        self.created = created
+
+    def __repr__(self):
+        return '<SpooledRequest %s>' % os.path.basename(self.path)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rb') as f:
+            entry = json.loads(f.read().decode('utf8'))
+        return cls(path=path, **entry)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            # Flushed concurrently, or pruned.
+            if e.errno != errno.ENOENT:
+                raise
+
+    def reject(self):
+        """Keep the request, but never send it again."""
+        try:
+            os.rename(self.path, self.path + REJECTED_SUFFIX)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+class Spool(object):
+    """
+    Spooled requests stored as compressed JSON files under ``path``,
+    named so that they sort in the order they were spooled.
+
+    Requests older than ``max_age`` seconds are discarded, as are the
+    oldest ones when the files take more than ``max_size`` bytes.
+
+    """
+
+    def __init__(self, path, max_age=settings.SPOOL_MAX_AGE,
+                 max_size=settings.SPOOL_MAX_SIZE, clock=time.time):
+        self.path = os.path.expanduser(path)
+        self.max_age = max_age
+        self.max_size = max_size
+        self.clock = clock
+        self.logger = logger.getChild('spool')
+
+    def put(self, uri, data, uri_params, idempotency_key):
+        """Spool a request, and return the path of its file."""
+        created = self.clock()
+        path = os.path.join(self.path, '%017.6f-%d-%d%s' % (
+            created, os.getpid(), next(_sequence), SUFFIX))
+        makedirs(self.path)
+        write_atomically(path, gzip_compress(encode_json({
+            'uri': uri,
+            'data': data,
+            'uri_params': uri_params,
+            'idempotency_key': idempotency_key,
+            'created': created,
+        })))
+        self.logger.info('Spooled to %s; send it with `opbeat flush`', path)
+        self.prune()
+        return path
+
+    def get_paths(self):
+        """Return the paths of spooled requests, the oldest first."""
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        return [os.path.join(self.path, name)
+                for name in sorted(names) if name.endswith(SUFFIX)]
+
+    def iter_requests(self):
+        """
+        Yield ``SpooledRequest``s, the oldest first. Each one is loaded
+        only when it's needed, so that the whole spool, which can be large
+        once decompressed, is never in memory at once.
+
+        """
+        self.prune()
+        for path in self.get_paths():
+            try:
+                yield SpooledRequest.load(path)
+            except (IOError, OSError) as e:
+                if e.errno == errno.ENOENT:  # Flushed concurrently.
+                    continue
+                self.logger.error('Ignoring invalid %s: %s', path, e)
+            except (ValueError, TypeError) as e:
+                self.logger.error('Ignoring invalid %s: %s', path, e)
+
+    def prune(self):
+        """Discard the requests exceeding the age and size limits."""
+        paths = self.get_paths()
+        sizes = {}
+        for path in paths:
+            try:
+                sizes[path] = os.path.getsize(path)
+            except OSError:  # Flushed concurrently.
+                sizes[path] = 0
+        total_size = sum(sizes.values())
+        min_created = self.clock() - self.max_age
+
+        for path in paths:
+            name = os.path.basename(path)
+            try:
+                created = float(name.split('-', 1)[0])
+            except ValueError:
+                created = 0
+            if created >= min_created and total_size <= self.max_size:
+                break
+            self.logger.warning(
+                'Discarding spooled %s (--spool-max-age, --spool-max-size)',
+                name)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= sizes[path]
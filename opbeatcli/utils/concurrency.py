@@ -0,0 +1,45 @@
+"""
+Running independent pieces of work concurrently.
+
+"""
+
+
+def map_concurrently(func, items, jobs=1):
+    """
+    Return ``[func(item) for item in items]`` computed by up to ``jobs``
+    threads.
+
+    Results are returned in the order of ``items``, regardless of the order
+    in which they finish. If ``func`` raises for any of the items, the
+    exception of the first such item (in ``items`` order) is re-raised once
+    all the work is done, so that errors are reported deterministically.
+
+    """
+    items = list(items)
+    jobs = min(jobs or 1, len(items))
+
+    if jobs <= 1:
+        return [func(item) for item in items]
+
+    # Imported here because it's slow to import and rarely needed.
+    from multiprocessing.pool import ThreadPool
+
+    def call(item):
+        try:
+            return True, func(item)
+        except Exception as e:
+            return False, e
+
+    pool = ThreadPool(jobs)
+    try:
+        outcomes = pool.map(call, items)
+    finally:
+        pool.close()
+        pool.join()
+
+    results = []
+    for ok, result in outcomes:
+        if not ok:
+            raise result
+        results.append(result)
+    return results
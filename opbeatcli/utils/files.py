@@ -0,0 +1,36 @@
+"""
+File system helpers.
+
+"""
+import os
+import errno
+import tempfile
+
+
+def makedirs(path):
+    """Create ``path`` and its parents unless it already exists."""
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def write_atomically(path, content):
+    """
+    Write ``content`` (bytes) to ``path`` so that readers see either the
+    old or the new content, never a partially written file.
+
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        if os.name == 'nt' and os.path.exists(path):
+            # rename() does not replace existing files on Windows.
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
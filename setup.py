@@ -5,7 +5,10 @@ It provides access to the Opbeat API through the command line. It is also
 useful for use in your own applications. "opbeat" is installed as a binary.
 
 """
+import sys
+
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 
 from opbeatcli import __version__
 
@@ -45,6 +48,22 @@ try:
 except (ImportError, AttributeError):
     tests_require.append('unittest2')
 
+# Modules using syntax of Python 3.5+ (async/await), which would only make
+# byte-compiling them print a SyntaxError when installing for older ones.
+PY35_MODULES = ['opbeatcli.aio']
+
+
+class BuildPy(build_py):
+    """Leave out the modules that cannot be used with this Python."""
+
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info >= (3, 5):
+            return modules
+        return [(package, module, path) for package, module, path in modules
+                if package + '.' + module not in PY35_MODULES]
+
+
 setup(
     name='opbeatcli',
     version=__version__,
@@ -55,6 +74,7 @@ setup(
     long_description=long_description,
     packages=find_packages('.', exclude=['tests']),
     zip_safe=False,
+    cmdclass={'build_py': BuildPy},
     install_requires=install_requires,
     tests_require=tests_require,
     extras_require={
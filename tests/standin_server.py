@@ -0,0 +1,242 @@
+"""
+A local stand-in for the Opbeat API server for client tests.
+
+"""
+import threading
+
+try:
+    #noinspection PyCompatibility
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:  # Python < 3.0
+    #noinspection PyCompatibility,PyUnresolvedReferences
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+
+    # Keep-alive.
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.server.requests_started += 1
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = self.read_chunked()
+        else:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length)
+        headers = dict((name.lower(), value)
+                       for name, value in self.headers.items())
+        self.server.requests.append((self.path, headers, body))
+
+        status = self.server.get_status()
+        response = b'{}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if status >= 400:
+            for name, value in self.server.error_headers.items():
+                self.send_header(name, value)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+        if self.server.drop_connections:
+            # Close without telling the client, like servers do with
+            # connections that are idle for too long.
+            self.close_connection = True
+
+    def read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            chunk = self.rfile.read(size + 2)[:-2]
+            if not size:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(HTTPServer):
+    """
+    A server on a random local port, which counts accepted connections,
+    records requests (with lowercase header names), and responds with the
+    given ``statuses`` in turn (the last one repeats). Error responses
+    include ``error_headers``.
+
+    Use as a context manager.
+
+    """
+
+    def __init__(self, statuses=(201,), drop_connections=False,
+                 error_headers=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInRequestHandler)
+        self.statuses = list(statuses)
+        self.error_headers = error_headers or {}
+        self.drop_connections = drop_connections
+        self.connections = 0
+        self.requests = []
+        # Including the ones whose body is still being received.
+        self.requests_started = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def get_status(self):
+        with self.lock:
+            if len(self.statuses) > 1:
+                return self.statuses.pop(0)
+            return self.statuses[0]
+
+    def get_request(self):
+        request = HTTPServer.get_request(self)
+        with self.lock:
+            self.connections += 1
+        return request
+
+    def process_request(self, request, client_address):
+        # Handle each connection in a thread, so that concurrent
+        # keep-alive connections don't block each other.
+        thread = threading.Thread(
+            target=self.process_request_thread,
+            args=(request, client_address))
+        thread.daemon = True
+        thread.start()
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+
+try:
+    import asyncio
+except ImportError:  # Python < 3.4
+    asyncio = None
+
+
+if asyncio is not None:
+
+    class AsyncStandInServer(object):
+        """
+        An asyncio counterpart of ``StandInServer``, which also responds
+        after ``delay`` seconds and records the maximum number of requests
+        in progress at a time.
+
+        """
+
+        def __init__(self, loop, statuses=(201,), delay=0):
+            self.loop = loop
+            self.statuses = list(statuses)
+            self.delay = delay
+            self.connections = 0
+            self.requests = []
+            self.in_progress = 0
+            self.max_in_progress = 0
+            self.server = loop.run_until_complete(loop.create_server(
+                lambda: AsyncStandInProtocol(self), '127.0.0.1', 0))
+
+        @property
+        def url(self):
+            return 'http://%s:%d' % self.server.sockets[0].getsockname()[:2]
+
+        def get_status(self):
+            if len(self.statuses) > 1:
+                return self.statuses.pop(0)
+            return self.statuses[0]
+
+        def close(self):
+            self.server.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+
+    class AsyncStandInProtocol(asyncio.Protocol):
+
+        def __init__(self, server):
+            self.server = server
+            self.buffer = b''
+
+        def connection_made(self, transport):
+            self.transport = transport
+            self.server.connections += 1
+
+        def data_received(self, data):
+            self.buffer += data
+            while b'\r\n\r\n' in self.buffer:
+                head, rest = self.buffer.split(b'\r\n\r\n', 1)
+                lines = head.decode('latin1').split('\r\n')
+                headers = dict(
+                    (name.strip().lower(), value.strip())
+                    for name, _, value in (line.partition(':')
+                                           for line in lines[1:]))
+                length = int(headers.get('content-length', 0))
+                if len(rest) < length:
+                    return
+                body, self.buffer = rest[:length], rest[length:]
+                path = lines[0].split(' ')[1]
+                self.server.requests.append((path, headers, body))
+                self.server.in_progress += 1
+                self.server.max_in_progress = max(
+                    self.server.max_in_progress, self.server.in_progress)
+                self.server.loop.call_later(self.server.delay, self.respond)
+
+        def respond(self):
+            self.server.in_progress -= 1
+            if self.transport.is_closing():
+                return
+            status = self.server.get_status()
+            self.transport.write(
+                ('HTTP/1.1 %d Status\r\nContent-Type: application/json\r\n'
+                 'Content-Length: 2\r\n\r\n{}' % status).encode('latin1'))
+
+    class AsyncRawServer(object):
+        """
+        Sends ``response`` as is in response to the first request of each
+        connection, and closes it, e.g., to test malformed responses.
+
+        """
+
+        def __init__(self, loop, response):
+            self.loop = loop
+            self.response = response
+            self.server = loop.run_until_complete(loop.create_server(
+                lambda: AsyncRawProtocol(self.response), '127.0.0.1', 0))
+
+        @property
+        def url(self):
+            return 'http://%s:%d' % self.server.sockets[0].getsockname()[:2]
+
+        def close(self):
+            self.server.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+
+    class AsyncRawProtocol(asyncio.Protocol):
+
+        def __init__(self, response):
+            self.response = response
+            self.buffer = b''
+
+        def connection_made(self, transport):
+            self.transport = transport
+
+        def data_received(self, data):
+            self.buffer += data
+            if b'\r\n\r\n' in self.buffer:
+                self.transport.write(self.response)
+                self.transport.close()
@@ -0,0 +1,150 @@
+import sys
+import threading
+
+from opbeatcli import settings
+from opbeatcli.exceptions import ClientConnectionError, ClientHTTPError
+from standin_server import asyncio
+
+if sys.version_info >= (3, 5):
+    from opbeatcli.aio import AsyncOpbeatClient, AsyncConnectionPool
+    from standin_server import AsyncStandInServer, AsyncRawServer
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'requires Python 3.5+')
+class AsyncOpbeatClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def get_server(self, **kwargs):
+        server = AsyncStandInServer(self.loop, **kwargs)
+        self.addCleanup(server.close)
+        return server
+
+    def get_raw_server(self, response):
+        server = AsyncRawServer(self.loop, response)
+        self.addCleanup(server.close)
+        return server.url
+
+    def get_client(self, server_url, **kwargs):
+        client = AsyncOpbeatClient(secret_token='TOKEN',
+                                   organization_id='ORG_ID',
+                                   app_id='APP_ID',
+                                   server=server_url,
+                                   **kwargs)
+        self.addCleanup(self.loop.run_until_complete, client.close())
+        return client
+
+    def post_many(self, client, app_ids, **kwargs):
+        return self.loop.run_until_complete(client.post_many(
+            settings.DEPLOYMENT_API_URI,
+            [({'app': app_id}, {'app_id': app_id}) for app_id in app_ids],
+            **kwargs
+        ))
+
+    def test_post(self):
+        server = self.get_server()
+        client = self.get_client(server.url)
+        self.loop.run_until_complete(
+            client.post(settings.DEPLOYMENT_API_URI, {'a': 1}))
+        [(path, headers, body)] = server.requests
+        self.assertEqual(
+            path, '/api/v1/organizations/ORG_ID/apps/APP_ID/deployments/')
+        self.assertEqual(headers['authorization'], 'Bearer TOKEN')
+        self.assertEqual(body, b'{"a":1}')
+
+    def test_post_many_bounded_concurrency(self):
+        server = self.get_server(delay=0.01)
+        client = self.get_client(server.url, pool_size=5)
+        app_ids = ['app%d' % i for i in range(200)]
+        self.assertEqual(self.post_many(client, app_ids, concurrency=5),
+                         [None] * len(app_ids))
+        self.assertEqual(
+            sorted(path for path, headers, body in server.requests),
+            sorted('/api/v1/organizations/ORG_ID/apps/%s/deployments/'
+                   % app_id for app_id in app_ids)
+        )
+        self.assertLessEqual(server.max_in_progress, 5)
+        # The connections are kept alive and reused.
+        self.assertLessEqual(server.connections, 5)
+
+    def test_post_many_errors(self):
+        server = self.get_server(statuses=[201, 400, 201])
+        client = self.get_client(server.url)
+        results = self.post_many(client, ['a', 'b', 'c'], concurrency=1,
+                                 return_exceptions=True)
+        self.assertEqual(results[0], None)
+        self.assertIsInstance(results[1], ClientHTTPError)
+        self.assertEqual(results[1].args[0], 400)
+        self.assertEqual(results[2], None)
+
+        server.statuses = [404]
+        with self.assertRaises(ClientHTTPError):
+            self.post_many(client, ['d'])
+
+    def test_retry(self):
+        server = self.get_server(statuses=[503, 502, 201])
+        client = self.get_client(server.url, retry_backoff=0.001)
+        self.post_many(client, ['a'])
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(
+            len(set(headers['idempotency-key']
+                    for path, headers, body in server.requests)),
+            1
+        )
+
+    def test_blocking_work_off_the_loop(self):
+        server = self.get_server()
+        client = self.get_client(server.url, compress=True)
+        threads = []
+
+        def record(method):
+            def wrapper(*args):
+                threads.append(threading.current_thread())
+                return method(*args)
+            return wrapper
+        client.prepare_request = record(client.prepare_request)
+        client.finish = record(client.finish)
+
+        self.post_many(client, ['a', 'b'])
+        self.assertEqual(len(threads), 4)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_connection_error(self):
+        server = self.get_server()
+        url = server.url
+        server.close()
+        client = self.get_client(url, retries=0)
+        with self.assertRaises(ClientConnectionError) as cm:
+            self.post_many(client, ['a'])
+        self.assertNotIsInstance(cm.exception, ClientHTTPError)
+
+    def test_timeout(self):
+        server = self.get_server(delay=1)
+        client = self.get_client(server.url, timeout=0.05, retries=0)
+        with self.assertRaises(ClientConnectionError) as cm:
+            self.post_many(client, ['a'])
+        self.assertIn('timed out', str(cm.exception))
+
+    def test_body_until_eof(self):
+        url = self.get_raw_server(
+            b'HTTP/1.0 200 OK\r\nContent-Type: text/plain\r\n\r\nbody')
+        pool = AsyncConnectionPool(url)
+        response = self.loop.run_until_complete(pool.request('POST', '/'))
+        self.assertEqual((response.status, response.body), (200, b'body'))
+        self.assertEqual(pool._idle, [])
+
+    def test_malformed_response(self):
+        for response in [b'garbage\r\n\r\n',
+                         b'HTTP/1.1 200 OK\r\nContent-Length: x\r\n\r\n',
+                         b'HTTP/1.1 200 ' + b'x' * 100000]:
+            client = self.get_client(self.get_raw_server(response),
+                                     retries=0)
+            with self.assertRaises(ClientConnectionError):
+                self.post_many(client, ['a'])
@@ -0,0 +1,71 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks'))
+
+import run as benchmarks
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class BenchmarksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_run_and_compare(self):
+        baseline = os.path.join(self.tmp, 'baseline.json')
+        args = ['--scale', '0.001', '--repeat', '1', '--min-time', '0',
+                '--baseline', baseline]
+        self.assertEqual(benchmarks.main(args + ['--save-baseline']),
+                         benchmarks.EXIT_SUCCESS)
+        with open(baseline) as f:
+            saved = json.load(f)
+        self.assertEqual(sorted(saved['benchmarks']),
+                         sorted(benchmarks.Benchmarks.NAMES))
+
+        # Everything is infinitely slower than this.
+        for result in saved['benchmarks'].values():
+            result['time'] = 0
+        with open(baseline, 'w') as f:
+            json.dump(saved, f)
+        self.assertEqual(benchmarks.main(args + ['--only', 'parse_dpkg']),
+                         benchmarks.EXIT_REGRESSION)
+
+    def test_compare(self):
+        baseline = {
+            'fast': {'time': 1.0, 'memory_peak': 100},
+            'lean': {'time': 1.0, 'memory_peak': 100},
+            'new_memory': {'time': 1.0, 'memory_peak': None},
+        }
+        results = {
+            'fast': {'time': 1.2, 'memory_peak': 120},
+            'lean': {'time': 0.5, 'memory_peak': 105},
+            'new_memory': {'time': 1.0, 'memory_peak': 1000},
+            'new': {'time': 9.0, 'memory_peak': 1000},
+        }
+        self.assertEqual(
+            benchmarks.compare(results, baseline, time_threshold=0.25,
+                               memory_threshold=0.1),
+            {'fast': ['memory']})
+
+    def test_fixtures_sizes(self):
+        fixtures = benchmarks.fixtures
+        self.assertEqual(len(fixtures.pip_freeze(lines=100).splitlines()),
+                         100)
+        self.assertIn('\n-e ', fixtures.pip_freeze(lines=100))
+        self.assertEqual(len(fixtures.dpkg_query(lines=30).splitlines()), 30)
+        self.assertEqual(len(fixtures.rpm_query(lines=30).splitlines()), 30)
+        self.assertGreaterEqual(len(fixtures.npm_list_json(size=10000)),
+                                10000)
+        config, urls = fixtures.ssh_config(entries=500)
+        self.assertEqual(config.count('\nHost '), 500)
+        self.assertTrue(urls)
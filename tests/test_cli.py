@@ -1,4 +1,6 @@
 import os
+import sys
+import subprocess
 
 from opbeatcli.cli import ENV
 from opbeatcli.core import get_command, main, EXIT_SUCCESS
@@ -47,3 +49,65 @@ class CommonCLIOptionsTest(unittest.TestCase):
         finally:
             for name in var_names:
                 del os.environ[name]
+
+
+# Modules that the CLI startup (parsing arguments, --version, --help)
+# must not import, because they are slow to import and only needed once
+# a command does its work.
+HEAVY_MODULES = [
+    'pip',
+    'sqlite3',
+    'tempfile',
+    'subprocess',
+    'multiprocessing',
+    'urllib.request',
+    'urllib2',
+    'asyncio',
+    'httplib',
+    'http.client',
+    'cProfile',
+    'tracemalloc',
+    'opbeatcli.client',
+    'opbeatcli.deployment.vcs',
+    'opbeatcli.deployment.packages',
+]
+
+# The import time budget of `opbeatcli.core' in microseconds, including
+# the standard library modules it needs (mostly logging and argparse).
+IMPORT_TIME_BUDGET = 150000
+
+
+class StartupTest(unittest.TestCase):
+
+    def run_python(self, code, *options):
+        return subprocess.check_output(
+            [sys.executable] + list(options) + ['-c', code],
+            stderr=subprocess.STDOUT,
+        ).decode()
+
+    def test_startup_imports(self):
+        output = self.run_python(
+            'import sys\n'
+            'from opbeatcli.core import get_command\n'
+            'get_command("-o o -a a deployment --component path:.".split())\n'
+            'print(" ".join(name for name, module in sys.modules.items()'
+            ' if module))'
+        )
+        modules = set(output.split())
+        self.assertIn('opbeatcli.commands.deployment', modules)
+        self.assertEqual(
+            [name for name in HEAVY_MODULES if name in modules], [])
+
+    @unittest.skipIf(sys.version_info < (3, 7), '-X importtime unavailable')
+    def test_startup_import_time(self):
+        # Once to make sure the bytecode is cached.
+        self.run_python('import opbeatcli.core')
+        output = self.run_python('import opbeatcli.core', '-X', 'importtime')
+        for line in output.splitlines():
+            # "import time: <self us> | <cumulative us> | <module>"
+            parts = [part.strip() for part in line.split('|')]
+            if parts[-1] == 'opbeatcli.core':
+                self.assertLess(int(parts[1]), IMPORT_TIME_BUDGET)
+                break
+        else:
+            self.fail('opbeatcli.core not found in:\n' + output)
@@ -1,6 +1,19 @@
-from opbeatcli.client import OpbeatClient
-from opbeatcli.exceptions import ClientConnectionError
+import io
+import gzip
+import json
+import time
+import logging
+import shutil
+import tempfile
+from email.utils import formatdate
+
+from opbeatcli.client import OpbeatClient, encode_json
+from opbeatcli.connection import Response
+from opbeatcli.retry import RetryPolicy, CircuitBreaker, parse_retry_after
+from opbeatcli.exceptions import (ClientConnectionError, ClientHTTPError,
+                                  CircuitBreakerOpenError)
 from opbeatcli import settings
+from standin_server import StandInServer
 
 try:
     import unittest2 as unittest
@@ -36,3 +49,308 @@ class ClientTest(unittest.TestCase):
 
         with self.assertRaises(ClientConnectionError):
             client.post('/', {})
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def get_client(self, server, **kwargs):
+        return OpbeatClient(secret_token='TOKEN',
+                            organization_id='ORG_ID',
+                            app_id='APP_ID',
+                            server=server.url,
+                            **kwargs)
+
+    def test_keep_alive(self):
+        with StandInServer() as server:
+            client = self.get_client(server)
+            for app_id in ['a', 'b', 'c']:
+                client.post(settings.DEPLOYMENT_API_URI, {}, app_id=app_id)
+            client.close()
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(
+            [path for path, headers, body in server.requests],
+            ['/api/v1/organizations/ORG_ID/apps/%s/deployments/' % app_id
+             for app_id in ['a', 'b', 'c']]
+        )
+        self.assertEqual(client.pool.connections_opened, 1)
+
+    def test_reconnect_stale_connection(self):
+        with StandInServer(drop_connections=True) as server:
+            client = self.get_client(server)
+            client.post('/', {})
+            client.post('/', {})
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(server.connections, 2)
+
+    def test_http_error_keeps_connection(self):
+        with StandInServer(statuses=[404, 201]) as server:
+            client = self.get_client(server)
+            with self.assertRaises(ClientHTTPError) as cm:
+                client.post('/', {})
+            self.assertEqual(cm.exception.args[0], 404)
+            client.post('/', {})
+        self.assertEqual(server.connections, 1)
+
+    def test_pool_size(self):
+        with StandInServer() as server:
+            client = self.get_client(server, pool_size=2)
+            connections = [client.pool.get_connection()[0]
+                           for _ in range(3)]
+            for connection in connections:
+                client.pool.release(connection)
+            self.assertEqual(len(client.pool._idle), 2)
+            client.close()
+            self.assertEqual(len(client.pool._idle), 0)
+
+    def test_connection_refused(self):
+        with StandInServer() as server:
+            url = server.url
+        client = OpbeatClient(secret_token='TOKEN',
+                              organization_id='ORG_ID',
+                              app_id='APP_ID',
+                              server=url)
+        with self.assertRaises(ClientConnectionError) as cm:
+            client.post('/', {})
+        self.assertNotIsInstance(cm.exception, ClientHTTPError)
+
+
+class CompressionTest(unittest.TestCase):
+
+    DATA = {'releases': [{'module': {'name': 'name%d' % i, 'type': 'deb'},
+                          'version': '1.0'} for i in range(100)]}
+
+    def get_client(self, server, **kwargs):
+        return OpbeatClient(secret_token='TOKEN',
+                            organization_id='ORG_ID',
+                            app_id='APP_ID',
+                            server=server.url,
+                            **kwargs)
+
+    def test_compact_json(self):
+        with StandInServer() as server:
+            self.get_client(server).post('/', self.DATA)
+        path, headers, body = server.requests[0]
+        self.assertNotIn(b' ', body)
+        self.assertEqual(json.loads(body.decode('utf8')), self.DATA)
+        self.assertNotIn('content-encoding', headers)
+
+    def test_gzip(self):
+        with StandInServer() as server:
+            self.get_client(server, compress=True).post('/', self.DATA)
+        path, headers, body = server.requests[0]
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(
+            json.loads(gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+                       .decode('utf8')),
+            self.DATA
+        )
+        self.assertLess(len(body), len(encode_json(self.DATA)) / 5)
+
+    def test_fall_back_to_uncompressed(self):
+        with StandInServer(statuses=[415, 201]) as server:
+            client = self.get_client(server, compress=True)
+            client.post('/', self.DATA)
+            client.post('/', self.DATA)
+        self.assertFalse(client.compress)
+        self.assertEqual(
+            [json.loads(body.decode('utf8'))
+             for path, headers, body in server.requests[1:]],
+            [self.DATA, self.DATA]
+        )
+
+
+    def test_compression_not_logged_when_off(self):
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        client = OpbeatClient(secret_token='token', organization_id='org',
+                              app_id='app', dry_run=True)
+        level = client.logger.level
+        client.logger.addHandler(handler)
+        client.logger.setLevel(logging.DEBUG)
+        try:
+            client.post('/', self.DATA)
+            client.compress = True
+            client.post('/', self.DATA)
+        finally:
+            client.logger.removeHandler(handler)
+            client.logger.setLevel(level)
+        self.assertEqual(len([message for message in messages
+                              if message.startswith('Compressed')]), 1)
+
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def get_client(self, server, retries=3, **kwargs):
+        return OpbeatClient(secret_token='TOKEN',
+                            organization_id='ORG_ID',
+                            app_id='APP_ID',
+                            server=server.url,
+                            retries=retries,
+                            retry_backoff=0.001,
+                            **kwargs)
+
+    def get_idempotency_keys(self, server):
+        return [headers['idempotency-key']
+                for path, headers, body in server.requests]
+
+    def test_retry_until_success(self):
+        with StandInServer(statuses=[503, 500, 201]) as server:
+            self.get_client(server).post('/', {})
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(server.connections, 1)
+        # All the attempts are the same request for the server.
+        self.assertEqual(len(set(self.get_idempotency_keys(server))), 1)
+
+    def test_give_up(self):
+        with StandInServer(statuses=[503]) as server:
+            with self.assertRaises(ClientHTTPError) as cm:
+                self.get_client(server, retries=2).post('/', {})
+        self.assertEqual(cm.exception.args[0], 503)
+        self.assertEqual(len(server.requests), 3)
+
+    def test_client_errors_are_not_retried(self):
+        with StandInServer(statuses=[400]) as server:
+            with self.assertRaises(ClientHTTPError):
+                self.get_client(server).post('/', {})
+        self.assertEqual(len(server.requests), 1)
+
+    def test_idempotency_key(self):
+        with StandInServer() as server:
+            client = self.get_client(server)
+            client.post('/', {}, idempotency_key='KEY')
+            client.post('/', {})
+            client.post('/', {})
+        keys = self.get_idempotency_keys(server)
+        self.assertEqual(keys[0], 'KEY')
+        self.assertNotEqual(keys[1], keys[2])
+
+    def test_retry_after_too_long(self):
+        with StandInServer(statuses=[429, 201],
+                           error_headers={'Retry-After': '3600'}) as server:
+            with self.assertRaises(ClientHTTPError):
+                self.get_client(server).post('/', {})
+        self.assertEqual(len(server.requests), 1)
+
+    def test_connection_error(self):
+        with StandInServer() as server:
+            client = self.get_client(server, retries=2)
+        with self.assertRaises(ClientConnectionError):
+            client.post('/', {})
+
+    def test_backoff(self):
+        policy = RetryPolicy(retries=5, backoff=1, max_backoff=5,
+                             rand=lambda: 1)
+        self.assertEqual([policy.get_delay(retry) for retry in range(6)],
+                         [1, 2, 4, 5, 5, None])
+        policy.rand = lambda: 0.5
+        self.assertEqual(policy.get_delay(2), 2)
+
+    def test_retry_after(self):
+        policy = RetryPolicy(retries=5, backoff=1, max_retry_after=60,
+                             rand=lambda: 0)
+
+        def response(status, retry_after):
+            return Response(status, '', {'retry-after': retry_after}, b'')
+
+        self.assertEqual(policy.get_delay(0, response(429, '7')), 7)
+        self.assertEqual(policy.get_delay(0, response(503, '7')), 7)
+        self.assertEqual(policy.get_delay(0, response(502, '7')), 0)
+        self.assertEqual(policy.get_delay(0, response(503, 'x')), 0)
+        self.assertIsNone(policy.get_delay(0, response(503, '61')))
+        self.assertIsNone(policy.get_delay(0, response(404, '7')))
+        self.assertAlmostEqual(
+            parse_retry_after(formatdate(time.time() + 30, usegmt=True)),
+            30, delta=2)
+
+    def test_circuit_breaker(self):
+        now = [1000.0]
+
+        def get_circuit_breaker():
+            return CircuitBreaker('http://server', path=self.tmp,
+                                  threshold=2, reset_timeout=60,
+                                  clock=lambda: now[0])
+
+        with StandInServer(statuses=[503, 503, 201]) as server:
+            client = self.get_client(server, retries=0,
+                                     circuit_breaker=get_circuit_breaker())
+            for _ in range(2):
+                with self.assertRaises(ClientHTTPError):
+                    client.post('/', {})
+            with self.assertRaises(CircuitBreakerOpenError):
+                client.post('/', {})
+            # Subsequent runs, too.
+            client.circuit_breaker = get_circuit_breaker()
+            with self.assertRaises(CircuitBreakerOpenError):
+                client.post('/', {})
+            self.assertEqual(len(server.requests), 2)
+
+            now[0] += 61
+            client.post('/', {})
+            self.assertEqual(len(server.requests), 3)
+            self.assertEqual(client.circuit_breaker.load(), (0, None))
+
+
+class StreamTest(unittest.TestCase):
+
+    def get_client(self, server, **kwargs):
+        return OpbeatClient(secret_token='TOKEN',
+                            organization_id='ORG_ID',
+                            app_id='APP_ID',
+                            server=server.url,
+                            **kwargs)
+
+    def get_fragments(self, server, started):
+        yield '['
+        for i in range(1000):
+            yield '%s%d' % (',' if i else '', i)
+            if i == 999:
+                # The upload has started before all the data is produced.
+                deadline = time.time() + 5
+                while not server.requests_started and time.time() < deadline:
+                    time.sleep(0.01)
+                started.append(server.requests_started)
+        yield ']'
+
+    def test_post_stream(self):
+        started = []
+        with StandInServer() as server:
+            client = self.get_client(server)
+            client.post_stream('/', self.get_fragments(server, started),
+                               chunk_size=100)
+            client.post('/', {})
+        self.assertEqual(started, [1])
+        [(_, headers, body), _] = server.requests
+        self.assertEqual(json.loads(body.decode('utf8')), list(range(1000)))
+        self.assertEqual(headers['transfer-encoding'], 'chunked')
+        self.assertEqual(server.connections, 1)
+
+    def test_post_stream_compressed(self):
+        started = []
+        with StandInServer() as server:
+            client = self.get_client(server, compress=True)
+            client.post_stream('/', self.get_fragments(server, started))
+        [(_, headers, body)] = server.requests
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(
+            json.loads(gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+                       .decode('utf8')),
+            list(range(1000))
+        )
+
+    def test_post_stream_error_while_producing(self):
+        def fragments():
+            yield '['
+            raise ValueError()
+
+        with StandInServer() as server:
+            client = self.get_client(server)
+            with self.assertRaises(ValueError):
+                client.post_stream('/', fragments(), chunk_size=1)
+            client.post('/', {})
+        # The incomplete request's connection is not reused.
+        self.assertEqual(client.pool.connections_opened, 2)
@@ -1,4 +1,10 @@
+import gc
+import io
 import os
+import sys
+import glob
+import json
+import time
 import shlex
 import datetime
 import shutil
@@ -9,21 +15,38 @@ from operator import attrgetter
 from pip.vcs import vcs as pip_vcs
 from pip.exceptions import BadCommand
 
-from opbeatcli.deployment.packages.deb import DebDependency
-from opbeatcli.deployment.packages.nodejs import NodeDependency
+from opbeatcli.deployment.packages.deb import (DebDependency, DebCollector,
+                                               DebStatusCollector)
+from opbeatcli.deployment.packages.nodejs import (NodeDependency,
+                                                  read_package_json,
+                                                  read_top_level_strings)
 from opbeatcli.deployment.packages.other import OtherDependency
-from opbeatcli.deployment.packages.python import PythonDependency
-from opbeatcli.deployment.packages.rpm import RPMDependency
-from opbeatcli.deployment.packages.ruby import RubyDependency
+from opbeatcli.deployment.packages.python import (PythonDependency,
+                                                  PythonSiteCollector)
+from opbeatcli.deployment.packages.rpm import (RPMDependency,
+                                               RPMDatabaseCollector)
+from opbeatcli.deployment.packages.ruby import (RubyDependency,
+                                                GemVersionKey,
+                                                parse_gemspec_filename)
 from opbeatcli.deployment.packages.component import Component
-from opbeatcli.deployment.vcs import expand_ssh_host_alias
-from opbeatcli.core import get_command, main, EXIT_SUCCESS
+from opbeatcli.deployment.vcs import VCS, expand_ssh_host_alias
+from opbeatcli.deployment.cache import CollectionCache
+from opbeatcli.deployment.state import canonical_releases, diff_releases
+from opbeatcli.deployment.manifest import load_manifest
+from opbeatcli.deployment import serialize
+from opbeatcli.client import encode_json
+from opbeatcli.core import (get_command, main, EXIT_SUCCESS,
+                            EXIT_SERVER_ERROR)
 from opbeatcli.commands.deployment import KeyValue, PackageSpecValidator
 from opbeatcli.exceptions import (InvalidArgumentError,
                                   DependencyParseError,
-                                  ExternalCommandNotFoundError)
+                                  ExternalCommandError,
+                                  ExternalCommandNotFoundError,
+                                  ClientHTTPError,
+                                  VCSError)
 #noinspection PyUnresolvedReferences
 import settings
+from standin_server import StandInServer
 
 
 try:
@@ -32,6 +55,15 @@ except ImportError:
     import unittest
 
 
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+
+# The rpmdb can only be opened read-only with sqlite3 on Python 3.4+.
+RPMDB_READ_ONLY = sqlite3 is not None and sys.version_info >= (3, 4)
+
 # Homebrew-installed VCS tools may be there but not on PATH.
 os.environ['PATH'] += ':/usr/local/bin'
 
@@ -97,12 +129,12 @@ class _BaseDeploymentCommandTestCase(unittest.TestCase):
         vcs = expected_attributes.get('vcs', None)
         if vcs:
             self.assertIsNotNone(component.vcs)
-            self.assertDictContainsSubset(vcs,  component.vcs.__dict__)
+            self.assertDictContainsSubset(vcs,  component.vcs.as_dict())
             del expected_attributes['vcs']
 
         self.assertDictContainsSubset(
             expected_attributes,
-            component.__dict__
+            component.as_dict()
         )
 
 
@@ -421,6 +453,55 @@ class DeploymentCLIPackagesTest(_BaseDeploymentCommandTestCase):
             command.get_packages_from_args()
 
 
+class DeploymentConcurrentComponentsTest(_BaseDeploymentCommandTestCase):
+    """Test --vcs-jobs."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make_dirs(self, names, marker=None):
+        paths = []
+        for name in names:
+            path = os.path.join(self.tmp, name)
+            os.makedirs(os.path.join(path, marker) if marker else path)
+            paths.append(path)
+        return paths
+
+    def test_vcs_jobs_order(self):
+        paths = self.make_dirs(['c%02d' % i for i in range(20)])
+        command = self.get_deployment_command(' '.join(
+            '--component path:{path} version:{i}'.format(path=path, i=i)
+            for i, path in enumerate(reversed(paths))
+        ) + ' --vcs-jobs 8')
+        packages = command.get_packages_from_args()
+        self.assertEqual([package.path for package in packages],
+                         list(reversed(paths)))
+        self.assertEqual([package.version for package in packages],
+                         [str(i) for i in range(20)])
+
+    @unittest.skipIf(get_vcs_command('bzr'), 'bazaar available')
+    def test_vcs_jobs_errors_reported_in_order(self):
+        ok = self.make_dirs(['ok'])[0]
+        broken = self.make_dirs(['broken1', 'broken2'], marker='.bzr')
+        command = self.get_deployment_command(
+            '--vcs-jobs 3'
+            ' --component path:{0} version:1'
+            ' --component path:{1}'
+            ' --component path:{2}'.format(ok, *broken))
+        with self.assertRaises(VCSError) as cm:
+            command.get_packages_from_args()
+        message = str(cm.exception)
+        self.assertIn('--component: path:%r' % broken[0], message)
+        self.assertIn('cannot read VCS info', message)
+
+    def test_vcs_jobs_invalid(self):
+        with self.assertRaises(SystemExit):
+            self.get_deployment_command('--vcs-jobs 0')
+
+
 class TestDependencyCollection(_BaseDeploymentCommandTestCase):
     """Test automatic dependency collection with valid and invalid output."""
 
@@ -499,6 +580,86 @@ class TestDependencyCollection(_BaseDeploymentCommandTestCase):
             ).get_all_packages()
         )
 
+    def test_collect_jobs_same_results_and_order(self):
+        collect_args = """
+            --no-auto-collect-dependencies
+            --collect-dependencies
+                python:"cat fixtures/pip_freeze.txt"
+                ruby:"cat fixtures/gem_list.txt"
+                deb:"cat fixtures/dpkg_query.txt"
+                rpm:"cat fixtures/rpm_query.txt"
+        """
+
+        def collect(jobs):
+            command = self.get_deployment_command(
+                collect_args + ' --collect-jobs %d' % jobs)
+            return [(dep.package_type, dep.name, dep.version)
+                    for dep in command.collect_dependencies()]
+
+        serial = collect(1)
+        self.assertEqual(len(serial), 7 + 36 + 25 + 25)
+        self.assertEqual(collect(4), serial)
+
+    def test_collect_jobs_explicit_errors_propagate(self):
+        command = self.get_deployment_command("""
+            --no-auto-collect-dependencies
+            --collect-jobs 2
+            --collect-dependencies
+                deb:"cat fixtures/dpkg_query.txt"
+                python:/NOT/A/CMD
+        """)
+        with self.assertRaises(ExternalCommandNotFoundError):
+            list(command.collect_dependencies())
+
+    def test_collect_jobs_invalid(self):
+        with self.assertRaises(SystemExit):
+            self.get_deployment_command('--collect-jobs 0')
+
+    def test_collectors_share_vcs_resolver(self):
+        command = self.get_deployment_command(
+            '--collect-dependencies python --collect-native python')
+        collectors = command.get_collectors()
+        self.assertGreater(len(collectors), 2)
+        for collector, explicit in collectors:
+            self.assertIs(collector.vcs_resolver, command.vcs_resolver)
+
+    def test_collect_streaming_large_output_and_stderr(self):
+        collector = DebCollector(custom_commands=[
+            "yes 'package 1.0' | head -n 50000;"
+            " yes error | head -c 300000 >&2"
+        ])
+        self.assertEqual(sum(1 for _ in collector.collect()), 50000)
+
+    def test_collect_streaming_exit_status_checked(self):
+        collector = DebCollector(custom_commands=['echo name 1.0; exit 3'])
+        dependencies = collector.collect()
+        self.assertEqual(next(dependencies).name, 'name')
+        with self.assertRaises(ExternalCommandError):
+            next(dependencies)
+
+    def test_collect_streaming_yields_while_running(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        done = os.path.join(tmp, 'done')
+        collector = DebCollector(custom_commands=[
+            'echo first 1.0; while [ ! -e %s ]; do sleep 0.01; done;'
+            ' echo second 2.0' % done
+        ])
+        dependencies = collector.collect()
+        self.assertEqual(next(dependencies).name, 'first')
+        open(done, 'w').close()
+        self.assertEqual([dep.name for dep in dependencies], ['second'])
+
+    def test_collect_streaming_failed_command_output_discarded(self):
+        command = self.get_deployment_command('')
+        collector = DebCollector(custom_commands=[
+            'echo first 1.0; echo second 2.0; exit 3',
+            'echo third 3.0',
+        ])
+        self.assertEqual(
+            [dep.name for dep in command.run_collector(collector, False)],
+            [])
+
     def test_collect_python(self):
         command = self.get_deployment_command("""
             --no-auto-collect-dependencies
@@ -710,6 +871,809 @@ class TestDependencyCollection(_BaseDeploymentCommandTestCase):
             list(command.collect_dependencies())
 
 
+class TestNativeDependencyCollection(_BaseDeploymentCommandTestCase):
+    """Test --collect-native collectors against fake package databases."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_file(self, path, content):
+        path = os.path.join(self.tmp, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def collect_native(self, args):
+        command = self.get_deployment_command(
+            '--no-auto-collect-dependencies --collect-native ' + args)
+        return list(command.collect_dependencies())
+
+    def test_collect_native_python(self):
+        site = 'venv/lib/python2.7/site-packages/'
+        self.write_file(
+            site + 'Django-1.5.0.dist-info/METADATA',
+            'Metadata-Version: 2.1\nName: Django\nVersion: 1.5.0\n\n'
+            'Version: not-a-header\n'
+        )
+        self.write_file(
+            site + 'ipython-1.0.dist-info/METADATA',
+            'Name: ipython\nVersion: 1.0\n'
+        )
+        self.write_file(
+            site + 'ipython-1.0.dist-info/direct_url.json',
+            '{"url": "https://github.com/ipython/ipython.git",'
+            ' "vcs_info": {"vcs": "git", "commit_id": "dbf7918"}}'
+        )
+        self.write_file(
+            site + 'argparse-1.2.1.egg-info',
+            'Metadata-Version: 1.0\nName: argparse\nVersion: 1.2.1\n'
+        )
+        self.write_file(
+            site + 'six-1.4.1-py2.7.egg-info/PKG-INFO',
+            'Name: six\nVersion: 1.4.1\n'
+        )
+        self.write_file(
+            'project/project.egg-info/PKG-INFO',
+            'Name: project\nVersion: 0.1\n'
+        )
+        self.write_file(
+            site + 'project.egg-link',
+            os.path.join(self.tmp, 'project') + '\n.'
+        )
+        self.write_file(site + 'README.txt', 'not a distribution')
+        for name in ['pip', 'setuptools', 'wheel']:
+            self.write_file(
+                site + '%s-1.0.dist-info/METADATA' % name,
+                'Name: %s\nVersion: 1.0\n' % name
+            )
+
+        dependencies = self.collect_native(
+            'python:' + os.path.join(self.tmp, 'venv'))
+
+        self.assertTrue(all(isinstance(dep, PythonDependency)
+                            for dep in dependencies))
+        self.assertEqual(
+            [(dep.name, dep.version) for dep in dependencies],
+            [
+                ('argparse', '1.2.1'),
+                ('Django', '1.5.0'),
+                ('ipython', '1.0'),
+                ('project', '0.1'),
+                ('six', '1.4.1'),
+            ]
+        )
+        self.assert_package_attributes(dependencies[2], {
+            'name': 'ipython',
+            'vcs': {
+                'vcs_type': 'git',
+                'rev': 'dbf7918',
+                'remote_url': 'https://github.com/ipython/ipython.git',
+            }
+        })
+
+    def test_collect_native_python_site_dir(self):
+        self.write_file('site-packages/six-1.4.1.dist-info/METADATA',
+                        'Name: six\nVersion: 1.4.1\n')
+        dependencies = self.collect_native(
+            'python:' + os.path.join(self.tmp, 'site-packages'))
+        self.assertEqual([dep.name for dep in dependencies], ['six'])
+
+    def test_collect_native_python_source_not_found(self):
+        with self.assertRaises(ExternalCommandNotFoundError):
+            self.collect_native('python:' + os.path.join(self.tmp, 'nope'))
+
+    def test_collect_native_python_default_source(self):
+        self.assertEqual(PythonSiteCollector.get_default_sources(),
+                         [sys.prefix])
+        # As bare as it may be, pip is installed, but left out.
+        names = [dep.name.lower() for dep in self.collect_native('python')]
+        self.assertNotIn('pip', names)
+
+    def test_collect_native_deb(self):
+        dependencies = self.collect_native('deb:fixtures/dpkg_status.txt')
+        self.assertTrue(all(isinstance(dep, DebDependency)
+                            for dep in dependencies))
+        self.assertEqual(
+            [(dep.name, dep.version) for dep in dependencies],
+            [
+                ('accountsservice', '0.6.15-2ubuntu9.6'),
+                ('acpid', '1:2.0.10-1ubuntu3'),
+                ('libc6', '2.15-0ubuntu10.5'),
+                ('libc6', '2.15-0ubuntu10.5'),
+            ]
+        )
+
+    def test_collect_native_deb_qualify_multiarch(self):
+        collector = DebStatusCollector(
+            custom_sources=['fixtures/dpkg_status.txt'],
+            qualify_multiarch=True,
+        )
+        self.assertEqual(
+            [dep.name for dep in collector.collect()],
+            ['accountsservice', 'acpid', 'libc6:amd64', 'libc6:i386']
+        )
+
+    def test_collect_native_deb_multiarch_arg(self):
+        dependencies = self.collect_native(
+            'deb:fixtures/dpkg_status.txt --deb-multiarch')
+        self.assertEqual(
+            [dep.name for dep in dependencies],
+            ['accountsservice', 'acpid', 'libc6:amd64', 'libc6:i386']
+        )
+
+    def test_collect_native_deb_empty_and_missing(self):
+        path = self.write_file('status', '')
+        self.assertEqual(self.collect_native('deb:' + path), [])
+        with self.assertRaises(ExternalCommandNotFoundError):
+            self.collect_native('deb:' + path + '-missing')
+
+    @unittest.skipUnless(RPMDB_READ_ONLY, 'cannot open rpmdb read-only')
+    def test_collect_native_rpm(self):
+        dependencies = self.collect_native('rpm:fixtures/rpmdb.sqlite')
+        self.assertTrue(all(isinstance(dep, RPMDependency)
+                            for dep in dependencies))
+        # The same as `rpm --query --all' with the default --queryformat.
+        self.assertEqual(
+            [(dep.name, dep.version) for dep in dependencies],
+            [
+                ('libaio', '0.3.1095.fc17'),
+                ('python3', '3.2.37.fc17'),
+                ('gpg-pubkey', 'a82ba4b74e2df47d'),
+            ]
+        )
+
+    @unittest.skipUnless(RPMDB_READ_ONLY, 'cannot open rpmdb read-only')
+    def test_collect_native_rpm_missing_and_invalid(self):
+        with self.assertRaises(ExternalCommandNotFoundError):
+            self.collect_native('rpm:' + self.tmp)
+        path = self.write_file('rpmdb.sqlite', 'not a database')
+        with self.assertRaises(DependencyParseError):
+            self.collect_native('rpm:' + path)
+
+    def test_collect_native_rpm_fallback(self):
+        dbpath = os.path.join(self.tmp, 'rpm')
+        rpm = self.write_file(
+            'bin/rpm',
+            '#!/bin/sh\n[ "$1 $2" = "--dbpath %s" ] && echo bash 4.2.fc19\n'
+            % dbpath)
+        os.chmod(rpm, 0o755)
+        path = os.environ['PATH']
+        self.addCleanup(os.environ.__setitem__, 'PATH', path)
+        os.environ['PATH'] = os.path.dirname(rpm) + ':' + path
+
+        class Collector(RPMDatabaseCollector):
+            def connect(self, source):
+                return None
+
+        source = self.write_file('rpm/rpmdb.sqlite', '')
+        collector = Collector(custom_sources=[source])
+        self.assertEqual(
+            [(dep.name, dep.version) for dep in collector.collect()],
+            [('bash', '4.2.fc19')])
+
+    def test_collect_native_nodejs(self):
+        def package(path, name, version, extra=''):
+            self.write_file(
+                os.path.join('app/node_modules', path, 'package.json'),
+                '{"name": "%s", %s "version": "%s"}' % (name, extra, version)
+            )
+        package('a', 'a', '1.0.0')
+        package('a/node_modules/c', 'c', '1.0.0')
+        package('c', 'c', '2.0.0')
+        package('d', 'd', '0.1.0',
+                extra='"author": {"name": "X"}, "_from": {"version": "Y"},')
+        package('d/node_modules/c', 'c', '2.0.0')
+        package('@scope/b', '@scope/b', '2.0.0')
+        self.write_file('app/node_modules/.bin/a', '')
+
+        dependencies = self.collect_native(
+            'nodejs:' + os.path.join(self.tmp, 'app'))
+        self.assertTrue(all(isinstance(dep, NodeDependency)
+                            for dep in dependencies))
+        self.assertEqual(
+            [(dep.name, dep.version) for dep in dependencies],
+            [
+                ('@scope/b', '2.0.0'),
+                ('a', '1.0.0'),
+                ('c', '1.0.0'),
+                ('c', '2.0.0'),
+                ('d', '0.1.0'),
+            ]
+        )
+
+    def test_collect_native_nodejs_missing(self):
+        with self.assertRaises(ExternalCommandNotFoundError):
+            self.collect_native('nodejs:' + self.tmp)
+
+    def test_read_package_json_nested_fields(self):
+        for content, expected in [
+            ('{"name": "a", "version": "1.0"}', ('a', '1.0')),
+            ('{"author": {"name": "Ann"}, "version": "1.0"}', (None, '1.0')),
+            ('{"name": "a", "engines": {"version": "2"}}', ('a', None)),
+            ('{"description": "[\\"name\\"", "x": ["{"],'
+             ' "name": "a", "version": "1.0"}', ('a', '1.0')),
+        ]:
+            path = self.write_file('package.json', content)
+            self.assertEqual(read_package_json(path), expected)
+
+    def test_read_package_json_stops_when_found(self):
+        # Not even valid JSON after the fields.
+        path = self.write_file(
+            'package.json',
+            '{"name": "a", "author": {"name": "Ann"}, "version": "1.0",'
+            ' "readme": "%s' % ('x' * 100000))
+        self.assertEqual(read_package_json(path), ('a', '1.0'))
+
+    def test_read_top_level_strings_across_reads(self):
+        def read(content, read_size=1024):
+            path = self.write_file('package.json', content)
+            with io.open(path, encoding='utf8') as f:
+                return read_top_level_strings(f, ('name', 'version'),
+                                              read_size)
+
+        content = ('{"x": "a \\"quoted\\" \\\\", "list": [1, {"name": 2}],'
+                   ' "name": "b", "n": null, "version": "2.0"}')
+        for read_size in [1, 2, 3, 7]:
+            self.assertEqual(read(content, read_size),
+                             {'name': 'b', 'version': '2.0'})
+        self.assertIsNone(read('{"version": 1, "name": "a"}'))
+        self.assertIsNone(read('["name", "version"]'))
+        self.assertEqual(read('{"name": "a"} '), {'name': 'a'})
+
+    def test_collect_native_nodejs_jobs(self):
+        command = self.get_deployment_command(
+            '--no-auto-collect-dependencies --collect-native nodejs'
+            ' --collect-jobs 3')
+        [(collector, explicit)] = command.get_collectors()
+        self.assertEqual(collector.jobs, 3)
+
+    def test_collect_native_ruby(self):
+        for spec in [
+            'gems/specifications/rails-3.2.12.gemspec',
+            'gems/specifications/rails-3.0.9.gemspec',
+            'gems/specifications/rails-3.0.10.gemspec',
+            'gems/specifications/net-http-persistent-2.9.gemspec',
+            'gems/specifications/nokogiri-1.13.1-x86_64-linux.gemspec',
+            'gems/specifications/default/json-2.3.0.gemspec',
+            'app/vendor/bundle/ruby/2.7.0/specifications/rails-3.2.12.gemspec',
+            'app/vendor/bundle/ruby/2.7.0/specifications/rake-10.0.gemspec',
+        ]:
+            self.write_file(spec, '')
+        self.write_file('gems/gems/rails-3.2.12/README', '')
+
+        dependencies = self.collect_native('ruby:{gems}{sep}{bundle}'.format(
+            gems=os.path.join(self.tmp, 'gems'),
+            bundle=os.path.join(self.tmp, 'app', 'vendor', 'bundle'),
+            sep=os.pathsep
+        ))
+        self.assertTrue(all(isinstance(dep, RubyDependency)
+                            for dep in dependencies))
+        self.assertEqual(
+            [(dep.name, dep.version) for dep in dependencies],
+            [
+                ('json', '2.3.0'),
+                ('net-http-persistent', '2.9'),
+                ('nokogiri', '1.13.1'),
+                ('rails', '3.2.12'),
+                ('rails', '3.0.10'),
+                ('rails', '3.0.9'),
+                ('rake', '10.0'),
+            ]
+        )
+
+    def test_parse_gemspec_filename(self):
+        for filename, expected in [
+            ('rake-10.0.gemspec', ('rake', '10.0')),
+            ('foo-2fa-1.0.0.gemspec', ('foo-2fa', '1.0.0')),
+            ('foo-2-bar-1.0.gemspec', ('foo-2-bar', '1.0')),
+            ('oauth2-2.0.9.gemspec', ('oauth2', '2.0.9')),
+            ('rails-7.1.0.rc1.gemspec', ('rails', '7.1.0.rc1')),
+            ('jruby-openssl-0.9.4-java.gemspec', ('jruby-openssl', '0.9.4')),
+            ('nokogiri-1.13.1-arm64-darwin-21.gemspec',
+             ('nokogiri', '1.13.1')),
+            ('ffi-2fa-1.15.5-x86_64-linux-gnu.gemspec', ('ffi-2fa', '1.15.5')),
+        ]:
+            self.assertEqual(parse_gemspec_filename(filename), expected)
+        with self.assertRaises(DependencyParseError):
+            parse_gemspec_filename('no-version.gemspec')
+
+    def test_gem_version_order(self):
+        versions = ['1.0.0', '1.0.0.rc1', '1.0.0.1', '0.9', '1.0.0.rc2',
+                    '1.0.0.beta', '1.0.0.0.a', '10.0', '1.1']
+        self.assertEqual(sorted(versions, key=GemVersionKey, reverse=True),
+                         ['10.0', '1.1', '1.0.0.1', '1.0.0', '1.0.0.rc2',
+                          '1.0.0.rc1', '1.0.0.beta', '1.0.0.0.a', '0.9'])
+
+    def test_collect_native_ruby_gem_home(self):
+        self.write_file('gems/specifications/rake-10.0.gemspec', '')
+        environ = os.environ.copy()
+        os.environ['GEM_HOME'] = os.path.join(self.tmp, 'gems')
+        try:
+            dependencies = self.collect_native('ruby')
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        self.assertEqual([(dep.name, dep.version) for dep in dependencies],
+                         [('rake', '10.0')])
+
+    def test_collect_native_ruby_missing(self):
+        with self.assertRaises(ExternalCommandNotFoundError):
+            self.collect_native('ruby:' + self.tmp)
+
+    def test_collect_native_unknown_type(self):
+        with self.assertRaises(InvalidArgumentError):
+            self.collect_native('other')
+
+
+class CountingDebStatusCollector(DebStatusCollector):
+
+    reads = 0
+
+    def read_source(self, source):
+        self.reads += 1
+        return super(CountingDebStatusCollector, self).read_source(source)
+
+
+class TestCollectionCache(_BaseDeploymentCommandTestCase):
+    """Test --cache, i.e., reusing dependencies of unchanged sources."""
+
+    STATUS = (
+        'Package: acpid\n'
+        'Status: install ok installed\n'
+        'Version: {version}\n'
+    )
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = CollectionCache(path=self.tmp)
+        self.status = os.path.join(self.tmp, 'status')
+        self.write_status('1:2.0.10-1ubuntu3')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_status(self, version):
+        with open(self.status, 'w') as f:
+            f.write(self.STATUS.format(version=version))
+
+    def collect(self, collector):
+        return [(dep.name, dep.version) for dep in collector.collect()]
+
+    def test_cache_hit(self):
+        collector = CountingDebStatusCollector(custom_sources=[self.status],
+                                               cache=self.cache)
+        expected = [('acpid', '1:2.0.10-1ubuntu3')]
+        self.assertEqual(self.collect(collector), expected)
+        self.assertEqual(self.collect(collector), expected)
+        self.assertEqual(collector.reads, 1)
+
+        dependencies = list(collector.collect())
+        self.assertIsInstance(dependencies[0], DebDependency)
+
+    def test_cache_invalid_entries(self):
+        collector = CountingDebStatusCollector(custom_sources=[self.status],
+                                               cache=self.cache)
+        expected = [('acpid', '1:2.0.10-1ubuntu3')]
+        self.assertEqual(self.collect(collector), expected)
+        [path] = glob.glob(os.path.join(self.cache.path, '*.json'))
+        for content in ['{"dependencies": [["deb", "acpid", "1.0", nu',
+                        '{}',
+                        '[]',
+                        '{"dependencies": [["deb", "acpid"]]}',
+                        '{"dependencies": [["nope", "acpid", "1", null]]}',
+                        '{"dependencies": [["deb", "a", "1", {"x": 1}]]}',
+                        '{"dependencies": [["deb", "a", "1", {"rev": "a",'
+                        ' "vcs_type": "cvs"}]]}']:
+            with open(path, 'w') as f:
+                f.write(content)
+            reads = collector.reads
+            self.assertEqual(self.collect(collector), expected)
+            self.assertEqual(collector.reads, reads + 1)
+            # Replaced with a valid one.
+            self.assertEqual(self.collect(collector), expected)
+            self.assertEqual(collector.reads, reads + 1)
+
+    def test_cache_invalidated_when_source_changes(self):
+        collector = CountingDebStatusCollector(custom_sources=[self.status],
+                                               cache=self.cache)
+        self.collect(collector)
+        self.write_status('1:2.0.16-1ubuntu2')
+        self.assertEqual(self.collect(collector),
+                         [('acpid', '1:2.0.16-1ubuntu2')])
+        self.assertEqual(collector.reads, 2)
+
+    def test_cache_disabled(self):
+        collector = CountingDebStatusCollector(custom_sources=[self.status])
+        self.collect(collector)
+        self.collect(collector)
+        self.assertEqual(collector.reads, 2)
+
+    def test_cache_editable_checkout_head_changes(self):
+        site = os.path.join(self.tmp, 'venv', 'lib', 'python2.7',
+                            'site-packages')
+        project = os.path.join(self.tmp, 'project')
+        for path, content in [
+            (os.path.join(site, 'project.egg-link'), project + '\n.'),
+            (os.path.join(project, 'project.egg-info', 'PKG-INFO'),
+             'Name: project\nVersion: 0.1\n'),
+            (os.path.join(project, '.git', 'HEAD'), 'ref: refs/heads/main\n'),
+            (os.path.join(project, '.git', 'refs', 'heads', 'main'),
+             'a' * 40 + '\n'),
+        ]:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(content)
+
+        def revs():
+            # Each run resolves the VCS info anew.
+            collector = PythonSiteCollector(
+                custom_sources=[os.path.join(self.tmp, 'venv')],
+                cache=self.cache)
+            return [dep.vcs.rev for dep in collector.collect()]
+        self.assertEqual(revs(), ['a' * 40])
+        # A commit in the checkout, which site-packages knows nothing of.
+        with open(os.path.join(project, '.git', 'refs', 'heads', 'main'),
+                  'w') as f:
+            f.write('b' * 40 + '\n')
+        self.assertEqual(revs(), ['b' * 40])
+
+    def test_cache_custom_commands_not_cached(self):
+        collector = DebCollector(custom_commands=['echo acpid 1.0'],
+                                 cache=self.cache)
+        self.assertEqual(self.collect(collector), [('acpid', '1.0')])
+        self.assertFalse(os.path.exists(self.cache.path)
+                         and os.listdir(self.cache.path))
+
+    def test_cache_lru_eviction(self):
+        cache = CollectionCache(path=self.tmp, max_size=1)
+        collector = CountingDebStatusCollector(custom_sources=[self.status],
+                                               cache=cache)
+        self.collect(collector)
+        self.collect(collector)
+        # Over the limit right away.
+        self.assertEqual(collector.reads, 2)
+
+        cache.max_size = 9999
+        dependencies = [DebDependency(name='acpid', version=str(i))
+                        for i in range(3)]
+        for key in ['a', 'b', 'c']:
+            cache.set(key, dependencies)
+            # Make sure the mtimes differ.
+            os.utime(cache.entry_path(key), (time.time(), time.time() - 10))
+        self.assertIsNotNone(cache.get('a'))  # "a" is now the most recent.
+        entry_size = os.path.getsize(cache.entry_path('a'))
+        cache.max_size = entry_size * 2
+        cache.set('d', dependencies)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNone(cache.get('c'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('d'))
+
+    def test_cache_args(self):
+        command = self.get_deployment_command(
+            '--no-auto-collect-dependencies --collect-native deb:{status}'
+            ' --cache --cache-dir {tmp}'.format(status=self.status,
+                                               tmp=self.tmp))
+        [(collector, explicit)] = command.get_collectors()
+        self.assertEqual(collector.cache.path,
+                         os.path.join(self.tmp, 'collect'))
+        list(command.collect_dependencies())
+        self.assertEqual(
+            len(glob.glob(os.path.join(self.tmp, 'collect', '*.json'))), 1)
+
+        command = self.get_deployment_command('--cache --no-cache')
+        for collector, explicit in command.get_collectors():
+            self.assertIsNone(collector.cache)
+
+
+class TestDeduplication(_BaseDeploymentCommandTestCase):
+
+    def get_packages(self, args):
+        command = self.get_deployment_command(
+            '--no-auto-collect-dependencies ' + args)
+        return [(package.package_type, package.name, package.version)
+                for package in command.get_all_packages()]
+
+    def test_identical_packages_collapsed(self):
+        packages = self.get_packages("""
+            --collect-dependencies
+                deb:"cat fixtures/dpkg_query.txt"
+                deb:"cat ./fixtures/dpkg_query.txt"
+        """)
+        self.assertEqual(len(packages), 25)
+        self.assertEqual(len(set(packages)), 25)
+
+    def test_explicit_dependency_wins(self):
+        packages = self.get_packages("""
+            --dependency type:deb name:acpid version:EXPLICIT
+            --collect-dependencies deb:"cat fixtures/dpkg_query.txt"
+        """)
+        self.assertIn(('deb', 'acpid', 'EXPLICIT'), packages)
+        self.assertNotIn(('deb', 'acpid', '1:2.0.10-1ubuntu3'), packages)
+        self.assertEqual(len(packages), 25)
+
+    def test_different_versions_kept(self):
+        packages = self.get_packages("""
+            --collect-dependencies
+                deb:"cat fixtures/dpkg_query.txt"
+                deb:"echo acpid 2.0"
+        """)
+        self.assertIn(('deb', 'acpid', '1:2.0.10-1ubuntu3'), packages)
+        self.assertIn(('deb', 'acpid', '2.0'), packages)
+
+    def test_canonical_order(self):
+        packages = self.get_packages("""
+            --dependency type:other name:b version:1
+            --dependency type:other name:a version:1
+            --collect-dependencies
+                rpm:"cat fixtures/rpm_query.txt"
+                deb:"cat fixtures/dpkg_query.txt"
+        """)
+        self.assertEqual(packages, sorted(packages))
+        self.assertEqual(packages, self.get_packages("""
+            --dependency type:other name:a version:1
+            --dependency type:other name:b version:1
+            --collect-dependencies
+                deb:"cat fixtures/dpkg_query.txt"
+                rpm:"cat fixtures/rpm_query.txt"
+        """))
+
+    def test_streamed_without_duplicates(self):
+        with StandInServer() as server:
+            main(shlex.split(
+                '-t token -o org -a app -s {url} --retries 0 deployment'
+                ' --stream --no-auto-collect-dependencies'
+                ' --dependency type:deb name:acpid version:EXPLICIT'
+                ' --collect-dependencies deb:"echo acpid 1.0; echo acpid 1.0"'
+                .format(url=server.url)))
+        [(path, headers, body)] = server.requests
+        releases = json.loads(body.decode('utf8'))['releases']
+        self.assertEqual([release['version'] for release in releases],
+                         ['EXPLICIT'])
+
+
+class TestPackageMemory(unittest.TestCase):
+
+    def test_no_instance_dict(self):
+        dependency = PythonDependency(name='foo', version='1.0',
+                                      vcs=VCS(rev='abc', vcs_type='git'))
+        self.assertIsInstance(dependency.vcs, VCS)
+        self.assertFalse(hasattr(dependency, '__dict__'))
+        self.assertFalse(hasattr(dependency.vcs, '__dict__'))
+        with self.assertRaises(AttributeError):
+            dependency.foo = 'bar'
+
+    def test_equal_vcs_shared(self):
+        dependencies = [
+            PythonDependency(name=name, version='1.0', vcs=VCS(
+                vcs_type='git', rev='abc', branch='master',
+                remote_url='https://example.com/repo.git'))
+            for name in ['a', 'b']
+        ]
+        self.assertIs(dependencies[0].vcs, dependencies[1].vcs)
+        other = PythonDependency(name='c', vcs=VCS(rev='def'))
+        self.assertIsNot(other.vcs, dependencies[0].vcs)
+        self.assertNotEqual(other.vcs, dependencies[0].vcs)
+
+    def test_unused_shared_vcs_released(self):
+        vcs = VCS(rev='unused', vcs_type='git').shared()
+        key = vcs.key
+        self.assertIn(key, VCS._shared)
+        del vcs
+        gc.collect()
+        self.assertNotIn(key, VCS._shared)
+
+    def test_repr(self):
+        component = Component(path='/app', name='app', version='1',
+                              vcs=VCS(rev='abc', vcs_type='git'))
+        self.assertEqual(
+            repr(component),
+            "Component(path='/app', name='app', version='1',"
+            " vcs=VCS(rev='abc', vcs_type='git', branch=None,"
+            " remote_url=None))"
+        )
+
+
+class RecordingClient(object):
+
+    def __init__(self, failing_app_ids=()):
+        self.posted = []
+        self.posted_app_ids = []
+        self.failing_app_ids = failing_app_ids
+
+    def post(self, uri, data, idempotency_key=None, app_id=None):
+        if app_id in self.failing_app_ids:
+            raise ClientHTTPError(500)
+        self.posted.append(data)
+        self.posted_app_ids.append(app_id)
+
+
+class TestSkipUnchanged(_BaseDeploymentCommandTestCase):
+    """Test --skip-unchanged and the diff against the last deployment."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def register(self, args, hostname='web1'):
+        command = self.get_deployment_command(
+            '--no-auto-collect-dependencies --skip-unchanged'
+            ' --cache-dir {tmp} --hostname {hostname} {args}'
+            .format(tmp=self.tmp, hostname=hostname, args=args))
+        command._client = RecordingClient()
+        command.run()
+        return len(command._client.posted)
+
+    def test_skip_unchanged(self):
+        deps = ('--dependency type:other name:a version:1'
+                ' --dependency type:other name:b version:1')
+        self.assertEqual(self.register(deps), 1)
+        self.assertEqual(self.register(deps), 0)
+        # The order does not matter.
+        self.assertEqual(self.register(
+            '--dependency type:other name:b version:1'
+            ' --dependency type:other name:a version:1'), 0)
+        # Other hosts have their own state.
+        self.assertEqual(self.register(deps, hostname='web2'), 1)
+        self.assertEqual(self.register(deps + ' --dependency'
+                                       ' type:other name:c version:1'), 1)
+        self.assertEqual(self.register(deps), 1)
+
+    def test_diff_releases(self):
+        def release(name, version, package_type='deb'):
+            return {'module': {'name': name, 'type': package_type},
+                    'version': version}
+
+        old = canonical_releases([
+            release('acpid', '1'),
+            release('libc6', '2.15'),
+            release('libc6', '2.15'),
+            release('rake', '10.0', 'rpm'),
+        ])
+        new = canonical_releases([
+            release('zlib', '1.2'),
+            release('rake', '10.0', 'rpm'),
+            release('libc6', '2.15'),
+            release('libc6', '2.17'),
+        ])
+        added, removed, changed = diff_releases(old, new)
+        self.assertEqual([key for key, _ in added],
+                         [('deb', 'zlib', '')])
+        self.assertEqual([key for key, _ in removed],
+                         [('deb', 'acpid', '')])
+        self.assertEqual(
+            [(json.loads(old)['version'], json.loads(new)['version'])
+             for (_, old), (_, new) in changed],
+            [('2.15', '2.17')]
+        )
+        self.assertEqual(diff_releases(new, new), ([], [], []))
+
+
+class TestManifest(_BaseDeploymentCommandTestCase):
+    """Test registering deployments of many apps with --manifest."""
+
+    MANIFEST = {
+        'apps': [
+            {
+                'app_id': 'web',
+                'components': [
+                    {'path': '/srv/web', 'name': 'web', 'version': '1.0'},
+                ],
+            },
+            {
+                'app_id': 'worker',
+                'dependencies': [
+                    {'type': 'other', 'name': 'redis', 'version': '2.8'},
+                ],
+            },
+        ]
+    }
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_manifest(self, manifest, filename='manifest.json'):
+        path = os.path.join(self.tmp, filename)
+        with open(path, 'w') as f:
+            f.write(json.dumps(manifest))
+        return path
+
+    def get_manifest_command(self, manifest, args='', client=None):
+        command = get_command(shlex.split(
+            '-t token -o org deployment --no-auto-collect-dependencies'
+            ' --manifest {path} {args}'
+            .format(path=self.write_manifest(manifest), args=args)))
+        command._client = client or RecordingClient()
+        return command
+
+    def get_releases(self, data):
+        return sorted((release['module']['name'], release['version'])
+                      for release in data['releases'])
+
+    def test_load_manifest(self):
+        apps = load_manifest(self.write_manifest(self.MANIFEST))
+        self.assertEqual(apps, [
+            ('web', [[('name', 'web'), ('path', '/srv/web'),
+                      ('version', '1.0')]], []),
+            ('worker', [], [[('name', 'redis'), ('type', 'other'),
+                             ('version', '2.8')]]),
+        ])
+
+    def test_invalid_manifests(self):
+        invalid = [
+            {},
+            {'apps': []},
+            {'apps': [{'components': []}]},
+            {'apps': [{'app_id': 'a'}, {'app_id': 'a'}]},
+            {'apps': [{'app_id': 'a', 'servers': []}]},
+            {'apps': [{'app_id': 'a', 'components': {}}]},
+            {'apps': [{'app_id': 'a', 'components': [{}]}]},
+            {'apps': [{'app_id': 'a', 'components': [{'path': ['/']}]}]},
+        ]
+        for manifest in invalid:
+            with self.assertRaises(InvalidArgumentError):
+                load_manifest(self.write_manifest(manifest))
+        with self.assertRaises(InvalidArgumentError):
+            load_manifest(os.path.join(self.tmp, 'missing.json'))
+
+    def test_invalid_package_in_manifest(self):
+        command = self.get_manifest_command({
+            'apps': [{'app_id': 'a', 'dependencies': [{'name': 'x'}]}]
+        })
+        with self.assertRaises(SystemExit):
+            command.run()
+
+    def test_app_id_required_without_manifest(self):
+        command = get_command(shlex.split(
+            '-t token -o org deployment --no-auto-collect-dependencies'))
+        with self.assertRaises(SystemExit):
+            command.run()
+
+    def test_shared_packages(self):
+        command = self.get_manifest_command(
+            self.MANIFEST,
+            '--dependency type:other name:nginx version:1.5.3 --post-jobs 2')
+        self.assertEqual(command.run(), EXIT_SUCCESS)
+        # Posted concurrently, in any order.
+        posted = dict(zip(command.client.posted_app_ids,
+                          command.client.posted))
+        self.assertEqual(sorted(posted), ['web', 'worker'])
+        web, worker = posted['web'], posted['worker']
+        self.assertEqual(self.get_releases(web),
+                         [('nginx', '1.5.3'), ('web', '1.0')])
+        self.assertEqual(self.get_releases(worker),
+                         [('nginx', '1.5.3'), ('redis', '2.8')])
+
+    def test_failed_app_does_not_stop_others(self):
+        command = self.get_manifest_command(
+            self.MANIFEST, client=RecordingClient(failing_app_ids=['web']))
+        self.assertEqual(command.run(), EXIT_SERVER_ERROR)
+        self.assertEqual(command.client.posted_app_ids, ['worker'])
+
+    def test_skip_unchanged(self):
+        args = '--skip-unchanged --cache-dir %s' % self.tmp
+        command = self.get_manifest_command(self.MANIFEST, args)
+        self.assertEqual(command.run(), EXIT_SUCCESS)
+        self.assertEqual(len(command.client.posted), 2)
+
+        manifest = json.loads(json.dumps(self.MANIFEST))
+        manifest['apps'][0]['components'][0]['version'] = '1.1'
+        command = self.get_manifest_command(manifest, args)
+        self.assertEqual(command.run(), EXIT_SUCCESS)
+        self.assertEqual(command.client.posted_app_ids, ['web'])
+
+
 class DeploymentAPIVersion1SerializationTest(_BaseDeploymentCommandTestCase):
     """Test serialization as per the Opbeat API version 1 docs."""
 
@@ -781,6 +1745,54 @@ class DeploymentAPIVersion1SerializationTest(_BaseDeploymentCommandTestCase):
             ]
         })
 
+    def test_streamed_serialization(self):
+        command = self.get_deployment_command("""
+            --hostname HOSTNAME
+            --component path:/PATH name:COMPONENT version:1.0 vcs:git
+                        branch:BRANCH rev:REV remote_url:REMOTE_URL
+            --no-auto-collect-dependencies
+            --dependency type:other name:DEPENDENCY version:\u00e9
+        """)
+        packages = command.get_packages_from_args()
+        for packages in [packages, packages[:1], []]:
+            self.assertEqual(
+                ''.join(serialize.iter_deployment_json('HOSTNAME', packages))
+                .encode('utf8'),
+                encode_json(serialize.deployment('HOSTNAME', packages))
+            )
+
+
+class TestStreamedDeployment(_BaseDeploymentCommandTestCase):
+
+    ARGS = ('--no-auto-collect-dependencies'
+            ' --dependency type:other name:a version:1'
+            ' --dependency type:other name:b version:2')
+
+    def run_deployment(self, server, args):
+        return main(shlex.split(
+            '-t token -o org -a app -s {url} --retries 0 deployment {args}'
+            .format(url=server.url, args=args)))
+
+    def test_stream(self):
+        with StandInServer() as server:
+            self.assertEqual(self.run_deployment(server, self.ARGS),
+                             EXIT_SUCCESS)
+            self.assertEqual(
+                self.run_deployment(server, self.ARGS + ' --stream'),
+                EXIT_SUCCESS)
+        (_, headers, body), (_, streamed_headers, streamed) = server.requests
+        self.assertEqual(streamed, body)
+        self.assertEqual(streamed_headers['transfer-encoding'], 'chunked')
+
+    def test_stream_requires_all_data_options(self):
+        with StandInServer() as server:
+            for option in ['--skip-unchanged', '--spool-dir /tmp',
+                           '--manifest manifest.json']:
+                with self.assertRaises(SystemExit):
+                    self.run_deployment(
+                        server, self.ARGS + ' --stream ' + option)
+        self.assertEqual(server.requests, [])
+
 
 class TestSSHAliasExpansion(unittest.TestCase):
 
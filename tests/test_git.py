@@ -0,0 +1,207 @@
+import os
+import shutil
+import tempfile
+import subprocess
+
+from opbeatcli.compat import which
+from opbeatcli.deployment.git import (read_git_metadata, find_git_dir,
+                                      UnsupportedGitLayout)
+from opbeatcli.deployment.vcs import VCS, VCSResolver
+from opbeatcli.deployment.packages.component import Component
+from opbeatcli.exceptions import VCSError
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+GIT = which('git')
+
+
+@unittest.skipIf(not GIT, 'git not available')
+class NativeGitMetadataTest(unittest.TestCase):
+    """Compare the native Git reader with what ``git`` says."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.repo = os.path.join(self.tmp, 'repo')
+        os.mkdir(self.repo)
+        self.git('init', '-q')
+        self.git('checkout', '-q', '-b', 'main')
+        self.commit('first')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def git(self, *args, **kwargs):
+        return subprocess.check_output(
+            [GIT, '-c', 'user.name=Test', '-c', 'user.email=test@example.com']
+            + list(args),
+            cwd=kwargs.get('cwd', self.repo),
+            stderr=subprocess.STDOUT,
+        ).decode().strip()
+
+    def commit(self, message):
+        self.git('commit', '-q', '--allow-empty', '-m', message)
+
+    def assert_matches_git(self, path=None):
+        path = path or self.repo
+        rev, branch, remote_url = read_git_metadata(path)
+        self.assertEqual(rev, self.git('rev-parse', 'HEAD', cwd=path))
+        try:
+            git_branch = self.git('symbolic-ref', '--short', 'HEAD', cwd=path)
+        except subprocess.CalledProcessError:
+            git_branch = None
+        self.assertEqual(branch, git_branch)
+        try:
+            git_url = self.git('config', 'remote.origin.url', cwd=path)
+        except subprocess.CalledProcessError:
+            git_url = None
+        self.assertEqual(remote_url, git_url)
+
+    def test_loose_refs(self):
+        self.assert_matches_git()
+
+    def test_packed_refs(self):
+        self.git('branch', 'other')
+        self.git('pack-refs', '--all')
+        self.assertFalse(os.path.exists(
+            os.path.join(self.repo, '.git', 'refs', 'heads', 'main')))
+        self.assert_matches_git()
+
+        # Loose refs take precedence over packed ones.
+        self.commit('second')
+        self.assert_matches_git()
+
+    def test_detached_head(self):
+        self.commit('second')
+        self.git('checkout', '-q', 'HEAD~1')
+        self.assert_matches_git()
+        self.assertIsNone(read_git_metadata(self.repo)[1])
+
+    def test_remote_url(self):
+        self.git('remote', 'add', 'origin',
+                 'git@github.com:opbeat/opbeatcli.git')
+        self.git('remote', 'add', 'upstream', 'https://example.com/x.git')
+        self.assert_matches_git()
+        self.assertEqual(read_git_metadata(self.repo)[2],
+                         'git@github.com:opbeat/opbeatcli.git')
+
+    def test_worktree(self):
+        worktree = os.path.join(self.tmp, 'worktree')
+        self.git('worktree', 'add', '-q', '-b', 'feature', worktree)
+        self.assertTrue(os.path.isfile(os.path.join(worktree, '.git')))
+        self.git('remote', 'add', 'origin', 'https://example.com/x.git')
+        self.git('commit', '-q', '--allow-empty', '-m', 'wt', cwd=worktree)
+        self.assert_matches_git(worktree)
+        self.assert_matches_git()
+
+    def test_submodule_style_gitdir_file(self):
+        git_dir = os.path.join(self.tmp, 'modules', 'repo')
+        shutil.move(os.path.join(self.repo, '.git'), git_dir)
+        with open(os.path.join(self.repo, '.git'), 'w') as f:
+            f.write('gitdir: ../modules/repo\n')
+        self.git('config', 'core.worktree', self.repo)
+        self.assertEqual(find_git_dir(self.repo), git_dir)
+        self.assert_matches_git()
+
+    def test_unsupported_layouts(self):
+        self.git('config', 'url.https://example.com/.insteadOf', 'ex:')
+        with self.assertRaises(UnsupportedGitLayout):
+            read_git_metadata(self.repo)
+
+    def test_non_utf8_config(self):
+        with open(os.path.join(self.repo, '.git', 'config'), 'ab') as f:
+            f.write(b'[user]\n\tname = J\xf6rg\n')
+        with self.assertRaises(UnsupportedGitLayout):
+            read_git_metadata(self.repo)
+
+    def test_unborn_branch(self):
+        self.git('checkout', '-q', '--orphan', 'empty')
+        with self.assertRaises(UnsupportedGitLayout):
+            read_git_metadata(self.repo)
+
+    def test_vcs_from_path(self):
+        self.git('remote', 'add', 'origin', 'https://example.com/x.git')
+        vcs = VCS.from_path(self.repo)
+        self.assertEqual(vcs.vcs_type, 'git')
+        self.assertEqual(vcs.rev, self.git('rev-parse', 'HEAD'))
+        self.assertEqual(vcs.branch, 'main')
+        self.assertEqual(vcs.remote_url, 'https://example.com/x.git')
+
+
+class VCSResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.repo = os.path.join(self.tmp, 'repo')
+        for path in ['a/b/c', 'a/b/d', 'e']:
+            os.makedirs(os.path.join(self.repo, path))
+        os.mkdir(os.path.join(self.repo, '.hg'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_find_root(self):
+        resolver = VCSResolver()
+        self.assertEqual(
+            resolver.find_root(os.path.join(self.repo, 'a', 'b', 'c')),
+            self.repo)
+        self.assertEqual(resolver.find_root(self.repo), self.repo)
+        self.assertIsNone(resolver.find_root(self.tmp))
+
+    def test_find_root_memoized(self):
+        resolver = VCSResolver()
+        resolver.find_root(os.path.join(self.repo, 'a', 'b', 'c'))
+        os.rmdir(os.path.join(self.repo, '.hg'))
+        # The ancestors have already been resolved.
+        self.assertEqual(
+            resolver.find_root(os.path.join(self.repo, 'a', 'b', 'd')),
+            self.repo)
+        self.assertIsNone(VCSResolver().find_root(self.repo))
+
+    def test_get_vcs_errors(self):
+        resolver = VCSResolver()
+        from_path = VCS.__dict__['from_path']
+
+        def fail(cls, path):
+            raise error
+        VCS.from_path = classmethod(fail)
+        try:
+            error = OSError('no such command')
+            with self.assertRaises(VCSError):
+                resolver.get_vcs(self.repo)
+            # Bugs are not turned into VCSErrors, nor remembered.
+            error = AttributeError('bug')
+            with self.assertRaises(AttributeError):
+                resolver.get_vcs(os.path.join(self.repo, 'e'))
+            with self.assertRaises(AttributeError):
+                resolver.get_vcs(os.path.join(self.repo, 'e'))
+        finally:
+            VCS.from_path = from_path
+
+    @unittest.skipIf(not GIT, 'git not available')
+    def test_components_share_vcs(self):
+        os.rmdir(os.path.join(self.repo, '.hg'))
+        subprocess.check_call([GIT, 'init', '-q'], cwd=self.repo)
+        subprocess.check_call(
+            [GIT, '-c', 'user.name=Test', '-c', 'user.email=test@example.com',
+             'commit', '-q', '--allow-empty', '-m', 'first'],
+            cwd=self.repo)
+
+        resolver = VCSResolver()
+        components = [
+            Component.from_spec(
+                {'path': os.path.join(self.repo, path), 'name': None,
+                 'version': None, 'vcs': None, 'branch': None, 'rev': None,
+                 'remote_url': None},
+                vcs_resolver=resolver)
+            for path in ['a/b/c', 'e']
+        ]
+        self.assertEqual(components[0].vcs.vcs_type, 'git')
+        self.assertIs(components[0].vcs, components[1].vcs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import shlex
+import pstats
+import shutil
+import tempfile
+
+from opbeatcli import profiling
+from opbeatcli.core import main, EXIT_SUCCESS
+from standin_server import StandInServer
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+FIXTURE = os.path.join(FIXTURES, 'dpkg_query.txt')
+
+# Keeps a child process busy for a moment.
+BUSY_COMMAND = ('i=0; while [ $i -lt 100000 ]; do i=$((i+1)); done;'
+                ' echo acpid 1.0')
+
+
+class ProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.addCleanup(profiling.stop)
+
+    def deploy(self, server, args):
+        return main(shlex.split(
+            '-t token -o org -a app -s {url} --retries 0 {args}'
+            ' deployment --no-auto-collect-dependencies'
+            ' --collect-dependencies deb:"cat {fixture}"'
+            .format(url=server.url, args=args, fixture=FIXTURE)
+        ))
+
+    def get_phases(self, server, args=''):
+        path = os.path.join(self.tmp, 'profile.json')
+        self.assertEqual(
+            self.deploy(server, '--profile-json %s %s' % (path, args)),
+            EXIT_SUCCESS)
+        with open(path) as f:
+            return json.load(f)['phases']
+
+    def test_phases(self):
+        with StandInServer() as server:
+            phases = self.get_phases(server)
+        self.assertEqual(sorted(phase['name'] for phase in phases),
+                         ['deployment', 'parse arguments'])
+        [deployment] = [phase for phase in phases
+                        if phase['name'] == 'deployment']
+
+        # {name: path} of all the phases.
+        paths = {}
+
+        def check(phases, path):
+            walls = [phase['wall'] for phase in phases]
+            self.assertEqual(walls, sorted(walls, reverse=True))
+            for phase in phases:
+                self.assertEqual(phase['count'], 1)
+                self.assertGreaterEqual(phase['cpu'], 0)
+                paths[phase['name']] = path + [phase['name']]
+                check(phase['phases'], paths[phase['name']])
+                # Nested phases are included in the outer one.
+                self.assertLessEqual(
+                    sum(nested['wall'] for nested in phase['phases']),
+                    phase['wall'])
+
+        check(phases, [])
+        collect = 'collect DebCollector: cat ' + FIXTURE
+        self.assertEqual(paths['packages from arguments'],
+                         ['deployment', 'packages from arguments'])
+        self.assertEqual(paths['run DebCollector: cat ' + FIXTURE],
+                         ['deployment', collect,
+                          'run DebCollector: cat ' + FIXTURE])
+        self.assertEqual(paths['serialize'], ['deployment', 'serialize'])
+        self.assertEqual(paths['encode'], ['deployment', 'post', 'encode'])
+        self.assertEqual(paths['send'], ['deployment', 'post', 'send'])
+
+    def test_iterate_excludes_consumer(self):
+        def produce():
+            for i in range(3):
+                time.sleep(0.01)
+                yield i
+
+        profiler = profiling.start(trace_memory=False)
+        with profiling.phase('outer'):
+            for _ in profiling.iterate('produce', produce()):
+                time.sleep(0.05)
+        profiling.stop()
+        [outer, produced] = profiler.get_phases()
+        self.assertEqual(produced.path, ('outer', 'produce'))
+        self.assertEqual(produced.count, 1)
+        self.assertGreaterEqual(produced.wall, 0.03)
+        self.assertLess(produced.wall, 0.15)
+        self.assertGreaterEqual(outer.wall, 0.18)
+
+    def test_children_cpu_time(self):
+        profiler = profiling.start(trace_memory=False)
+        with profiling.phase('busy'):
+            os.system(BUSY_COMMAND + ' > /dev/null')
+        profiling.stop()
+        [busy] = profiler.get_phases()
+        self.assertGreater(busy.children_cpu, 0)
+        self.assertIsNone(busy.memory_peak)
+
+    @unittest.skipIf(profiling.get_tracemalloc() is None,
+                     'tracemalloc cannot measure phases')
+    def test_memory_peak(self):
+        profiler = profiling.start()
+        with profiling.phase('outer'):
+            with profiling.phase('inner'):
+                data = bytearray(4 * 1024 * 1024)
+                del data
+            with profiling.phase('small'):
+                pass
+        profiling.stop()
+        phases = dict((phase.name, phase) for phase in profiler.get_phases())
+        self.assertGreaterEqual(phases['inner'].memory_peak, 4 * 10 ** 6)
+        self.assertGreaterEqual(phases['outer'].memory_peak, 4 * 10 ** 6)
+        self.assertLess(phases['small'].memory_peak, 1024 * 1024)
+
+    def test_table_and_stats(self):
+        stats_path = os.path.join(self.tmp, 'profile.stats')
+        stderr = sys.stderr
+        output = tempfile.TemporaryFile(mode='w+')
+        self.addCleanup(output.close)
+        sys.stderr = output
+        try:
+            with StandInServer() as server:
+                self.deploy(server, '--profile-stats %s' % stats_path)
+        finally:
+            sys.stderr = stderr
+        output.seek(0)
+        lines = output.read().splitlines()
+        self.assertEqual(lines[0].split(),
+                         ['phase', 'count', 'wall', 'cpu', 'children',
+                          'memory'])
+        self.assertEqual(lines[1].split()[0], 'deployment')
+        self.assertTrue(any(line.startswith('  collect DebCollector: ')
+                            for line in lines))
+        self.assertGreater(pstats.Stats(stats_path).total_calls, 0)
+
+    def test_not_profiling(self):
+        self.assertIs(profiling.phase('name'), profiling.phase('other'))
+        self.assertIsNone(profiling.stop())
+
+
+class TraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.addCleanup(profiling.stop_tracing)
+
+    def test_trace(self):
+        path = os.path.join(self.tmp, 'trace.json')
+        npm_fixture = os.path.join(FIXTURES, 'npm_list.json')
+        with StandInServer() as server:
+            self.assertEqual(main(shlex.split(
+                '-t token -o org -a app -s {url} --retries 0 --trace {path}'
+                ' deployment --component path:{repo}'
+                ' --no-auto-collect-dependencies --collect-jobs 2'
+                ' --collect-dependencies deb:"cat {fixture}"'
+                ' nodejs:"cat {npm_fixture}"'
+                .format(url=server.url, path=path, fixture=FIXTURE,
+                        npm_fixture=npm_fixture,
+                        repo=os.path.dirname(FIXTURES))
+            )), EXIT_SUCCESS)
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+
+        spans = [event for event in events if event['ph'] == 'X']
+        names = [span['name'] for span in spans]
+        for name in ['parse arguments',
+                     'deployment',
+                     'packages from arguments',
+                     'run DebCollector: cat ' + FIXTURE,
+                     'run NodeCollector: cat ' + npm_fixture,
+                     'parse NodeCollector: cat ' + npm_fixture,
+                     'serialize',
+                     'post']:
+            self.assertIn(name, names)
+        self.assertEqual(
+            len([name for name in names if name.startswith('vcs ')]), 1)
+        for span in spans:
+            self.assertGreaterEqual(span['ts'], 0)
+            self.assertGreaterEqual(span['dur'], 0)
+
+        # The collectors ran in their own threads, which are all named.
+        thread_ids = set(span['tid'] for span in spans)
+        self.assertGreater(len(thread_ids), 1)
+        self.assertEqual(
+            set(event['tid'] for event in events
+                if event['ph'] == 'M' and event['name'] == 'thread_name'),
+            thread_ids)
+
+    def test_iterate_spans(self):
+        def produce():
+            for i in range(3):
+                time.sleep(0.01)
+                yield i
+
+        tracer = profiling.start_tracing()
+        for _ in profiling.iterate('produce', produce()):
+            time.sleep(0.05)
+        for _ in profiling.iterate('cached', range(1000)):
+            pass
+        profiling.stop_tracing()
+
+        spans = [event for event in tracer.events if event['ph'] == 'X']
+        produced = [span for span in spans if span['name'] == 'produce']
+        self.assertEqual(len(produced), 3)
+        for span in produced:
+            self.assertGreaterEqual(span['dur'], 0.01 * 1e6)
+            self.assertLess(span['dur'], 0.05 * 1e6)
+        for span, next_span in zip(produced, produced[1:]):
+            self.assertGreaterEqual(next_span['ts'] - span['ts'] - span['dur'],
+                                    0.05 * 1e6)
+        self.assertLess(
+            len([span for span in spans if span['name'] == 'cached']), 100)
@@ -0,0 +1,151 @@
+import os
+import json
+import shlex
+import shutil
+import tempfile
+
+from opbeatcli.core import main, EXIT_SUCCESS, EXIT_SERVER_ERROR
+from opbeatcli.spool import Spool
+from standin_server import StandInServer
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir)
+
+    def run_command(self, server_url, args):
+        return main(shlex.split(
+            '-t token -o org -a app -s {url} --retries 0 {args}'
+            .format(url=server_url, args=args)
+        ))
+
+    def deploy(self, server_url, version='1', args=''):
+        return self.run_command(
+            server_url,
+            'deployment --no-auto-collect-dependencies'
+            ' --dependency type:other name:a version:{version}'
+            ' --spool-dir {spool_dir} {args}'
+            .format(version=version, spool_dir=self.spool_dir, args=args)
+        )
+
+    def flush(self, server_url, args=''):
+        return self.run_command(
+            server_url,
+            'flush --spool-dir {spool_dir} {args}'
+            .format(spool_dir=self.spool_dir, args=args)
+        )
+
+    def get_versions(self, server):
+        return [json.loads(body.decode('utf8'))['releases'][0]['version']
+                for path, headers, body in server.requests]
+
+    def get_spooled(self):
+        return sorted(os.listdir(self.spool_dir))
+
+    def test_spool_when_unreachable(self):
+        with StandInServer() as server:
+            url = server.url
+        self.assertEqual(self.deploy(url), EXIT_SUCCESS)
+        self.assertEqual(len(self.get_spooled()), 1)
+
+        with StandInServer() as server:
+            self.assertEqual(self.flush(server.url), EXIT_SUCCESS)
+        self.assertEqual(self.get_spooled(), [])
+        [(path, headers, body)] = server.requests
+        self.assertEqual(
+            path, '/api/v1/organizations/org/apps/app/deployments/')
+        self.assertEqual(self.get_versions(server), ['1'])
+
+    def test_defer_and_flush_in_order(self):
+        with StandInServer() as server:
+            for version in ['1', '2', '3']:
+                self.assertEqual(self.deploy(server.url, version, '--defer'),
+                                 EXIT_SUCCESS)
+            self.assertEqual(server.requests, [])
+            self.assertEqual(len(self.get_spooled()), 3)
+
+            self.assertEqual(self.flush(server.url), EXIT_SUCCESS)
+        self.assertEqual(self.get_versions(server), ['1', '2', '3'])
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(self.get_spooled(), [])
+
+    def test_flush_concurrently(self):
+        with StandInServer() as server:
+            for version in ['1', '2', '3', '4', '5']:
+                self.deploy(server.url, version, '--defer')
+            self.assertEqual(self.flush(server.url, '--jobs 2'),
+                             EXIT_SUCCESS)
+        self.assertEqual(sorted(self.get_versions(server)),
+                         ['1', '2', '3', '4', '5'])
+        self.assertEqual(self.get_spooled(), [])
+
+    def test_flush_keeps_requests_when_unreachable(self):
+        with StandInServer() as server:
+            for version in ['1', '2']:
+                self.deploy(server.url, version, '--defer')
+            url = server.url
+        self.assertNotEqual(self.flush(url), EXIT_SUCCESS)
+        self.assertEqual(len(self.get_spooled()), 2)
+
+    def test_flush_stops_when_server_overloaded(self):
+        with StandInServer(statuses=[503]) as server:
+            for version in ['1', '2', '3']:
+                self.deploy(server.url, version, '--defer')
+            self.assertEqual(self.flush(server.url), EXIT_SERVER_ERROR)
+        self.assertEqual(self.get_versions(server), ['1'])
+        self.assertEqual(len(self.get_spooled()), 3)
+
+    def test_flushed_concurrently(self):
+        spool = Spool(self.spool_dir)
+        spool.put('/', {}, {}, 'key')
+        [request] = spool.iter_requests()
+        request.remove()
+        # E.g., by another flush.
+        request.remove()
+        request.reject()
+        self.assertEqual(self.get_spooled(), [])
+
+    def test_rejected_requests_are_kept_aside(self):
+        with StandInServer(statuses=[403]) as server:
+            self.deploy(server.url, '1', '--defer')
+            self.assertEqual(self.flush(server.url), EXIT_SERVER_ERROR)
+            self.assertEqual(self.flush(server.url), EXIT_SUCCESS)
+        self.assertEqual(len(server.requests), 1)
+        [name] = self.get_spooled()
+        self.assertTrue(name.endswith('.rejected'))
+
+    def test_defer_requires_spool_dir(self):
+        with self.assertRaises(SystemExit):
+            main(shlex.split('-t token -o org -a app deployment'
+                             ' --no-auto-collect-dependencies --defer'))
+
+    def test_limits(self):
+        now = [1000000.0]
+        spool = Spool(self.spool_dir, max_age=150, max_size=10 ** 6,
+                      clock=lambda: now[0])
+        for i in range(3):
+            spool.put('/', {'i': i}, {}, 'key')
+            now[0] += 60
+        # The first one is 180s old by now.
+        self.assertEqual([request.data['i']
+                          for request in spool.iter_requests()], [1, 2])
+
+        spool.max_size = os.path.getsize(spool.get_paths()[-1])
+        self.assertEqual([request.data['i']
+                          for request in spool.iter_requests()], [2])
+
+    def test_requests_loaded_lazily(self):
+        spool = Spool(self.spool_dir)
+        paths = [spool.put('/', {'i': i}, {}, 'key') for i in range(3)]
+        requests = spool.iter_requests()
+        self.assertEqual(next(requests).data, {'i': 0})
+        # Flushed concurrently after the spool was listed.
+        os.remove(paths[1])
+        self.assertEqual([request.data for request in requests], [{'i': 2}])